@@ -3,13 +3,25 @@ vLLM服务模块
 包含服务器、客户端和管理器的实现
 """
 
+from .engines import BaseEngine, VLLMEngine, FakeEngine, create_engine
 from .vllm_server import VLLMServer
 from .vllm_client import VLLMClient, VLLMClientManager
 from .server_manager import ServerManager
+from .gateway import Gateway
+from .autoscaler import Autoscaler
+from .placement import PlacementPlanner, PlacementError
 
 __all__ = [
+    'BaseEngine',
+    'VLLMEngine',
+    'FakeEngine',
+    'create_engine',
     'VLLMServer',
     'VLLMClient', 
     'VLLMClientManager',
-    'ServerManager'
+    'ServerManager',
+    'Gateway',
+    'Autoscaler',
+    'PlacementPlanner',
+    'PlacementError'
 ] 
\ No newline at end of file
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Autoscaler - 按负载在ServerManager之上启停模型服务器
+
+每个周期读取运行中服务器的负载（/health的in_flight和waiting，/metrics的请求数推算QPS）
+以及网关记录的无副本可用的请求数，为每个模型计算所需副本数，在配置的最小/最大副本数之间
+启动或停止服务器。GPU条目的devices相交时共用设备，能否同时运行由放置规划器按显存利用率判断：
+繁忙模型没有放得下的副本时，按空闲时间从长到短驱逐空闲模型的服务器，直到放得下为止。
+
+设备清单和模型大小由管理器缓存，step()在调用plan()之前读取它们；plan()本身只依赖传入的负载、
+自身的冷却状态和这些缓存，不做IO，可以用构造的负载和设备清单验证扩缩容决策。
+"""
+
+import asyncio
+import argparse
+import logging
+import math
+import signal
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+import aiohttp
+
+from ..utils.config import Config
+from .placement import PlacementError
+from .server_manager import ServerManager
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+@dataclass
+class ModelPolicy:
+    """单个模型的扩缩容策略"""
+    min_replicas: int
+    max_replicas: int
+    # 每个副本的目标负载（in_flight + waiting）
+    target_load: float = 8.0
+    # 多久没有请求后可以缩容到0或被驱逐（秒）
+    idle_timeout: float = 600.0
+
+@dataclass
+class ServerLoad:
+    """单个服务器的负载信号"""
+    in_flight: int = 0
+    waiting: int = 0
+    qps: float = 0.0
+
+    @property
+    def load(self) -> int:
+        return self.in_flight + self.waiting
+
+@dataclass
+class ScalingAction:
+    """一次扩缩容动作"""
+    action: str  # "start"或"stop"
+    gpu_id: str
+    model: str
+    reason: str
+
+class Autoscaler:
+    """模型服务器的自动扩缩容控制器
+
+    配置取自"autoscaler"部分，"models"按模型名称或别名给出min_replicas、max_replicas、
+    target_load和idle_timeout；未列出的模型固定运行所有副本，与不启用自动扩缩容时相同。
+    配置重新加载后按新的GPU条目重建副本策略，周期和冷却时间只在创建时读取。
+    """
+
+    def __init__(self, manager: ServerManager):
+        self.manager = manager
+
+        autoscaler_config = self.config.config.get("autoscaler", {})
+        self.interval = autoscaler_config.get("interval", 15.0)
+        self.scale_up_cooldown = autoscaler_config.get("scale_up_cooldown", 60.0)
+        self.scale_down_cooldown = autoscaler_config.get("scale_down_cooldown", 300.0)
+        self.gateway_url = autoscaler_config.get("gateway_url")
+        self.policies = self._build_policies(self.config)
+        self.manager.config_store.subscribe(self._apply_config)
+
+        # 每个模型最近一次扩缩容和最近一次有请求的时刻
+        self.last_scaled: Dict[str, float] = {}
+        self.last_active: Dict[str, float] = {}
+        # 推算QPS和网关需求用的上一次计数
+        self._request_counts: Dict[str, tuple] = {}
+        self._unserved_counts: Dict[str, int] = {}
+
+    @property
+    def config(self) -> Config:
+        """管理器当前使用的配置快照"""
+        return self.manager.config
+
+    @staticmethod
+    def _build_policies(config: Config) -> Dict[str, ModelPolicy]:
+        policies: Dict[str, ModelPolicy] = {}
+        for name in config.get_model_names():
+            replicas = len(config.get_replicas(name))
+            policies[name] = ModelPolicy(min_replicas=replicas, max_replicas=replicas)
+        for model, options in config.config.get("autoscaler", {}).get("models", {}).items():
+            name = config.resolve_model(model)
+            if name is None:
+                raise ValueError(f"自动扩缩容配置了未知的模型: {model}")
+            replicas = len(config.get_replicas(name))
+            policy = ModelPolicy(
+                min_replicas=options.get("min_replicas", 1),
+                max_replicas=min(options.get("max_replicas", replicas), replicas),
+                target_load=options.get("target_load", 8.0),
+                idle_timeout=options.get("idle_timeout", 600.0)
+            )
+            if not 0 <= policy.min_replicas <= policy.max_replicas:
+                raise ValueError(f"模型 {model} 的副本数范围无效: {policy.min_replicas}-{policy.max_replicas}")
+            policies[name] = policy
+        return policies
+
+    def _apply_config(self, old: Config, new: Config):
+        """配置重新加载后重建副本策略，新配置无效时保留原策略"""
+        try:
+            self.policies = self._build_policies(new)
+        except ValueError as e:
+            logger.error(f"自动扩缩容配置无效，保留原策略: {e}")
+
+    def _fits(self, gpu_ids: Set[str]) -> bool:
+        """gpu_ids中的服务器能否同时放在各自的设备上"""
+        try:
+            self.manager.planner.check([self.manager.placement_spec(gpu_id) for gpu_id in sorted(gpu_ids)])
+        except PlacementError:
+            return False
+        return True
+
+    def observe(self, running: Set[str], loads: Dict[str, ServerLoad], demand: Dict[str, int], now: float):
+        """根据本周期的负载更新每个模型最近有请求的时刻"""
+        for model in self.policies:
+            self.last_active.setdefault(model, now)
+            replicas = [gpu_id for gpu_id in self.config.get_replicas(model) if gpu_id in running]
+            if demand.get(model) or any(
+                loads[gpu_id].load or loads[gpu_id].qps for gpu_id in replicas if gpu_id in loads
+            ):
+                self.last_active[model] = now
+
+    def _desired_replicas(self, model: str, active: List[str], loads: Dict[str, ServerLoad],
+                          demand: Dict[str, int]) -> int:
+        policy = self.policies[model]
+        total_load = sum(loads[gpu_id].load for gpu_id in active if gpu_id in loads)
+        desired = math.ceil(total_load / policy.target_load)
+        if demand.get(model):
+            desired = max(desired, 1)
+        return max(policy.min_replicas, min(desired, policy.max_replicas))
+
+    def _idle(self, model: str, now: float) -> bool:
+        return now - self.last_active.get(model, now) >= self.policies[model].idle_timeout
+
+    def plan(self, running: Set[str], loads: Dict[str, ServerLoad], demand: Dict[str, int],
+             now: float) -> List[ScalingAction]:
+        """计算本周期的扩缩容动作
+
+        running是应运行的服务器（包括仍在加载的），loads是它们的负载，demand是每个模型
+        本周期因没有可用副本而无法服务的请求数。负载最高的模型先分配空闲设备。
+        """
+        running = set(running)
+        actions: List[ScalingAction] = []
+
+        def active_replicas(model: str) -> List[str]:
+            return [gpu_id for gpu_id in self.config.get_replicas(model) if gpu_id in running]
+
+        def pressure(model: str) -> float:
+            active = active_replicas(model)
+            total_load = sum(loads[gpu_id].load for gpu_id in active if gpu_id in loads)
+            return (total_load + demand.get(model, 0)) / max(len(active), 1) / self.policies[model].target_load
+
+        for model in sorted(self.policies, key=pressure, reverse=True):
+            policy = self.policies[model]
+            active = active_replicas(model)
+            desired = self._desired_replicas(model, active, loads, demand)
+            since_scaled = now - self.last_scaled.get(model, float("-inf"))
+
+            if len(active) < desired:
+                # 低于最小副本数时不受冷却限制
+                if len(active) >= policy.min_replicas and since_scaled < self.scale_up_cooldown:
+                    continue
+                if len(active) < policy.min_replicas:
+                    reason = "低于最小副本数"
+                elif not active:
+                    reason = "网关有无法服务的请求"
+                else:
+                    reason = "负载超过目标"
+                for _ in range(desired - len(active)):
+                    started = self._plan_start(model, reason, running, now, actions)
+                    if not started:
+                        logger.warning(f"模型 {model} 需要{desired}个副本，但没有可用的设备")
+                        break
+
+            elif len(active) > desired and since_scaled >= self.scale_down_cooldown:
+                if desired == 0 and not self._idle(model, now):
+                    continue
+                # 每个周期最多缩容一个副本，停掉负载最低的
+                victim = min(active, key=lambda gpu_id: loads[gpu_id].load if gpu_id in loads else 0)
+                actions.append(ScalingAction("stop", victim, model, f"负载低于目标，副本数 {len(active)} -> {len(active) - 1}"))
+                running.discard(victim)
+
+        return actions
+
+    def _plan_start(self, model: str, reason: str, running: Set[str], now: float,
+                    actions: List[ScalingAction]) -> bool:
+        """为model选择一个可以启动的副本，必要时驱逐空闲模型的服务器；成功时追加动作并更新running"""
+        stopped = [gpu_id for gpu_id in self.config.get_replicas(model) if gpu_id not in running]
+
+        def devices_of(gpu_id: str) -> Optional[List[str]]:
+            return self.manager.placement_spec(gpu_id).devices
+
+        def model_of(gpu_id: str) -> str:
+            return self.config.resolve_model(self.config.get_model_name(gpu_id))
+
+        for gpu_id in stopped:
+            if self._fits(running | {gpu_id}):
+                actions.append(ScalingAction("start", gpu_id, model, reason))
+                running.add(gpu_id)
+                return True
+
+        # 没有空闲设备：按空闲时间从长到短驱逐空闲模型的服务器，放得下即停止，驱逐后不低于最小副本数
+        for gpu_id in stopped:
+            # 未固定设备的副本可以放到任何设备上，所有运行中的服务器都可能占着它需要的设备
+            devices = devices_of(gpu_id)
+            blockers = sorted(
+                (other for other in running
+                 if devices is None or devices_of(other) is None or set(devices).intersection(devices_of(other))),
+                key=lambda other: (self.last_active.get(model_of(other), now), other)
+            )
+            remaining = set(running)
+            evicted: List[str] = []
+            for other in blockers:
+                if not self._evictable(other, model, remaining, now):
+                    continue
+                remaining.discard(other)
+                evicted.append(other)
+                if self._fits(remaining | {gpu_id}):
+                    break
+            else:
+                continue
+
+            for other in evicted:
+                actions.append(ScalingAction("stop", other, model_of(other), f"驱逐空闲模型，为 {model} 腾出设备"))
+                running.discard(other)
+            actions.append(ScalingAction("start", gpu_id, model, f"{reason}，使用驱逐腾出的设备"))
+            running.add(gpu_id)
+            return True
+        return False
+
+    def _evictable(self, gpu_id: str, for_model: str, running: Set[str], now: float) -> bool:
+        model = self.config.resolve_model(self.config.get_model_name(gpu_id))
+        if model == for_model or not self._idle(model, now):
+            return False
+        active = [other for other in self.config.get_replicas(model) if other in running]
+        return len(active) - 1 >= self.policies[model].min_replicas
+
+    async def _fetch_load(self, session: aiohttp.ClientSession, gpu_id: str, now: float) -> Optional[ServerLoad]:
+        """读取一个服务器的/health和/metrics，不可达时返回None"""
+        url = self.manager.get_server_url(gpu_id)
+        try:
+            async with session.get(f"{url}/health") as response:
+                health = await response.json()
+            async with session.get(f"{url}/metrics") as response:
+                metrics = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return None
+
+        requests = 0.0
+        for line in metrics.splitlines():
+            if line.startswith("vllm_requests_total"):
+                requests = float(line.rsplit(" ", 1)[1])
+                break
+        previous = self._request_counts.get(gpu_id)
+        self._request_counts[gpu_id] = (requests, now)
+        qps = 0.0
+        if previous and now > previous[1] and requests >= previous[0]:
+            qps = (requests - previous[0]) / (now - previous[1])
+
+        return ServerLoad(in_flight=health.get("in_flight", 0), waiting=health.get("waiting", 0), qps=qps)
+
+    async def _fetch_demand(self, session: aiohttp.ClientSession) -> Dict[str, int]:
+        """读取网关记录的无副本可用的请求数，返回本周期的增量"""
+        if not self.gateway_url:
+            return {}
+        try:
+            async with session.get(f"{self.gateway_url}/health") as response:
+                unserved = (await response.json()).get("unserved", {})
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return {}
+
+        demand = {}
+        for model, count in unserved.items():
+            demand[model] = max(count - self._unserved_counts.get(model, 0), 0)
+            self._unserved_counts[model] = count
+        return demand
+
+    async def collect(self, now: float):
+        """并发读取所有应运行服务器的负载和网关需求"""
+        running = sorted(self.manager.desired)
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.manager.probe_timeout)) as session:
+            results = await asyncio.gather(
+                self._fetch_demand(session),
+                *(self._fetch_load(session, gpu_id, now) for gpu_id in running)
+            )
+        loads = {gpu_id: load for gpu_id, load in zip(running, results[1:]) if load is not None}
+        return loads, results[0]
+
+    async def apply(self, actions: List[ScalingAction], now: float):
+        """先排空并停止，再启动并等待就绪；同一周期内的动作并发执行"""
+        for action in actions:
+            logger.info(f"{action.action} GPU {action.gpu_id} ({action.model}): {action.reason}")
+            self.last_scaled[action.model] = now
+
+        async def stop(gpu_id: str):
+            await self.manager.drain_server(gpu_id)
+            await self.manager.stop_server_async(gpu_id)
+
+        async def start(gpu_id: str):
+            # 周期之间配置可能重新加载过、清空了放置缓存，先在线程中重新读取，不在事件循环上调用nvidia-smi
+            await self.manager.load_placement()
+            if self.manager.start_server(gpu_id):
+                await self.manager.wait_until_ready(gpu_id)
+
+        await asyncio.gather(*(stop(action.gpu_id) for action in actions if action.action == "stop"))
+        await asyncio.gather(*(start(action.gpu_id) for action in actions if action.action == "start"))
+
+    async def step(self) -> List[ScalingAction]:
+        """执行一个扩缩容周期"""
+        now = time.monotonic()
+        loads, demand = await self.collect(now)
+        running = set(self.manager.desired)
+        await self.manager.load_placement()
+        self.observe(running, loads, demand, now)
+        actions = self.plan(running, loads, demand, now)
+        if actions:
+            await self.apply(actions, now)
+        return actions
+
+    async def run(self):
+        """按固定间隔执行扩缩容周期"""
+        logger.info(f"开始自动扩缩容，周期: {self.interval}秒")
+        while True:
+            try:
+                await self.step()
+            except Exception as e:
+                logger.error(f"自动扩缩容周期出错: {e}")
+            await asyncio.sleep(self.interval)
+
+async def main():
+    parser = argparse.ArgumentParser(description='vLLM服务器自动扩缩容')
+    parser.add_argument('--config',
+                       default="vllm/config/config.json",
+                       help='配置文件路径')
+    parser.add_argument('--monitor-interval',
+                       type=float,
+                       default=30,
+                       help='监督检查间隔（秒）')
+    args = parser.parse_args()
+
+    manager = ServerManager(args.config)
+    autoscaler = Autoscaler(manager)
+
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    # 第一个周期按最小副本数启动服务器，之后由监督器处理崩溃，自动扩缩容调整副本数
+    await autoscaler.step()
+    tasks = [
+        asyncio.create_task(manager.monitor_servers(args.monitor_interval)),
+        asyncio.create_task(autoscaler.run())
+    ]
+    try:
+        await stopping.wait()
+    finally:
+        logger.info("正在停止自动扩缩容...")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        manager.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
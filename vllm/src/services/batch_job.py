@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Batch Job - 离线JSONL批量推理任务
+
+从输入JSONL流式读取prompt，通过VLLMClient.generate_many并发分发到各vLLM服务器，
+结果逐行追加到输出JSONL，并定期写入检查点。中断或崩溃后重新运行同一命令即可续跑，
+已完成的行不会重新生成。
+
+输入每行可以是JSON字符串（即prompt），也可以是对象：
+    {"id": "q1", "prompt": "...", "max_tokens": 128, "temperature": 0}
+输出每行对应一个输入行：
+    {"index": 0, "id": "q1", "text": "...", "finish_reason": "length", "gpu_id": "0", ...}
+失败的行带有"error"字段。因服务器暂时不可用（没有健康的服务器、429、503、超时）而失败的行
+不写入输出，也不计为完成，重新运行同一命令时会重试它们。
+"""
+
+import asyncio
+import argparse
+import json
+import logging
+import os
+import signal
+import time
+from typing import Dict, List, Optional, Any, Iterator, Set
+
+from . import vllm_client
+from .vllm_client import VLLMClient, GENERATION_PARAMS
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class BatchJob:
+    """可续跑的离线批量推理任务
+
+    输入行的编号只计非空行。检查点记录一个"水位"：编号小于next_index的行都已完成，
+    input_offset是第next_index行在输入文件中的字节偏移；水位之上已完成的行编号
+    记在done中，output_size是写检查点时输出文件的长度。续跑时从input_offset继续读，
+    并扫描output_size之后追加的输出行，跳过所有已完成的行。
+    """
+
+    def __init__(
+        self,
+        input_path: str,
+        output_path: str,
+        config_path: str = "vllm/config/config.json",
+        checkpoint_path: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        model: Optional[str] = None,
+        model_preference: Optional[List[str]] = None,
+        checkpoint_interval: float = 10.0,
+        progress_interval: float = 5.0,
+        **sampling
+    ):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.config_path = config_path
+        self.checkpoint_path = checkpoint_path or f"{output_path}.ckpt"
+        self.concurrency = concurrency
+        self.model = model
+        self.model_preference = model_preference
+        self.checkpoint_interval = checkpoint_interval
+        self.progress_interval = progress_interval
+        self.sampling = sampling
+
+        # 水位和水位之上的完成情况
+        self.next_index = 0
+        self.done: Set[int] = set()
+        # 已读取但仍在水位之上的行：编号 -> 行首字节偏移
+        self._offsets: Dict[int, int] = {}
+        # 下一个要读取的行的编号和字节偏移
+        self._next_row = 0
+        self._read_offset = 0
+        self._output = None
+
+        # 进度统计
+        self.total_rows: Optional[int] = None
+        self.completed_before = 0
+        self.completed = 0
+        self.failed = 0
+        # 暂时失败、留给下次运行重试的行数
+        self.deferred = 0
+        self.completion_tokens = 0
+        self._started_at = 0.0
+        self._last_checkpoint = 0.0
+        self._last_progress = 0.0
+
+    async def run(self, restart: bool = False) -> Dict[str, Any]:
+        """运行任务直到所有行完成，返回统计信息"""
+        if restart:
+            self._reset()
+        else:
+            self._load_checkpoint()
+
+        self.total_rows = self._count_rows()
+        self.completed_before = self.next_index + len(self.done)
+        if self.completed_before >= self.total_rows:
+            logger.info(f"所有 {self.total_rows} 行均已完成: {self.output_path}")
+            return self.summary()
+
+        logger.info(
+            f"开始批量任务: {self.input_path} -> {self.output_path}，"
+            f"共 {self.total_rows} 行，已完成 {self.completed_before} 行"
+        )
+        self._started_at = self._last_checkpoint = self._last_progress = time.monotonic()
+        self._output = open(self.output_path, "ab")
+        try:
+            async with VLLMClient(self.config_path) as client:
+                async for item in client.generate_many(
+                    self._read_rows(),
+                    self.concurrency,
+                    self.model_preference,
+                    self.model,
+                    **self.sampling
+                ):
+                    self._write_result(item)
+                    self._maybe_report()
+        finally:
+            # 正常结束、出错或被中断时都保存检查点
+            self._write_checkpoint()
+            self._output.close()
+            self._output = None
+
+        self._report_progress()
+        logger.info(f"批量任务完成: 成功 {self.completed - self.failed} 行，失败 {self.failed} 行")
+        if self.deferred:
+            logger.warning(f"{self.deferred} 行因服务器暂时不可用而失败，未写入输出，重新运行同一命令即可重试")
+        return self.summary()
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        return {
+            "total_rows": self.total_rows,
+            "completed_before": self.completed_before,
+            "completed": self.completed,
+            "failed": self.failed,
+            "deferred": self.deferred,
+            "completion_tokens": self.completion_tokens,
+            "elapsed": elapsed,
+        }
+
+    def _reset(self):
+        """丢弃之前的输出和检查点，从头开始"""
+        for path in (self.output_path, self.checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load_checkpoint(self):
+        """读取检查点，并找回检查点之后已写入输出的行"""
+        if not os.path.exists(self.checkpoint_path):
+            if os.path.exists(self.output_path) and os.path.getsize(self.output_path) > 0:
+                raise RuntimeError(
+                    f"输出文件 {self.output_path} 已存在但没有检查点，使用--restart重新开始"
+                )
+            return
+
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("input_path") != os.path.abspath(self.input_path):
+            raise RuntimeError(f"检查点属于另一个输入文件: {checkpoint.get('input_path')}")
+
+        self.next_index = self._next_row = checkpoint["next_index"]
+        self._read_offset = checkpoint["input_offset"]
+        self.done = set(checkpoint["done"])
+        self.done.update(self._recover_output(checkpoint["output_size"]))
+        logger.info(f"从检查点恢复: 第 {self.next_index} 行之前均已完成，之后已完成 {len(self.done)} 行")
+
+    def _recover_output(self, output_size: int) -> Set[int]:
+        """扫描检查点之后追加的输出行，截掉崩溃时写了一半的最后一行"""
+        recovered = set()
+        with open(self.output_path, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < output_size:
+                raise RuntimeError(f"输出文件 {self.output_path} 比检查点记录的短，可能已被修改")
+
+            f.seek(output_size)
+            valid_size = output_size
+            for line in iter(f.readline, b""):
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    recovered.add(json.loads(line)["index"])
+                except (ValueError, KeyError, TypeError):
+                    break
+                valid_size += len(line)
+            f.truncate(valid_size)
+        return recovered
+
+    def _write_checkpoint(self):
+        """原子地写入检查点"""
+        self._output.flush()
+        os.fsync(self._output.fileno())
+        checkpoint = {
+            "input_path": os.path.abspath(self.input_path),
+            "next_index": self.next_index,
+            "input_offset": self._offsets.get(self.next_index, self._read_offset),
+            "output_size": self._output.tell(),
+            "done": sorted(self.done),
+        }
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+        self._last_checkpoint = time.monotonic()
+
+    def _count_rows(self) -> int:
+        """流式统计输入的非空行数，用于估计剩余时间"""
+        with open(self.input_path, "rb") as f:
+            return sum(1 for line in f if line.strip())
+
+    def _read_rows(self) -> Iterator[Dict[str, Any]]:
+        """从水位处按需读取输入行，跳过已完成的行，无效的行直接记为失败"""
+        with open(self.input_path, "rb") as f:
+            f.seek(self._read_offset)
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                self._read_offset = f.tell()
+                if not line.strip():
+                    continue
+
+                row_index = self._next_row
+                self._next_row += 1
+                if row_index in self.done:
+                    # 上次运行已完成，读过之后水位才能越过它
+                    self._advance()
+                    continue
+                self._offsets[row_index] = offset
+
+                try:
+                    row = json.loads(line)
+                    if isinstance(row, str):
+                        row = {"prompt": row}
+                    if not isinstance(row, dict) or not isinstance(row.get("prompt"), str):
+                        raise ValueError("缺少字符串类型的prompt字段")
+                except ValueError as e:
+                    self._write_row({"index": row_index, "error": f"无效的输入行: {e}"}, failed=True)
+                    continue
+
+                item = {key: row[key] for key in GENERATION_PARAMS if key in row}
+                item.update(prompt=row["prompt"], index=row_index, id=row.get("id"))
+                yield item
+
+    def _write_result(self, item: Dict[str, Any]):
+        source = item["input"]
+        row = {"index": source["index"]}
+        if source.get("id") is not None:
+            row["id"] = source["id"]
+
+        if item["error"] is not None:
+            if item.get("transient"):
+                # 不写入输出也不标记完成，水位停在这一行，下次运行从这里重试
+                self.deferred += 1
+                return
+            row["error"] = item["error"]
+            self._write_row(row, failed=True)
+            return
+
+        result = item["result"]
+        for key in ("text", "finish_reason", "prompt_tokens", "completion_tokens", "model", "gpu_id"):
+            if key in result:
+                row[key] = result[key]
+        self.completion_tokens += result.get("completion_tokens") or 0
+        self._write_row(row)
+
+    def _write_row(self, row: Dict[str, Any], failed: bool = False):
+        self._output.write(json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.completed += 1
+        if failed:
+            self.failed += 1
+        self._mark_done(row["index"])
+
+    def _mark_done(self, index: int):
+        """记录一行已完成，并尽量推进水位"""
+        self.done.add(index)
+        self._advance()
+
+    def _advance(self):
+        """水位越过所有已读取且已完成的行，保证input_offset始终对应next_index"""
+        while self.next_index < self._next_row and self.next_index in self.done:
+            self.done.discard(self.next_index)
+            self._offsets.pop(self.next_index, None)
+            self.next_index += 1
+
+    def _maybe_report(self):
+        now = time.monotonic()
+        if now - self._last_checkpoint >= self.checkpoint_interval:
+            self._write_checkpoint()
+        if now - self._last_progress >= self.progress_interval:
+            self._report_progress()
+
+    def _report_progress(self):
+        self._last_progress = time.monotonic()
+        elapsed = self._last_progress - self._started_at
+        rate = self.completed / elapsed if elapsed > 0 else 0.0
+        finished = self.completed_before + self.completed
+        remaining = max(self.total_rows - finished, 0)
+        eta = f"{remaining / rate:.0f}秒" if rate > 0 else "未知"
+        logger.info(
+            f"进度 {finished}/{self.total_rows} 行，失败 {self.failed}，暂时失败 {self.deferred}，"
+            f"{rate:.1f} 行/秒，{self.completion_tokens / elapsed if elapsed > 0 else 0.0:.1f} tokens/秒，"
+            f"预计剩余 {eta}"
+        )
+
+async def main():
+    parser = argparse.ArgumentParser(description='vLLM离线批量推理任务')
+    parser.add_argument('--input',
+                       required=True,
+                       help='输入JSONL文件')
+    parser.add_argument('--output',
+                       required=True,
+                       help='输出JSONL文件')
+    parser.add_argument('--config',
+                       default="vllm/config/config.json",
+                       help='配置文件路径')
+    parser.add_argument('--checkpoint',
+                       help='检查点文件路径（默认为输出文件加.ckpt）')
+    parser.add_argument('--restart',
+                       action='store_true',
+                       help='忽略已有的检查点和输出，从头开始')
+    parser.add_argument('--concurrency',
+                       type=int,
+                       help='同时进行的请求数（默认读取client.bulk.concurrency）')
+    parser.add_argument('--model',
+                       help='模型名称或别名')
+    parser.add_argument('--model-preference',
+                       nargs='+',
+                       help='模型偏好列表')
+    parser.add_argument('--max-tokens',
+                       type=int,
+                       default=2048,
+                       help='最大生成token数（输入行可以单独指定）')
+    parser.add_argument('--temperature',
+                       type=float,
+                       default=0.7,
+                       help='生成温度（输入行可以单独指定）')
+    parser.add_argument('--checkpoint-interval',
+                       type=float,
+                       default=10.0,
+                       help='写检查点的间隔（秒）')
+    parser.add_argument('--progress-interval',
+                       type=float,
+                       default=5.0,
+                       help='打印进度的间隔（秒）')
+
+    args = parser.parse_args()
+
+    # 逐条请求的日志会淹没进度输出
+    logging.getLogger(vllm_client.__name__).setLevel(logging.WARNING)
+
+    job = BatchJob(
+        args.input,
+        args.output,
+        config_path=args.config,
+        checkpoint_path=args.checkpoint,
+        concurrency=args.concurrency,
+        model=args.model,
+        model_preference=args.model_preference,
+        checkpoint_interval=args.checkpoint_interval,
+        progress_interval=args.progress_interval,
+        max_tokens=args.max_tokens,
+        temperature=args.temperature
+    )
+    # SIGTERM与Ctrl+C一样取消任务，run()在退出前保存检查点
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    await job.run(restart=args.restart)
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logger.info("任务已中断，重新运行同一命令即可续跑")
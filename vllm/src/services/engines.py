@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+推理引擎后端 - VLLMServer依赖的引擎接口及其实现
+
+- VLLMEngine: 基于vLLM AsyncLLMEngine的GPU引擎
+- FakeEngine: 确定性的CPU假引擎，按配置的prefill延迟和decode速率产出token，
+  用于在没有GPU的机器上测试和压测HTTP、路由和排队开销
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, AsyncIterator, Set, Tuple, Type
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+@dataclass
+class EngineOutput:
+    """引擎的一次增量输出，text为截至目前的完整生成文本"""
+    text: str
+    prompt_tokens: int
+    completion_tokens: int
+    finished: bool = False
+    finish_reason: Optional[str] = None
+
+class BaseEngine(ABC):
+    """推理引擎接口"""
+
+    # get_stats可能报告的统计项，服务器只为这些统计项导出指标
+    reported_stats: Tuple[str, ...] = ()
+
+    @abstractmethod
+    async def start(self):
+        """加载模型并准备好接受请求"""
+
+    @abstractmethod
+    def generate(
+        self,
+        prompt: str,
+        sampling: Dict[str, Any],
+        request_id: str
+    ) -> AsyncIterator[EngineOutput]:
+        """提交一个生成请求，返回增量输出的异步迭代器
+
+        sampling包含max_tokens、temperature、top_p、top_k和stop
+        """
+
+    @abstractmethod
+    async def abort(self, request_id: str):
+        """中止一个尚未完成的请求"""
+
+    def get_stats(self) -> Dict[str, int]:
+        """返回引擎内部的排队状态（running/waiting）和前缀缓存统计
+        （prefix_cache_queries/prefix_cache_hits，按prompt token计），不支持时返回空字典"""
+        return {}
+
+    @staticmethod
+    async def _end_on_abort(
+        results: AsyncIterator[EngineOutput],
+        request_id: str,
+        aborted: Set[str]
+    ) -> AsyncIterator[EngineOutput]:
+        """转发结果流，被abort中止的请求像流正常结束一样返回
+
+        vLLM中止请求时以CancelledError结束结果流，不处理的话中止会被当成任务被取消。
+        服务器按最后一个输出未完成识别中止；当前任务本身被取消时照常传播。
+        """
+        try:
+            async for output in results:
+                yield output
+        except asyncio.CancelledError:
+            task = asyncio.current_task()
+            if request_id not in aborted or (task is not None and task.cancelling()):
+                raise
+        finally:
+            aclose = getattr(results, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+class VLLMEngine(BaseEngine):
+    """基于vLLM AsyncLLMEngine的引擎"""
+
+    reported_stats = ("running", "waiting")
+
+    def __init__(self, gpu_config: Dict[str, Any]):
+        self.gpu_config = gpu_config
+        self.engine = None
+        # 进行中的请求和其中被abort中止的请求
+        self._active = set()
+        self._aborted = set()
+
+    async def start(self):
+        from vllm import AsyncLLMEngine, AsyncEngineArgs
+
+        engine_args = AsyncEngineArgs(
+            model=self.gpu_config["model"],
+            tensor_parallel_size=self.gpu_config["tensor_parallel_size"],
+            gpu_memory_utilization=self.gpu_config["gpu_memory_utilization"],
+            max_model_len=self.gpu_config["max_model_len"],
+            enable_prefix_caching=self.gpu_config.get("enable_prefix_caching", False),
+            device="cuda",
+            worker_use_ray=False
+        )
+
+        self.engine = AsyncLLMEngine.from_engine_args(engine_args)
+
+    async def generate(
+        self,
+        prompt: str,
+        sampling: Dict[str, Any],
+        request_id: str
+    ) -> AsyncIterator[EngineOutput]:
+        from vllm import SamplingParams
+
+        results = self.engine.generate(
+            prompt,
+            sampling_params=SamplingParams(**sampling),
+            request_id=request_id
+        )
+
+        self._active.add(request_id)
+        try:
+            async for request_output in self._end_on_abort(results, request_id, self._aborted):
+                output = request_output.outputs[0]
+                yield EngineOutput(
+                    text=output.text,
+                    prompt_tokens=len(request_output.prompt_token_ids or []),
+                    completion_tokens=len(output.token_ids),
+                    finished=request_output.finished,
+                    finish_reason=output.finish_reason
+                )
+        finally:
+            self._active.discard(request_id)
+            self._aborted.discard(request_id)
+
+    async def abort(self, request_id: str):
+        if request_id in self._active:
+            self._aborted.add(request_id)
+        await self.engine.abort(request_id)
+
+    def get_stats(self) -> Dict[str, int]:
+        """从vLLM V0引擎的调度器读取队列长度，被抢占换出的序列计入waiting
+
+        V1引擎的调度器运行在独立的进程中，此时返回空字典。vLLM只提供前缀缓存命中率，
+        不提供查询和命中计数，因此不报告prefix_cache_*。
+        """
+        schedulers = getattr(getattr(self.engine, "engine", None), "scheduler", None)
+        if schedulers is None:
+            return {}
+        if not isinstance(schedulers, (list, tuple)):
+            schedulers = [schedulers]
+        try:
+            return {
+                "running": sum(len(scheduler.running) for scheduler in schedulers),
+                "waiting": sum(len(scheduler.waiting) + len(getattr(scheduler, "swapped", ()))
+                               for scheduler in schedulers)
+            }
+        except (AttributeError, TypeError):
+            return {}
+
+class FakeEngine(BaseEngine):
+    """确定性CPU假引擎
+
+    配置项（GPU配置中的fake_engine字段）:
+        prefill_delay: 每个请求开始产出token前的固定延迟（秒）
+        prefill_per_token: 每个prompt token额外增加的prefill延迟（秒）
+        decode_rate: 每个序列每秒产出的token数
+        max_concurrency: 同时decode的最大序列数，超出的请求排队等待
+        prefix_cache_blocks: 模拟的KV前缀缓存容量（块数），0表示不缓存；
+            命中缓存的prompt token不计prefill_per_token延迟
+        block_size: 前缀缓存每块的token数
+        abort_raises: 像vLLM一样在请求被中止时以CancelledError结束结果流，默认安静地结束
+    """
+
+    reported_stats = ("running", "waiting", "prefix_cache_queries", "prefix_cache_hits")
+
+    def __init__(self, gpu_config: Dict[str, Any]):
+        options = gpu_config.get("fake_engine", {})
+        self.prefill_delay = options.get("prefill_delay", 0.05)
+        self.prefill_per_token = options.get("prefill_per_token", 0.0)
+        self.decode_rate = options.get("decode_rate", 50)
+        self.max_concurrency = options.get("max_concurrency", 256)
+        self.prefix_cache_blocks = options.get("prefix_cache_blocks", 0)
+        self.block_size = options.get("block_size", 16)
+        self.abort_raises = options.get("abort_raises", False)
+        # 块哈希（包含之前所有token）的LRU
+        self._prefix_cache: "OrderedDict[str, None]" = OrderedDict()
+        self.prefix_cache_queries = 0
+        self.prefix_cache_hits = 0
+        self.running = 0
+        self.waiting = 0
+        self._slots = None
+        self._active = set()
+        self._aborted = set()
+
+    async def start(self):
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+
+    @staticmethod
+    def _token(seed: int, position: int) -> str:
+        """根据prompt种子和位置确定性地生成一个token"""
+        return f" tok{(seed + position * 7919) % 1000}"
+
+    def _cached_prefix_tokens(self, tokens: List[str]) -> int:
+        """像vLLM一样按完整的块查找并插入前缀缓存，返回命中的token数"""
+        if not self.prefix_cache_blocks:
+            return 0
+
+        cached = 0
+        matching = True
+        digest = hashlib.md5()
+        for end in range(self.block_size, len(tokens) + 1, self.block_size):
+            digest.update(" ".join(tokens[end - self.block_size:end]).encode("utf-8"))
+            key = digest.hexdigest()
+            if matching and key in self._prefix_cache:
+                self._prefix_cache.move_to_end(key)
+                cached = end
+                continue
+            matching = False
+            self._prefix_cache[key] = None
+            if len(self._prefix_cache) > self.prefix_cache_blocks:
+                self._prefix_cache.popitem(last=False)
+
+        self.prefix_cache_queries += len(tokens)
+        self.prefix_cache_hits += cached
+        return cached
+
+    async def generate(
+        self,
+        prompt: str,
+        sampling: Dict[str, Any],
+        request_id: str
+    ) -> AsyncIterator[EngineOutput]:
+        self._active.add(request_id)
+        try:
+            results = self._decode(prompt, sampling, request_id)
+            async for output in self._end_on_abort(results, request_id, self._aborted):
+                yield output
+        finally:
+            self._active.discard(request_id)
+            self._aborted.discard(request_id)
+
+    async def _decode(
+        self,
+        prompt: str,
+        sampling: Dict[str, Any],
+        request_id: str
+    ) -> AsyncIterator[EngineOutput]:
+        max_tokens = sampling.get("max_tokens") or 16
+        stop = sampling.get("stop") or []
+        tokens = prompt.split()
+        prompt_tokens = len(tokens)
+        seed = int(hashlib.md5(prompt.encode("utf-8")).hexdigest()[:8], 16)
+
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        try:
+            uncached_tokens = prompt_tokens - self._cached_prefix_tokens(tokens)
+            await asyncio.sleep(self.prefill_delay + self.prefill_per_token * uncached_tokens)
+
+            text = ""
+            interval = 1.0 / self.decode_rate
+            next_emit = time.monotonic()
+            for position in range(max_tokens):
+                if request_id in self._aborted:
+                    if self.abort_raises:
+                        raise asyncio.CancelledError()
+                    break
+
+                next_emit += interval
+                await asyncio.sleep(max(0.0, next_emit - time.monotonic()))
+                text += self._token(seed, position)
+
+                finish_reason = None
+                for stop_str in stop:
+                    if stop_str and stop_str in text:
+                        text = text[:text.index(stop_str)]
+                        finish_reason = "stop"
+                        break
+                if finish_reason is None and position == max_tokens - 1:
+                    finish_reason = "length"
+
+                yield EngineOutput(
+                    text=text,
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=position + 1,
+                    finished=finish_reason is not None,
+                    finish_reason=finish_reason
+                )
+                if finish_reason is not None:
+                    break
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+    async def abort(self, request_id: str):
+        if request_id in self._active:
+            self._aborted.add(request_id)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "prefix_cache_queries": self.prefix_cache_queries,
+            "prefix_cache_hits": self.prefix_cache_hits
+        }
+
+ENGINES = {
+    "vllm": VLLMEngine,
+    "fake": FakeEngine,
+}
+
+def get_engine_class(gpu_config: Dict[str, Any]) -> Type[BaseEngine]:
+    """GPU配置中engine字段对应的引擎类，默认为vllm"""
+    engine_type = gpu_config.get("engine", "vllm")
+    if engine_type not in ENGINES:
+        raise ValueError(f"未知的引擎类型: {engine_type}，可选: {', '.join(ENGINES)}")
+    return ENGINES[engine_type]
+
+def create_engine(gpu_config: Dict[str, Any]) -> BaseEngine:
+    """根据GPU配置中的engine字段创建引擎"""
+    engine_class = get_engine_class(gpu_config)
+    logger.info(f"使用{gpu_config.get('engine', 'vllm')}引擎")
+    return engine_class(gpu_config)
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+vLLM Gateway - 所有GPU服务器的统一入口
+
+网关持有一个长期存在的VLLMClient：上游连接池、后台健康探测、负载感知路由、
+失败重试和熔断都复用客户端的实现。每个后端在网关侧有一个有界队列
+（AdmissionController），限制网关同时发给它的请求数；排队的请求计入该后端的负载，
+所有调用方因此共享同一份全局负载视图。
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, List, AsyncIterator
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, ConfigDict
+import uvicorn
+from .vllm_client import VLLMClient, NoServerAvailable, UpstreamError, GENERATION_PARAMS
+from .vllm_server import GenerateRequest, GenerateResponse, BatchGenerateRequest, BatchItemResult
+from ..utils.config import Config
+from ..utils.metrics import MetricsRegistry
+from ..utils.admission import AdmissionController, AdmissionRejected
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class GatewayGenerateRequest(GenerateRequest):
+    """网关生成请求：在单服务器请求的基础上增加模型选择"""
+    model_config = ConfigDict(protected_namespaces=())
+
+    model: Optional[str] = None
+    model_preference: Optional[List[str]] = None
+
+class GatewayBatchRequest(BatchGenerateRequest):
+    """网关批量请求：各条prompt分别路由到不同的后端"""
+    model_config = ConfigDict(protected_namespaces=())
+
+    model: Optional[str] = None
+    model_preference: Optional[List[str]] = None
+
+class GatewayBatchItemResult(BatchItemResult):
+    """批量生成中单条prompt的结果，带实际处理它的后端"""
+    gpu_id: Optional[str] = None
+
+class GatewayBatchResponse(BaseModel):
+    """网关批量响应模型，results按输入顺序排列"""
+    results: List[GatewayBatchItemResult]
+
+class Gateway:
+    """vLLM网关"""
+
+    def __init__(self, config_path: str = "vllm/config/config.json"):
+        self.client = VLLMClient(config_path)
+        self.gateway_config = self.config.config.get("gateway", {})
+        self.host = self.gateway_config.get("host", "0.0.0.0")
+        self.port = self.gateway_config.get("port", 9000)
+
+        # 每个后端一个有界队列；删除的后端保留队列，进行中的请求完成时仍要释放槽位
+        self.queues: Dict[str, AdmissionController] = {
+            gpu_id: self._new_queue() for gpu_id in self.client.server_states
+        }
+        self.client.config_store.subscribe(self._apply_config)
+
+        # 每个模型因没有可用副本而无法服务的请求数，自动扩缩容据此把缩到0的模型拉起来
+        self.unserved: Dict[str, int] = {}
+
+        self.app = FastAPI(
+            title="vLLM Gateway",
+            description="路由到所有GPU服务器的统一入口",
+            version="1.0.0",
+            lifespan=self._lifespan
+        )
+
+        # 添加CORS中间件
+        self.app.add_middleware(
+            CORSMiddleware,
+            allow_origins=["*"],
+            allow_credentials=True,
+            allow_methods=["*"],
+            allow_headers=["*"],
+        )
+
+        self._setup_metrics()
+        self._setup_routes()
+
+    @property
+    def config(self) -> Config:
+        """客户端当前使用的配置快照"""
+        return self.client.config
+
+    def _new_queue(self) -> AdmissionController:
+        return AdmissionController(
+            max_in_flight=self.gateway_config.get("max_in_flight_per_backend", 64),
+            max_waiting=self.gateway_config.get("max_waiting_per_backend", 256),
+            max_queue_wait=self.gateway_config.get("max_queue_wait", 30)
+        )
+
+    def _apply_config(self, old: Config, new: Config):
+        """配置重新加载后为新增的后端创建队列"""
+        for gpu_id in new.get_available_gpus():
+            if gpu_id not in self.queues:
+                self.queues[gpu_id] = self._new_queue()
+
+    @asynccontextmanager
+    async def _lifespan(self, app: FastAPI):
+        """随应用启动客户端（连接池和健康探测），退出时关闭"""
+        await self.client.start()
+        try:
+            yield
+        finally:
+            await self.client.close()
+
+    def _setup_metrics(self):
+        """注册网关指标"""
+        self.metrics = MetricsRegistry({"service": "gateway"})
+        self.requests_total = self.metrics.counter(
+            "gateway_requests_total", "Number of generation requests received by the gateway")
+        self.request_errors_total = self.metrics.counter(
+            "gateway_request_errors_total", "Number of gateway requests that failed")
+        self.requests_rejected_total = self.metrics.counter(
+            "gateway_requests_rejected_total", "Number of requests rejected because backend queues were full")
+        self.metrics.gauge(
+            "gateway_in_flight", "Requests currently sent to backends",
+            function=lambda: sum(queue.in_flight for queue in self.queues.values()))
+        self.metrics.gauge(
+            "gateway_queue_waiting", "Requests waiting in backend queues",
+            function=lambda: sum(queue.waiting for queue in self.queues.values()))
+        self.metrics.gauge(
+            "gateway_healthy_backends", "Backends currently accepting requests",
+            function=lambda: sum(1 for state in self.client.server_states.values() if state.available))
+        self.request_latency = self.metrics.histogram(
+            "gateway_request_latency_seconds", "End-to-end gateway request latency")
+
+    def _setup_routes(self):
+        """设置路由"""
+
+        @self.app.get("/health")
+        async def health_check():
+            """网关健康检查，至少有一个可用后端时为healthy"""
+            available = [gpu_id for gpu_id, state in self.client.server_states.items() if state.available]
+            return {
+                "status": "healthy" if available else "degraded",
+                "backends": len(self.client.server_states),
+                "available_backends": available,
+                "in_flight": sum(queue.in_flight for queue in self.queues.values()),
+                "waiting": sum(queue.waiting for queue in self.queues.values()),
+                "unserved": self.unserved
+            }
+
+        @self.app.get("/backends")
+        async def list_backends():
+            """每个后端的缓存状态、负载和网关侧队列"""
+            backends = {}
+            for gpu_id, state in self.client.server_states.items():
+                queue = self.queues[gpu_id]
+                backends[gpu_id] = dict(
+                    state.to_dict(),
+                    name=self.config.get_model_name(gpu_id),
+                    load=state.load,
+                    gateway_in_flight=queue.in_flight,
+                    gateway_waiting=queue.waiting
+                )
+            return backends
+
+        @self.app.get("/metrics")
+        async def get_metrics():
+            """Prometheus文本格式的指标"""
+            return PlainTextResponse(
+                self.metrics.render(),
+                media_type="text/plain; version=0.0.4; charset=utf-8"
+            )
+
+        @self.app.post("/generate", response_model=GenerateResponse)
+        async def generate(request: GatewayGenerateRequest, http_request: Request):
+            """路由到负载最低的后端生成文本"""
+            self.requests_total.inc()
+            start = time.monotonic()
+            try:
+                return await self._until_disconnect(http_request, self._generate(request))
+            except Exception as e:
+                raise self._http_error(e)
+            finally:
+                self.request_latency.observe(time.monotonic() - start)
+
+        @self.app.post("/generate_stream")
+        async def generate_stream(request: GatewayGenerateRequest):
+            """以SSE流式返回生成的增量文本，事件格式与单服务器的/generate_stream相同"""
+            self.requests_total.inc()
+            try:
+                gpu_id = await self._acquire_backend(request.prompt, request.model, request.model_preference)
+            except Exception as e:
+                raise self._http_error(e)
+
+            return StreamingResponse(
+                self._stream_events(gpu_id, request),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+
+        @self.app.post("/generate_batch", response_model=GatewayBatchResponse)
+        async def generate_batch(request: GatewayBatchRequest, http_request: Request):
+            """批量生成，每条prompt分别路由；results按输入顺序排列"""
+            self.requests_total.inc()
+            if request.params is not None and len(request.params) != len(request.prompts):
+                raise HTTPException(status_code=422, detail="params的长度必须与prompts一致")
+
+            items = self._expand_batch(request)
+            if request.stream:
+                return StreamingResponse(
+                    self._stream_batch_events(items, request),
+                    media_type="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+                )
+
+            results = await self._until_disconnect(http_request, asyncio.gather(*[
+                self._generate_batch_item(index, item, request)
+                for index, item in enumerate(items)
+            ]))
+            return GatewayBatchResponse(results=results)
+
+    @staticmethod
+    async def _until_disconnect(http_request: Request, awaitable):
+        """等待awaitable完成；调用方先断开时取消它，关闭的上游连接让后端中止生成"""
+        task = asyncio.ensure_future(awaitable)
+        disconnected = False
+
+        async def wait_for_disconnect():
+            nonlocal disconnected
+            while True:
+                message = await http_request.receive()
+                if message["type"] == "http.disconnect":
+                    logger.info("调用方已断开，取消上游请求")
+                    disconnected = True
+                    task.cancel()
+                    return
+
+        watcher = asyncio.ensure_future(wait_for_disconnect())
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not disconnected:
+                raise
+            # 调用方已经收不到响应，状态码只用于日志
+            raise HTTPException(status_code=499, detail="调用方已断开")
+        finally:
+            watcher.cancel()
+
+    async def _generate(self, request: GatewayGenerateRequest) -> Dict[str, Any]:
+        """排队获取后端并生成一条文本"""
+        gpu_id = await self._acquire_backend(request.prompt, request.model, request.model_preference)
+        started = time.monotonic()
+        try:
+            return await asyncio.wait_for(
+                self.client.generate_text(gpu_id, request.prompt, **self._sampling(request)),
+                request.timeout
+            )
+        finally:
+            self._release_backend(gpu_id, started)
+
+    @staticmethod
+    def _sampling(request: GenerateRequest) -> Dict[str, Any]:
+        return {key: getattr(request, key) for key in GENERATION_PARAMS}
+
+    async def _acquire_backend(
+        self,
+        prompt: str,
+        model: Optional[str],
+        model_preference: Optional[List[str]]
+    ) -> str:
+        """选择后端并在它的队列中获取一个槽位；调用方负责release
+
+        队列已满的后端不参与路由；全部已满时拒绝请求。
+        """
+        try:
+            candidates = await self.client.candidate_servers(model_preference, model)
+        except NoServerAvailable:
+            if model is not None:
+                name = self.config.resolve_model(model)
+                self.unserved[name] = self.unserved.get(name, 0) + 1
+            raise
+        open_candidates = [state for state in candidates if not self.queues[state.gpu_id].would_reject()]
+        if not open_candidates:
+            retry_after = min(self.queues[state.gpu_id].retry_after() for state in candidates)
+            raise AdmissionRejected("所有后端的队列已满", retry_after)
+
+        state = self.client.routing_policy.select(open_candidates, prompt)
+        queue = self.queues[state.gpu_id]
+        state.queued += 1
+        try:
+            await queue.acquire()
+        finally:
+            state.queued -= 1
+        return state.gpu_id
+
+    def _release_backend(self, gpu_id: str, started: float):
+        """释放队列槽位，并用本次占用时间更新Retry-After估算"""
+        queue = self.queues[gpu_id]
+        queue.record_service_time(time.monotonic() - started)
+        queue.release()
+
+    def _http_error(self, error: Exception) -> HTTPException:
+        """把路由和上游错误转换为HTTP响应"""
+        if isinstance(error, HTTPException):
+            return error
+        if isinstance(error, AdmissionRejected):
+            self.requests_rejected_total.inc()
+            logger.warning(f"拒绝请求: {error.reason}")
+            return HTTPException(
+                status_code=429,
+                detail=error.reason,
+                headers={"Retry-After": str(error.retry_after)}
+            )
+
+        self.request_errors_total.inc()
+        if isinstance(error, UpstreamError):
+            headers = {"Retry-After": str(int(error.retry_after))} if error.retry_after else None
+            return HTTPException(status_code=error.status, detail=str(error), headers=headers)
+        if isinstance(error, ValueError):
+            return HTTPException(status_code=404, detail=str(error))
+        if isinstance(error, NoServerAvailable):
+            return HTTPException(status_code=503, detail=str(error))
+        if isinstance(error, asyncio.TimeoutError):
+            return HTTPException(status_code=504, detail="请求超时")
+        logger.error(f"网关请求失败: {error}")
+        return HTTPException(status_code=502, detail=f"上游请求失败: {error}")
+
+    @staticmethod
+    def _format_event(payload: Dict[str, Any]) -> str:
+        """编码为一条server-sent event"""
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    async def _stream_events(self, gpu_id: str, request: GatewayGenerateRequest) -> AsyncIterator[str]:
+        """转发后端事件；调用方断开时关闭上游连接，后端随之中止生成"""
+        start = time.monotonic()
+        try:
+            async for event in self.client.stream_events(gpu_id, request.prompt, **self._sampling(request)):
+                yield self._format_event(event)
+        except Exception as e:
+            self.request_errors_total.inc()
+            logger.error(f"流式生成时出错: {e}")
+            yield self._format_event({"error": f"生成失败: {str(e)}", "finished": True})
+        finally:
+            self._release_backend(gpu_id, start)
+            self.request_latency.observe(time.monotonic() - start)
+
+    @staticmethod
+    def _expand_batch(request: GatewayBatchRequest) -> List[GenerateRequest]:
+        """将批量请求展开为单条请求，合并共享参数和单条覆盖参数"""
+        shared = request.model_dump(include=set(GENERATION_PARAMS))
+        overrides = request.params or [None] * len(request.prompts)
+
+        items = []
+        for prompt, override in zip(request.prompts, overrides):
+            fields = dict(shared)
+            if override is not None:
+                fields.update(override.model_dump(exclude_none=True))
+            items.append(GenerateRequest(prompt=prompt, timeout=request.timeout, **fields))
+        return items
+
+    async def _generate_batch_item(
+        self,
+        index: int,
+        item: GenerateRequest,
+        request: GatewayBatchRequest
+    ) -> GatewayBatchItemResult:
+        """生成批量请求中的一条，失败只记录在该条结果中"""
+        try:
+            gpu_id = await self._acquire_backend(item.prompt, request.model, request.model_preference)
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(
+                    self.client.generate_text(gpu_id, item.prompt, **self._sampling(item)),
+                    item.timeout
+                )
+            finally:
+                self._release_backend(gpu_id, started)
+            return GatewayBatchItemResult(
+                index=index,
+                text=result["text"],
+                finish_reason=result.get("finish_reason"),
+                gpu_id=result.get("gpu_id", gpu_id)
+            )
+        except Exception as e:
+            error = self._http_error(e)
+            return GatewayBatchItemResult(index=index, error=f"HTTP {error.status_code}: {error.detail}")
+
+    async def _stream_batch_events(
+        self,
+        items: List[GenerateRequest],
+        request: GatewayBatchRequest
+    ) -> AsyncIterator[str]:
+        """每条prompt完成时立即产出带index的结果事件"""
+        tasks = [
+            asyncio.ensure_future(self._generate_batch_item(index, item, request))
+            for index, item in enumerate(items)
+        ]
+
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                yield self._format_event(result.model_dump())
+            yield self._format_event({"finished": True, "count": len(items)})
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def start_server(self):
+        """启动网关"""
+        config = uvicorn.Config(
+            app=self.app,
+            host=self.host,
+            port=self.port,
+            log_level="info"
+        )
+
+        server = uvicorn.Server(config)
+        logger.info(f"启动网关: {self.host}:{self.port}")
+        await server.serve()
+
+async def main():
+    parser = argparse.ArgumentParser(description='启动vLLM网关')
+    parser.add_argument('--config', default="vllm/config/config.json", help='配置文件路径')
+    args = parser.parse_args()
+
+    try:
+        gateway = Gateway(args.config)
+        await gateway.start_server()
+    except KeyboardInterrupt:
+        logger.info("网关已停止")
+    except Exception as e:
+        logger.error(f"网关启动失败: {e}")
+        raise e
+
+if __name__ == "__main__":
+    asyncio.run(main())
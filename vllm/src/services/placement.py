@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Placement - 按设备显存为GPU条目分配设备和端口
+
+vLLM按gpu_memory_utilization预留每张卡总显存的一部分，所以一张卡上的服务器的利用率之和
+不能超过max_utilization；tensor_parallel_size为N的服务器需要N张卡，每张卡放一个分片，
+分片（模型大小/N）加上KV缓存余量要放得进该卡的预留显存。
+
+规划时先放固定了devices的条目，再放有首选设备的条目（未配置devices时首选缺省设备，
+首选设备放得下就不挪动），其余按占用从大到小放：大模型优先拿到整块空闲的卡，
+小模型优先放进已经部分占用的卡，尽量密集。放不下时抛出PlacementError。
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from ..utils.config import Config
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 计入模型大小的权重文件
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt", ".pth", ".gguf")
+
+class PlacementError(Exception):
+    """设备或端口无法满足GPU条目的需求"""
+
+@dataclass
+class ServerSpec:
+    """一个GPU条目对设备的需求；devices和port为None时由规划器分配，优先使用preferred中的设备"""
+    gpu_id: str
+    size_gb: Optional[float]
+    tensor_parallel_size: int = 1
+    gpu_memory_utilization: float = 0.9
+    devices: Optional[List[str]] = None
+    port: Optional[int] = None
+    preferred: Optional[List[str]] = None
+
+@dataclass
+class Placement:
+    """规划结果：服务器使用的设备和端口"""
+    gpu_id: str
+    devices: List[str]
+    port: int
+
+@dataclass
+class PlacementPlanner:
+    """按设备清单规划服务器的放置
+
+    inventory为设备编号 -> 显存（GB），显存未知时为None，此时只检查利用率之和。
+    """
+    inventory: Dict[str, Optional[float]]
+    base_port: int = 8000
+    max_utilization: float = 0.95
+    # 每张卡的预留显存中至少留给KV缓存的比例
+    kv_headroom: float = 0.1
+    _order: Dict[str, int] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._order = {device: index for index, device in enumerate(self.inventory)}
+
+    def _shard_gb(self, spec: ServerSpec) -> Optional[float]:
+        if spec.size_gb is None:
+            return None
+        return spec.size_gb / spec.tensor_parallel_size
+
+    def _problem(self, spec: ServerSpec, device: str, usage: Dict[str, float]) -> Optional[str]:
+        """spec的一个分片放到device上的问题，能放下时返回None"""
+        if device not in self.inventory:
+            return f"设备 {device} 不在设备清单中"
+        if usage[device] + spec.gpu_memory_utilization > self.max_utilization + 1e-9:
+            return (f"设备 {device} 超额分配: 已用利用率 {usage[device]:.2f} + "
+                    f"{spec.gpu_memory_utilization:.2f} > {self.max_utilization:.2f}")
+        memory = self.inventory[device]
+        shard = self._shard_gb(spec)
+        if memory is not None and shard is not None:
+            available = memory * spec.gpu_memory_utilization * (1 - self.kv_headroom)
+            if shard > available:
+                return f"设备 {device} 显存不足: 每个分片 {shard:.1f}GB > 可用 {available:.1f}GB"
+        return None
+
+    def _preferred(self, spec: ServerSpec, usage: Dict[str, float]) -> Optional[List[str]]:
+        """spec的首选设备数量正确且都放得下时返回它们，否则返回None"""
+        if not spec.preferred or len(spec.preferred) != spec.tensor_parallel_size:
+            return None
+        if any(self._problem(spec, device, usage) for device in spec.preferred):
+            return None
+        return list(spec.preferred)
+    
+    def _choose(self, spec: ServerSpec, usage: Dict[str, float]) -> List[str]:
+        candidates = [device for device in self.inventory if self._problem(spec, device, usage) is None]
+        if len(candidates) < spec.tensor_parallel_size:
+            raise PlacementError(
+                f"GPU条目 {spec.gpu_id} 无法放置: 需要{spec.tensor_parallel_size}张卡，"
+                f"只有{len(candidates)}张卡剩余容量足够"
+                f"（模型 {spec.size_gb}GB, 利用率 {spec.gpu_memory_utilization}）"
+            )
+        # 最佳适应：剩余容量最少的卡优先，相同时显存小的卡优先，把整块大卡留给后面的大模型
+        candidates.sort(key=lambda device: (
+            self.max_utilization - usage[device],
+            self.inventory[device] or 0,
+            self._order[device]
+        ))
+        return sorted(candidates[:spec.tensor_parallel_size], key=self._order.get)
+
+    def plan(self, specs: List[ServerSpec]) -> Dict[str, Placement]:
+        """为所有条目分配设备和端口，返回gpu_id -> Placement"""
+        for spec in specs:
+            if spec.tensor_parallel_size < 1:
+                raise PlacementError(f"GPU条目 {spec.gpu_id} 的tensor_parallel_size无效: {spec.tensor_parallel_size}")
+            if not 0 < spec.gpu_memory_utilization <= 1:
+                raise PlacementError(f"GPU条目 {spec.gpu_id} 的gpu_memory_utilization无效: {spec.gpu_memory_utilization}")
+            if spec.devices is not None and len(spec.devices) != spec.tensor_parallel_size:
+                raise PlacementError(
+                    f"GPU条目 {spec.gpu_id} 的devices有{len(spec.devices)}张卡，"
+                    f"与tensor_parallel_size={spec.tensor_parallel_size}不一致"
+                )
+
+        ports: Dict[int, str] = {}
+        for spec in specs:
+            if spec.port is not None:
+                if spec.port in ports:
+                    raise PlacementError(f"GPU条目 {spec.gpu_id} 和 {ports[spec.port]} 使用了同一个端口 {spec.port}")
+                ports[spec.port] = spec.gpu_id
+
+        usage = {device: 0.0 for device in self.inventory}
+        ordered = sorted(specs, key=lambda spec: (
+            spec.devices is None,
+            spec.preferred is None,
+            -spec.tensor_parallel_size * spec.gpu_memory_utilization,
+            -(spec.size_gb or 0)
+        ))
+
+        assigned: Dict[str, List[str]] = {}
+        for spec in ordered:
+            if spec.devices is not None:
+                devices = spec.devices
+                for device in devices:
+                    problem = self._problem(spec, device, usage)
+                    if problem:
+                        raise PlacementError(f"GPU条目 {spec.gpu_id} 无法放置: {problem}")
+            else:
+                devices = self._preferred(spec, usage) or self._choose(spec, usage)
+            for device in devices:
+                usage[device] += spec.gpu_memory_utilization
+            assigned[spec.gpu_id] = list(devices)
+
+        # 端口按条目顺序分配，与放置顺序无关
+        placements: Dict[str, Placement] = {}
+        next_port = self.base_port
+        for spec in specs:
+            port = spec.port
+            if port is None:
+                while next_port in ports:
+                    next_port += 1
+                port = next_port
+                ports[port] = spec.gpu_id
+            placements[spec.gpu_id] = Placement(spec.gpu_id, assigned[spec.gpu_id], port)
+        return placements
+
+    def check(self, specs: List[ServerSpec]):
+        """检查一组已确定设备的服务器能否同时运行，不能时抛出PlacementError"""
+        self.plan(specs)
+
+def estimate_model_size(model_path: str) -> Optional[float]:
+    """按模型目录中权重文件的大小估计模型大小（GB），目录不存在时返回None"""
+    if not os.path.isdir(model_path):
+        return None
+    total = 0
+    for root, _, files in os.walk(model_path):
+        for name in files:
+            if name.endswith(WEIGHT_SUFFIXES):
+                total += os.path.getsize(os.path.join(root, name))
+    return total / 1024 ** 3 if total else None
+
+def detect_devices() -> Dict[str, Optional[float]]:
+    """用nvidia-smi读取本机GPU及其显存（GB），没有nvidia-smi时返回空字典"""
+    try:
+        output = subprocess.run(
+            ["nvidia-smi", "--query-gpu=index,memory.total", "--format=csv,noheader,nounits"],
+            capture_output=True, text=True, check=True, timeout=10
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return {}
+    devices = {}
+    for line in output.strip().splitlines():
+        index, memory_mib = [part.strip() for part in line.split(",")]
+        devices[index] = float(memory_mib) / 1024
+    return devices
+
+def load_inventory(config: Config) -> Dict[str, Optional[float]]:
+    """设备清单：优先取配置中的placement.devices，其次nvidia-smi，都没有时取条目引用的设备（显存未知）"""
+    configured = config.config.get("placement", {}).get("devices")
+    if configured:
+        return {str(device): memory for device, memory in configured.items()}
+    detected = detect_devices()
+    if detected:
+        return detected
+    devices = {}
+    for gpu_id in config.get_available_gpus():
+        for device in config.get_devices(gpu_id):
+            devices[device] = None
+    return devices
+
+def create_planner(config: Config) -> PlacementPlanner:
+    """按配置的placement部分创建规划器"""
+    placement_config = config.config.get("placement", {})
+    return PlacementPlanner(
+        inventory=load_inventory(config),
+        base_port=placement_config.get("base_port", 8000),
+        max_utilization=placement_config.get("max_utilization", 0.95),
+        kv_headroom=placement_config.get("kv_headroom", 0.1)
+    )
+
+def server_spec(config: Config, gpu_id: str) -> ServerSpec:
+    """GPU条目的放置需求；条目配置了devices时固定在这些设备上，否则由规划器分配，首选缺省设备"""
+    gpu_config = config.get_gpu_config(gpu_id)
+    size_gb = gpu_config.get("model_size_gb")
+    if size_gb is None:
+        size_gb = estimate_model_size(gpu_config["model"])
+    devices = gpu_config.get("devices")
+    return ServerSpec(
+        gpu_id=gpu_id,
+        size_gb=size_gb,
+        tensor_parallel_size=gpu_config.get("tensor_parallel_size", 1),
+        gpu_memory_utilization=gpu_config.get("gpu_memory_utilization", 0.9),
+        devices=[str(device) for device in devices] if devices is not None else None,
+        port=gpu_config.get("port"),
+        preferred=config.get_devices(gpu_id) if devices is None else None
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='为GPU条目规划设备和端口')
+    parser.add_argument('--config', default="vllm/config/config.json", help='配置文件路径')
+    parser.add_argument('--output', help='写入规划后配置的路径（默认只打印规划）')
+    parser.add_argument('--reassign-ports', action='store_true', help='忽略条目中已有的端口，从placement.base_port起重新分配')
+    args = parser.parse_args()
+
+    config = Config(args.config)
+    planner = create_planner(config)
+    specs = []
+    for gpu_id in config.get_available_gpus():
+        spec = server_spec(config, gpu_id)
+        if args.reassign_ports:
+            spec.port = None
+        specs.append(spec)
+
+    try:
+        placements = planner.plan(specs)
+    except PlacementError as e:
+        logger.error(f"放置失败: {e}")
+        raise SystemExit(1)
+
+    print("\n=== 放置规划 ===")
+    for spec in specs:
+        placement = placements[spec.gpu_id]
+        size = f"{spec.size_gb:.1f}GB" if spec.size_gb is not None else "未知大小"
+        print(f"GPU条目 {spec.gpu_id}: 设备 {','.join(placement.devices)}, 端口 {placement.port} "
+              f"({size}, TP={spec.tensor_parallel_size}, 利用率 {spec.gpu_memory_utilization})")
+
+    if args.output:
+        resolved = json.loads(json.dumps(config.config))
+        for gpu_id, placement in placements.items():
+            resolved["gpus"][gpu_id]["devices"] = placement.devices
+            resolved["gpus"][gpu_id]["port"] = placement.port
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(resolved, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        logger.info(f"已写入规划后的配置: {args.output}")
+
+if __name__ == "__main__":
+    main()
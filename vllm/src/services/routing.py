@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Routing - 在多个候选服务器之间选择目标的可插拔路由策略
+
+所有策略只读取ServerState中客户端自己维护的计数和服务器上报的队列深度，
+不做任何网络调用。
+"""
+
+import bisect
+import hashlib
+import itertools
+import math
+import random
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List, Optional, Tuple, Type
+
+from .server_state import ServerState
+
+class RoutingPolicy(ABC):
+    """路由策略接口"""
+
+    name = ""
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None):
+        self.options = options or {}
+
+    @abstractmethod
+    def select(self, candidates: List[ServerState], prompt: Optional[str] = None) -> ServerState:
+        """从非空的候选列表中选择一个服务器"""
+
+class FirstAvailablePolicy(RoutingPolicy):
+    """总是选择第一个候选服务器（原有行为）"""
+
+    name = "first"
+
+    def select(self, candidates: List[ServerState], prompt: Optional[str] = None) -> ServerState:
+        return candidates[0]
+
+class RoundRobinPolicy(RoutingPolicy):
+    """轮询"""
+
+    name = "round_robin"
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None):
+        super().__init__(options)
+        self._counter = itertools.count()
+
+    def select(self, candidates: List[ServerState], prompt: Optional[str] = None) -> ServerState:
+        return candidates[next(self._counter) % len(candidates)]
+
+class LeastOutstandingPolicy(RoutingPolicy):
+    """选择负载（未完成请求数加服务器排队数）最小的服务器，负载相同时随机选择"""
+
+    name = "least_outstanding"
+
+    def select(self, candidates: List[ServerState], prompt: Optional[str] = None) -> ServerState:
+        lowest = min(state.load for state in candidates)
+        return random.choice([state for state in candidates if state.load == lowest])
+
+class PowerOfTwoPolicy(RoutingPolicy):
+    """随机取两个候选，选择负载较小的一个"""
+
+    name = "power_of_two"
+
+    def select(self, candidates: List[ServerState], prompt: Optional[str] = None) -> ServerState:
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return first if first.load <= second.load else second
+
+class EWMALatencyPolicy(RoutingPolicy):
+    """按每token耗时的指数滑动平均乘以(负载+1)打分，选择分数最低的服务器
+
+    还没有延迟样本的服务器按候选中最快的耗时估计，因此冷启动时退化为按负载选择。
+    """
+
+    name = "ewma"
+
+    def select(self, candidates: List[ServerState], prompt: Optional[str] = None) -> ServerState:
+        samples = [state.ewma_time_per_token for state in candidates if state.ewma_time_per_token]
+        default = min(samples) if samples else 1.0
+        return min(
+            candidates,
+            key=lambda state: (state.ewma_time_per_token or default) * (state.load + 1)
+        )
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+class PrefixAffinityPolicy(RoutingPolicy):
+    """按prompt前缀做一致性哈希，让共享前缀的请求落在同一副本上以复用KV前缀缓存
+
+    前缀取prompt的前prefix_length个字符。每个服务器在哈希环上有virtual_nodes个虚拟节点，
+    副本增减时只有少量前缀改变归属。有界负载：负载超过平均负载load_factor倍的服务器
+    被跳过，请求沿环溢出到下一个服务器，热门前缀因此不会压垮单个GPU。
+    没有prompt时退化为选择负载最小的服务器。
+    """
+
+    name = "prefix_affinity"
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None):
+        super().__init__(options)
+        self.prefix_length = self.options.get("prefix_length", 256)
+        self.virtual_nodes = self.options.get("virtual_nodes", 64)
+        self.load_factor = self.options.get("load_factor", 1.25)
+        # 候选集合 -> 排好序的(哈希, gpu_id)环，候选集合变化不频繁
+        self._rings: Dict[Tuple[str, ...], List[Tuple[int, str]]] = {}
+
+    def _ring(self, gpu_ids: Tuple[str, ...]) -> List[Tuple[int, str]]:
+        ring = self._rings.get(gpu_ids)
+        if ring is None:
+            ring = sorted(
+                (_hash(f"{gpu_id}#{replica}"), gpu_id)
+                for gpu_id in gpu_ids
+                for replica in range(self.virtual_nodes)
+            )
+            self._rings[gpu_ids] = ring
+        return ring
+
+    def select(self, candidates: List[ServerState], prompt: Optional[str] = None) -> ServerState:
+        if len(candidates) == 1:
+            return candidates[0]
+        if not prompt:
+            return min(candidates, key=lambda state: state.load)
+
+        states = {state.gpu_id: state for state in candidates}
+        ring = self._ring(tuple(sorted(states)))
+        capacity = math.ceil(self.load_factor * (sum(state.load for state in candidates) + 1) / len(candidates))
+
+        start = bisect.bisect(ring, (_hash(prompt[:self.prefix_length]), ""))
+        visited = set()
+        for offset in range(len(ring)):
+            gpu_id = ring[(start + offset) % len(ring)][1]
+            if gpu_id in visited:
+                continue
+            visited.add(gpu_id)
+            if states[gpu_id].load < capacity:
+                return states[gpu_id]
+            if len(visited) == len(states):
+                break
+        return min(candidates, key=lambda state: state.load)
+
+ROUTING_POLICIES: Dict[str, Type[RoutingPolicy]] = {
+    policy.name: policy
+    for policy in (
+        FirstAvailablePolicy,
+        RoundRobinPolicy,
+        LeastOutstandingPolicy,
+        PowerOfTwoPolicy,
+        EWMALatencyPolicy,
+        PrefixAffinityPolicy,
+    )
+}
+
+def create_policy(name: str, options: Optional[Dict[str, Any]] = None) -> RoutingPolicy:
+    """按名称创建路由策略"""
+    if name not in ROUTING_POLICIES:
+        raise ValueError(f"未知的路由策略: {name}，可选: {', '.join(ROUTING_POLICIES)}")
+    return ROUTING_POLICIES[name](options)
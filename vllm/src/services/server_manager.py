@@ -6,30 +6,200 @@ vLLM Server Manager - 用于批量管理多个vLLM服务器
 import asyncio
 import argparse
 import logging
+import os
 import subprocess
 import signal
 import sys
 import time
-from typing import Dict, List, Optional
-from ..utils.config import Config
+from collections import deque
+from dataclasses import replace
+from typing import Dict, List, Optional, Set
+
+import aiohttp
+
+from ..utils.config import Config, diff_gpus, get_config_store
+from ..utils.log_capture import log_file_path, tail_lines
+from .placement import PlacementError, PlacementPlanner, ServerSpec, create_planner, server_spec
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class RestartBackoff:
+    """单个服务器的重启退避和崩溃循环检测
+    
+    只统计最近window秒内的崩溃：第n次崩溃后等待base_delay * 2^(n-1)秒（不超过max_delay）再重启，
+    window内崩溃超过max_restarts次即判定为崩溃循环。稳定运行超过window后退避自然回落。
+    """
+    
+    def __init__(self, base_delay: float = 5.0, max_delay: float = 300.0,
+                 max_restarts: int = 5, window: float = 600.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_restarts = max_restarts
+        self.window = window
+        self.crashes: deque = deque()
+    
+    def _expire(self):
+        cutoff = time.monotonic() - self.window
+        while self.crashes and self.crashes[0] < cutoff:
+            self.crashes.popleft()
+    
+    def record_crash(self):
+        self.crashes.append(time.monotonic())
+        self._expire()
+    
+    @property
+    def crash_looping(self) -> bool:
+        self._expire()
+        return len(self.crashes) > self.max_restarts
+    
+    def next_delay(self) -> float:
+        self._expire()
+        return min(self.base_delay * 2 ** max(len(self.crashes) - 1, 0), self.max_delay)
+
 class ServerManager:
     """vLLM服务器管理器"""
     
     def __init__(self, config_path: str = "vllm/config/config.json"):
-        self.config = Config(config_path)
+        self.config_store = get_config_store(config_path)
+        self.config: Config = self.config_store.snapshot
         self.processes: Dict[str, subprocess.Popen] = {}
+        # 每个服务器对应的日志转储进程
+        self.log_pumps: Dict[str, subprocess.Popen] = {}
         self.running = False
         
-    def start_server(self, gpu_id: str) -> bool:
-        """启动指定GPU上的服务器"""
+        manager_config = self.config.config.get("manager", {})
+        self.ready_timeout = manager_config.get("ready_timeout", 900)
+        self.ready_poll_interval = manager_config.get("ready_poll_interval", 2.0)
+        self.log_dir = manager_config.get("log_dir", "vllm/logs")
+        self.log_max_bytes = manager_config.get("log_max_bytes", 100 * 1024 * 1024)
+        self.log_backup_count = manager_config.get("log_backup_count", 5)
+        self.probe_timeout = manager_config.get("probe_timeout", 5.0)
+        self.unhealthy_threshold = manager_config.get("unhealthy_threshold", 3)
+        self.restart_backoff = manager_config.get("restart_backoff", 5.0)
+        self.max_restart_backoff = manager_config.get("max_restart_backoff", 300.0)
+        self.crash_loop_restarts = manager_config.get("crash_loop_restarts", 5)
+        self.crash_loop_window = manager_config.get("crash_loop_window", 600.0)
+        self.drain_timeout = manager_config.get("drain_timeout", 120.0)
+        # 进程启动时刻，以及从启动到/health可用的耗时（秒）
+        self.start_times: Dict[str, float] = {}
+        self.load_times: Dict[str, float] = {}
+        
+        # 应保持运行的服务器：start_server加入，stop_server移除，监督器只重启这些服务器
+        self.desired: Set[str] = set()
+        self.backoffs: Dict[str, RestartBackoff] = {}
+        self.restart_counts: Dict[str, int] = {}
+        self.probe_failures: Dict[str, int] = {}
+        # 判定为崩溃循环、已停止自动重启的服务器
+        self.crash_looping: Set[str] = set()
+        # 监督器正在后台恢复的服务器，以及正在滚动重启的服务器，监督器不检查后者
+        self.recoveries: Dict[str, asyncio.Task] = {}
+        self.restarting: Set[str] = set()
+        self._rolling_task: Optional[asyncio.Task] = None
+        self._planner: Optional[PlacementPlanner] = None
+        # 按当前配置的放置需求（模型大小需要读目录，缓存到配置重新加载），以及运行中的服务器启动时的需求和设备
+        self._specs: Dict[str, ServerSpec] = {}
+        self.server_specs: Dict[str, ServerSpec] = {}
+        
+        # 运行中的服务器实际监听的URL；配置修改了端口时，排空和停止旧服务器仍要用原来的端口
+        self.server_urls: Dict[str, str] = {}
+        # 配置重新加载后是否启动新增的GPU条目（supervise未指定--gpu时开启）
+        self.start_new_servers = False
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self.config_store.subscribe(self._apply_config)
+        
+    @property
+    def planner(self) -> PlacementPlanner:
+        """设备清单的放置规划器，第一次使用时读取设备清单"""
+        if self._planner is None:
+            self._planner = create_planner(self.config)
+        return self._planner
+    
+    def placement_spec(self, gpu_id: str) -> ServerSpec:
+        """GPU条目的放置需求：运行中的服务器固定在它使用的设备上，其余只固定配置了devices的条目"""
+        if gpu_id in self.server_specs:
+            return self.server_specs[gpu_id]
+        if gpu_id not in self._specs:
+            self._specs[gpu_id] = server_spec(self.config, gpu_id)
+        return self._specs[gpu_id]
+    
+    async def load_placement(self):
+        """在线程中读取设备清单和所有GPU条目的模型大小（nvidia-smi、读目录），在事件循环线程中存入缓存"""
+        config = self.config
+        missing = [gpu_id for gpu_id in config.get_available_gpus() if gpu_id not in self._specs]
+        if self._planner is not None and not missing:
+            return
+        
+        def load():
+            planner = self._planner or create_planner(config)
+            return planner, {gpu_id: server_spec(config, gpu_id) for gpu_id in missing}
+        
+        planner, specs = await asyncio.to_thread(load)
+        # 读取期间配置重新加载过时丢弃结果，下个周期重新读取
+        if self.config is config:
+            self._planner = planner
+            self._specs.update(specs)
+    
+    def assign_devices(self, gpu_list: List[str]) -> Dict[str, List[str]]:
+        """在运行中的服务器之外为gpu_list分配设备，超额分配时抛出PlacementError"""
+        running = [
+            gpu_id for gpu_id, process in self.processes.items()
+            if process.poll() is None and gpu_id not in gpu_list
+        ]
+        gpu_ids = list(dict.fromkeys(running + list(gpu_list)))
+        placements = self.planner.plan([self.placement_spec(gpu_id) for gpu_id in gpu_ids])
+        return {gpu_id: placements[gpu_id].devices for gpu_id in gpu_list}
+        
+    def get_server_url(self, gpu_id: str) -> str:
+        """获取指定GPU服务器的URL，运行中的服务器取它启动时的端口"""
+        if gpu_id in self.server_urls:
+            return self.server_urls[gpu_id]
+        host = self.config.server_config.get("host", "localhost")
+        port = self.config.get_gpu_config(gpu_id)["port"]
+        return f"http://{host}:{port}"
+    
+    def get_log_path(self, gpu_id: str) -> str:
+        """指定GPU服务器的日志文件路径"""
+        return log_file_path(self.log_dir, gpu_id)
+    
+    def tail_log(self, gpu_id: str, lines: int = 20) -> List[str]:
+        """读取指定GPU服务器日志的最后几行"""
+        return tail_lines(self.get_log_path(gpu_id), lines)
+    
+    def _start_log_pump(self, gpu_id: str) -> subprocess.Popen:
+        """启动把服务器输出写入轮转日志文件的转储进程"""
+        return subprocess.Popen(
+            [
+                sys.executable, "-m", "vllm.src.utils.log_capture",
+                "--path", self.get_log_path(gpu_id),
+                "--max-bytes", str(self.log_max_bytes),
+                "--backup-count", str(self.log_backup_count)
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+    
+    def _reap_log_pump(self, log_pump: Optional[subprocess.Popen]):
+        """服务器退出后转储进程读到EOF自行退出，这里只回收它"""
+        if log_pump is None:
+            return
+        try:
+            log_pump.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            log_pump.kill()
+            log_pump.wait()
+    
+    def start_server(self, gpu_id: str, devices: Optional[List[str]] = None) -> bool:
+        """启动指定GPU上的服务器，未指定devices时在运行中的服务器之外为它分配设备"""
         if gpu_id in self.processes:
-            logger.warning(f"GPU {gpu_id}上的服务器已经在运行")
-            return False
+            if self.processes[gpu_id].poll() is None:
+                logger.warning(f"GPU {gpu_id}上的服务器已经在运行")
+                return False
+            # 清理已退出的进程
+            del self.processes[gpu_id]
+            self._reap_log_pump(self.log_pumps.pop(gpu_id, None))
         
         gpu_config = self.config.get_gpu_config(gpu_id)
         if not gpu_config:
@@ -37,26 +207,54 @@ class ServerManager:
             return False
         
         try:
+            self.server_urls.pop(gpu_id, None)
+            self.server_specs.pop(gpu_id, None)
+            url = self.get_server_url(gpu_id)
+            if devices is None:
+                devices = self.assign_devices([gpu_id])[gpu_id]
+            preferred = self.placement_spec(gpu_id).preferred
+            if preferred and devices != preferred:
+                logger.warning(f"GPU条目 {gpu_id} 的缺省设备 {','.join(preferred)} 放不下，改用设备 {','.join(devices)}")
+            
             # 构建启动命令
             cmd = [
                 sys.executable, "-m", "vllm.src.services.vllm_server",
                 "--gpu", gpu_id,
-                "--config", self.config.config_path
+                "--config", self.config.config_path,
+                "--devices", ",".join(devices)
             ]
             
             logger.info(f"启动GPU {gpu_id}上的服务器: {gpu_config['description']}")
-            logger.info(f"端口: {gpu_config['port']}, 模型: {gpu_config['model']}")
+            logger.info(f"端口: {gpu_config['port']}, 设备: {','.join(devices)}, 模型: {gpu_config['model']}")
+            logger.info(f"日志: {self.get_log_path(gpu_id)}")
             
-            # 启动进程
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
+            # 启动进程，stdout和stderr都交给日志转储进程，管道不会因无人读取而写满
+            log_pump = self._start_log_pump(gpu_id)
+            try:
+                process = subprocess.Popen(
+                    cmd,
+                    stdout=log_pump.stdin,
+                    stderr=subprocess.STDOUT
+                )
+            except Exception:
+                # 服务器没能启动：关闭管道让转储进程退出，并回收它
+                log_pump.stdin.close()
+                self._reap_log_pump(log_pump)
+                raise
+            finally:
+                # 只让服务器持有管道写端，服务器退出时转储进程随之结束
+                log_pump.stdin.close()
             
             self.processes[gpu_id] = process
-            logger.info(f"服务器启动成功 GPU {gpu_id}, PID: {process.pid}")
+            self.log_pumps[gpu_id] = log_pump
+            self.server_urls[gpu_id] = url
+            self.server_specs[gpu_id] = replace(self.placement_spec(gpu_id), devices=list(devices))
+            self.start_times[gpu_id] = time.monotonic()
+            self.load_times.pop(gpu_id, None)
+            self.probe_failures[gpu_id] = 0
+            self.desired.add(gpu_id)
+            self.crash_looping.discard(gpu_id)
+            logger.info(f"服务器进程已启动 GPU {gpu_id}, PID: {process.pid}")
             return True
             
         except Exception as e:
@@ -64,13 +262,19 @@ class ServerManager:
             return False
     
     def stop_server(self, gpu_id: str) -> bool:
-        """停止指定GPU上的服务器"""
-        if gpu_id not in self.processes:
-            logger.warning(f"GPU {gpu_id}上没有运行的服务器")
-            return False
-        
+        """停止指定GPU上的服务器，监督器不会再重启它"""
+        self.desired.discard(gpu_id)
+        return self._terminate_server(gpu_id)
+    
+    async def stop_server_async(self, gpu_id: str) -> bool:
+        """stop_server的异步版本，在事件循环中停止服务器时使用"""
+        self.desired.discard(gpu_id)
+        return await self._terminate_server_async(gpu_id)
+    
+    def _stop_process(self, gpu_id: str, process: subprocess.Popen,
+                      log_pump: Optional[subprocess.Popen]) -> bool:
+        """终止服务器进程，先SIGTERM，10秒后SIGKILL，再回收日志转储进程；只等待，不修改管理器的状态"""
         try:
-            process = self.processes[gpu_id]
             logger.info(f"停止GPU {gpu_id}上的服务器, PID: {process.pid}")
             
             # 发送终止信号
@@ -84,7 +288,7 @@ class ServerManager:
                 process.kill()
                 process.wait()
             
-            del self.processes[gpu_id]
+            self._reap_log_pump(log_pump)
             logger.info(f"服务器已停止 GPU {gpu_id}")
             return True
             
@@ -92,20 +296,100 @@ class ServerManager:
             logger.error(f"停止服务器失败 GPU {gpu_id}: {e}")
             return False
     
-    def start_all_servers(self, gpu_list: Optional[List[str]] = None) -> int:
-        """启动所有或指定的服务器"""
+    def _forget_server(self, gpu_id: str, process: subprocess.Popen):
+        """清除已停止的服务器的记录；等待期间重新启动的服务器不受影响"""
+        if self.processes.get(gpu_id) is not process:
+            return
+        del self.processes[gpu_id]
+        self.log_pumps.pop(gpu_id, None)
+        self.load_times.pop(gpu_id, None)
+        self.server_urls.pop(gpu_id, None)
+        self.server_specs.pop(gpu_id, None)
+    
+    def _terminate_server(self, gpu_id: str) -> bool:
+        """终止服务器进程并等待它退出，会阻塞调用方；事件循环中使用_terminate_server_async"""
+        process = self.processes.get(gpu_id)
+        if process is None:
+            logger.warning(f"GPU {gpu_id}上没有运行的服务器")
+            return False
+        stopped = self._stop_process(gpu_id, process, self.log_pumps.get(gpu_id))
+        if stopped:
+            self._forget_server(gpu_id, process)
+        return stopped
+    
+    async def _terminate_server_async(self, gpu_id: str) -> bool:
+        """在线程中等待服务器进程退出，管理器的状态只在事件循环线程中修改"""
+        process = self.processes.get(gpu_id)
+        if process is None:
+            logger.warning(f"GPU {gpu_id}上没有运行的服务器")
+            return False
+        stopped = await asyncio.to_thread(self._stop_process, gpu_id, process, self.log_pumps.get(gpu_id))
+        if stopped:
+            self._forget_server(gpu_id, process)
+        return stopped
+    
+    async def _probe_health(self, session: aiohttp.ClientSession, gpu_id: str) -> Optional[str]:
+        """请求一次/health，返回服务器报告的状态（healthy/draining），不可达时返回None"""
+        try:
+            async with session.get(f"{self.get_server_url(gpu_id)}/health") as response:
+                if response.status != 200:
+                    return None
+                return (await response.json()).get("status")
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            # 端口尚未监听、模型仍在加载或服务器无响应
+            return None
+    
+    def _mark_ready(self, gpu_id: str):
+        """记录服务器就绪和加载耗时"""
+        load_time = time.monotonic() - self.start_times[gpu_id]
+        self.load_times[gpu_id] = load_time
+        self.probe_failures[gpu_id] = 0
+        logger.info(f"服务器就绪 GPU {gpu_id}, 加载耗时: {load_time:.1f}秒")
+    
+    async def wait_until_ready(self, gpu_id: str, timeout: Optional[float] = None) -> bool:
+        """轮询/health直到服务器就绪
+        
+        服务器先加载模型再监听端口，所以/health返回healthy即表示可以接收请求。
+        进程提前退出或超过timeout秒（从进程启动算起）时返回False。
+        """
+        process = self.processes.get(gpu_id)
+        if process is None:
+            return False
+        
+        timeout = self.ready_timeout if timeout is None else timeout
+        deadline = self.start_times[gpu_id] + timeout
+        
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.probe_timeout)) as session:
+            while True:
+                if process.poll() is not None:
+                    logger.error(f"服务器在就绪前退出 GPU {gpu_id}, 退出代码: {process.returncode}")
+                    return False
+                
+                if await self._probe_health(session, gpu_id) == "healthy":
+                    self._mark_ready(gpu_id)
+                    return True
+                
+                if time.monotonic() >= deadline:
+                    logger.error(f"服务器未在{timeout}秒内就绪 GPU {gpu_id}")
+                    return False
+                await asyncio.sleep(self.ready_poll_interval)
+    
+    async def start_all_servers(self, gpu_list: Optional[List[str]] = None, timeout: Optional[float] = None) -> int:
+        """并发启动所有或指定的服务器并等待就绪，返回就绪的服务器数"""
         if gpu_list is None:
             gpu_list = self.config.get_available_gpus()
+        # 一次规划所有请求的服务器，超额分配时一个都不启动
+        await self.load_placement()
+        assignments = self.assign_devices([gpu_id for gpu_id in gpu_list if self.config.get_gpu_config(gpu_id)])
         
-        success_count = 0
-        for gpu_id in gpu_list:
-            if self.start_server(gpu_id):
-                success_count += 1
-                # 添加启动间隔，避免资源冲突
-                time.sleep(2)
+        started = [gpu_id for gpu_id in gpu_list if self.start_server(gpu_id, assignments.get(gpu_id))]
+        results = await asyncio.gather(*(self.wait_until_ready(gpu_id, timeout) for gpu_id in started))
         
-        logger.info(f"启动完成: {success_count}/{len(gpu_list)} 个服务器启动成功")
-        return success_count
+        ready = [gpu_id for gpu_id, is_ready in zip(started, results) if is_ready]
+        for gpu_id in ready:
+            logger.info(f"  GPU {gpu_id}: {self.load_times[gpu_id]:.1f}秒")
+        logger.info(f"启动完成: {len(ready)}/{len(gpu_list)} 个服务器就绪")
+        return len(ready)
     
     def stop_all_servers(self) -> int:
         """停止所有服务器"""
@@ -135,57 +419,305 @@ class ServerManager:
                     status[gpu_id] = {
                         "status": "running",
                         "pid": process.pid,
+                        "devices": self.server_specs[gpu_id].devices if gpu_id in self.server_specs else None,
+                        "ready": gpu_id in self.load_times,
+                        "load_time": self.load_times.get(gpu_id),
+                        "restarts": self.restart_counts.get(gpu_id, 0),
                         "port": gpu_config["port"],
                         "model": gpu_config["model"],
-                        "description": gpu_config["description"]
+                        "description": gpu_config["description"],
+                        "log_file": self.get_log_path(gpu_id)
                     }
                 else:
                     # 进程已退出
                     status[gpu_id] = {
                         "status": "stopped",
                         "exit_code": poll_result,
+                        "restarts": self.restart_counts.get(gpu_id, 0),
+                        "crash_loop": gpu_id in self.crash_looping,
                         "port": gpu_config["port"],
                         "model": gpu_config["model"],
-                        "description": gpu_config["description"]
+                        "description": gpu_config["description"],
+                        "log_file": self.get_log_path(gpu_id)
                     }
-                    # 清理已退出的进程
-                    del self.processes[gpu_id]
             else:
                 status[gpu_id] = {
                     "status": "not_started",
+                    "crash_loop": gpu_id in self.crash_looping,
                     "port": gpu_config["port"],
                     "model": gpu_config["model"],
-                    "description": gpu_config["description"]
+                    "description": gpu_config["description"],
+                    "log_file": self.get_log_path(gpu_id)
                 }
         
         return status
     
-    def monitor_servers(self, interval: int = 30):
-        """监控服务器状态"""
-        logger.info(f"开始监控服务器，检查间隔: {interval}秒")
+    async def _check_server(self, session: aiohttp.ClientSession, gpu_id: str) -> Optional[str]:
+        """检查一个服务器的进程存活和HTTP健康，返回需要重启的原因；正常或仍在加载时返回None"""
+        process = self.processes.get(gpu_id)
+        if process is None:
+            return "进程不存在"
+        if process.poll() is not None:
+            return f"进程退出，退出代码: {process.returncode}"
+        
+        status = await self._probe_health(session, gpu_id)
+        
+        if gpu_id not in self.load_times:
+            # 仍在加载模型，只受就绪超时约束
+            if status == "healthy":
+                self._mark_ready(gpu_id)
+            elif time.monotonic() - self.start_times[gpu_id] > self.ready_timeout:
+                return f"未在{self.ready_timeout}秒内就绪"
+            return None
+        
+        # 排空中的服务器仍然存活
+        if status is not None:
+            self.probe_failures[gpu_id] = 0
+            return None
+        self.probe_failures[gpu_id] += 1
+        if self.probe_failures[gpu_id] >= self.unhealthy_threshold:
+            return f"连续{self.probe_failures[gpu_id]}次健康检查失败"
+        return None
+    
+    async def _recover_server(self, gpu_id: str, reason: str):
+        """按退避重启服务器，直到它重新就绪或被判定为崩溃循环"""
+        backoff = self.backoffs.setdefault(gpu_id, RestartBackoff(
+            self.restart_backoff, self.max_restart_backoff,
+            self.crash_loop_restarts, self.crash_loop_window
+        ))
+        
+        while self.running and gpu_id in self.desired:
+            logger.warning(f"检测到服务器异常 GPU {gpu_id}: {reason}")
+            self.load_times.pop(gpu_id, None)
+            backoff.record_crash()
+            if backoff.crash_looping:
+                logger.error(f"检测到崩溃循环 GPU {gpu_id}: {backoff.window}秒内异常{len(backoff.crashes)}次，停止自动重启")
+                self.desired.discard(gpu_id)
+                self.crash_looping.add(gpu_id)
+                await self._terminate_server_async(gpu_id)
+                return
+            
+            await self._terminate_server_async(gpu_id)
+            delay = backoff.next_delay()
+            logger.info(f"{delay:.1f}秒后重启GPU {gpu_id}上的服务器")
+            await asyncio.sleep(delay)
+            if not self.running or gpu_id not in self.desired:
+                return
+            
+            self.restart_counts[gpu_id] = self.restart_counts.get(gpu_id, 0) + 1
+            # 就绪之后才算恢复服务，客户端的健康探测也只会在此之后把流量路由过来
+            await self.load_placement()
+            if self.start_server(gpu_id) and await self.wait_until_ready(gpu_id):
+                logger.info(f"服务器已恢复服务 GPU {gpu_id}, 累计重启{self.restart_counts[gpu_id]}次")
+                return
+            reason = "重启后未能就绪"
+    
+    async def monitor_servers(self, interval: float = 30):
+        """监督服务器
+        
+        每interval秒并发检查所有应运行的服务器（进程存活 + /health），
+        对退出、加载超时或连续探测失败的服务器在后台按指数退避重启，重启中的服务器不再重复检查。
+        """
+        logger.info(f"开始监督服务器，检查间隔: {interval}秒")
         self.running = True
+        recoveries = self.recoveries
         
         try:
-            while self.running:
-                status = self.get_server_status()
-                
-                # 检查是否有异常退出的服务器
-                for gpu_id, info in status.items():
-                    if info["status"] == "stopped":
-                        logger.warning(f"检测到服务器异常退出 GPU {gpu_id}, 退出代码: {info['exit_code']}")
-                        # 可以在这里添加自动重启逻辑
-                
-                # 显示状态摘要
-                running_count = sum(1 for info in status.values() if info["status"] == "running")
-                total_count = len(status)
-                logger.info(f"服务器状态: {running_count}/{total_count} 运行中")
-                
-                time.sleep(interval)
-                
-        except KeyboardInterrupt:
-            logger.info("监控被中断")
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.probe_timeout)) as session:
+                while self.running:
+                    # 配置文件修改后在后台对齐运行中的服务器
+                    self.config_store.check()
+                    for gpu_id in [gpu_id for gpu_id, task in recoveries.items() if task.done()]:
+                        del recoveries[gpu_id]
+                    
+                    checked = [
+                        gpu_id for gpu_id in self.desired
+                        if gpu_id not in recoveries and gpu_id not in self.restarting
+                    ]
+                    problems = await asyncio.gather(*(self._check_server(session, gpu_id) for gpu_id in checked))
+                    for gpu_id, problem in zip(checked, problems):
+                        if problem and self.running:
+                            recoveries[gpu_id] = asyncio.create_task(self._recover_server(gpu_id, problem))
+                    
+                    # 显示状态摘要
+                    ready_count = sum(1 for gpu_id in self.desired if gpu_id in self.load_times)
+                    logger.info(
+                        f"服务器状态: {ready_count}/{len(self.desired)} 在服务, "
+                        f"{len(recoveries)} 恢复中, {len(self.crash_looping)} 崩溃循环"
+                    )
+                    
+                    await asyncio.sleep(interval)
+                    
+        except asyncio.CancelledError:
+            logger.info("监督被中断")
         finally:
             self.running = False
+            for task in recoveries.values():
+                task.cancel()
+            await asyncio.gather(*recoveries.values(), return_exceptions=True)
+            recoveries.clear()
+    
+    def _terminate_pid(self, gpu_id: str, pid: int, timeout: float = 10) -> bool:
+        """终止不是由本管理器启动的服务器进程（例如之前的start命令启动的）"""
+        logger.info(f"停止GPU {gpu_id}上的服务器, PID: {pid}")
+        try:
+            os.kill(pid, signal.SIGTERM)
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                os.kill(pid, 0)
+                time.sleep(0.2)
+            logger.warning(f"服务器未在{timeout}秒内停止，强制终止 GPU {gpu_id}")
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        except Exception as e:
+            logger.error(f"停止服务器失败 GPU {gpu_id}: {e}")
+            return False
+        logger.info(f"服务器已停止 GPU {gpu_id}")
+        return True
+    
+    def _admin_headers(self) -> Dict[str, str]:
+        """服务器管理接口的认证头，配置了server.admin_token时携带令牌"""
+        admin_token = self.config.server_config.get("admin_token")
+        return {"Authorization": f"Bearer {admin_token}"} if admin_token else {}
+    
+    async def drain_server(self, gpu_id: str, timeout: Optional[float] = None) -> Optional[int]:
+        """让服务器进入排空状态，等待已接收的请求完成
+        
+        返回服务器进程的PID，服务器不可达时返回None。超过timeout秒仍有请求未完成时
+        只记录警告并返回，由调用方停止服务器。
+        """
+        timeout = self.drain_timeout if timeout is None else timeout
+        url = self.get_server_url(gpu_id)
+        
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.probe_timeout)) as session:
+            try:
+                async with session.post(f"{url}/admin/drain", headers=self._admin_headers()) as response:
+                    response.raise_for_status()
+                    info = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.warning(f"无法排空GPU {gpu_id}上的服务器: {e}")
+                return None
+            
+            pid = info.get("pid")
+            logger.info(f"排空GPU {gpu_id}上的服务器, 进行中: {info['in_flight']}, 排队: {info['waiting']}")
+            deadline = time.monotonic() + timeout
+            while info["in_flight"] or info["waiting"]:
+                if time.monotonic() >= deadline:
+                    logger.warning(f"排空超时 GPU {gpu_id}: 仍有{info['in_flight']}个请求进行中")
+                    break
+                await asyncio.sleep(min(self.ready_poll_interval, 1.0))
+                try:
+                    async with session.get(f"{url}/health") as response:
+                        info = await response.json()
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                    break
+            return pid
+    
+    async def restart_server(self, gpu_id: str, drain_timeout: Optional[float] = None,
+                             ready_timeout: Optional[float] = None) -> bool:
+        """排空并重启一个服务器，替换的服务器就绪后返回True"""
+        self.restarting.add(gpu_id)
+        try:
+            pid = await self.drain_server(gpu_id, drain_timeout)
+            if gpu_id in self.processes:
+                await self._terminate_server_async(gpu_id)
+            elif pid is not None:
+                await asyncio.to_thread(self._terminate_pid, gpu_id, pid)
+            await self.load_placement()
+            return self.start_server(gpu_id) and await self.wait_until_ready(gpu_id, ready_timeout)
+        finally:
+            self.restarting.discard(gpu_id)
+    
+    async def rolling_restart(self, gpu_list: Optional[List[str]] = None, drain_timeout: Optional[float] = None,
+                              ready_timeout: Optional[float] = None) -> int:
+        """滚动重启：一次只重启一个服务器，其余服务器继续提供服务
+        
+        每一步之前确认其他原本在服务的服务器仍然健康，替换的服务器就绪后才继续下一个；
+        任何一步失败即中止，保证聚合容量不低于N-1。返回成功重启的服务器数。
+        """
+        if gpu_list is None:
+            gpu_list = self.config.get_available_gpus()
+        
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.probe_timeout)) as session:
+            async def healthy(gpu_ids: List[str]) -> List[str]:
+                statuses = await asyncio.gather(*(self._probe_health(session, gpu_id) for gpu_id in gpu_ids))
+                return [gpu_id for gpu_id, status in zip(gpu_ids, statuses) if status == "healthy"]
+            
+            serving = await healthy(gpu_list)
+            restarted = 0
+            for index, gpu_id in enumerate(gpu_list, 1):
+                if gpu_id in self.recoveries:
+                    logger.warning(f"GPU {gpu_id}正在由监督器恢复，跳过")
+                    continue
+                
+                others = [other for other in serving if other != gpu_id]
+                down = sorted(set(others) - set(await healthy(others)))
+                if down:
+                    logger.error(f"GPU {', '.join(down)}不在服务，中止滚动重启以免容量低于N-1")
+                    break
+                
+                logger.info(f"滚动重启 GPU {gpu_id} ({index}/{len(gpu_list)})")
+                if not await self.restart_server(gpu_id, drain_timeout, ready_timeout):
+                    logger.error(f"GPU {gpu_id}重启后未能就绪，中止滚动重启")
+                    break
+                restarted += 1
+                if gpu_id not in serving:
+                    serving.append(gpu_id)
+        
+        logger.info(f"滚动重启完成: {restarted}/{len(gpu_list)} 个服务器已重启")
+        return restarted
+    
+    def request_rolling_restart(self):
+        """在supervise模式下由SIGHUP触发，对监督中的服务器做一次滚动重启"""
+        if self._rolling_task and not self._rolling_task.done():
+            logger.warning("滚动重启正在进行，忽略本次请求")
+            return
+        gpu_list = [gpu_id for gpu_id in self.config.get_available_gpus() if gpu_id in self.desired]
+        self._rolling_task = asyncio.ensure_future(self.rolling_restart(gpu_list))
+    
+    def _apply_config(self, old: Config, new: Config):
+        """换用新的配置快照；监督中时在后台排空删除的服务器、滚动重启修改过的服务器"""
+        added, removed, changed = diff_gpus(old, new)
+        self.config = new
+        self._planner = None
+        self._specs.clear()
+        
+        # 删除的条目立即不再监督，避免监督器按新配置重启它
+        for gpu_id in removed:
+            self.desired.discard(gpu_id)
+            self.crash_looping.discard(gpu_id)
+            recovery = self.recoveries.pop(gpu_id, None)
+            if recovery:
+                recovery.cancel()
+        
+        if self.running:
+            previous = self._reconcile_task
+            self._reconcile_task = asyncio.ensure_future(self._reconcile(previous, added, removed, changed))
+    
+    async def _reconcile(self, previous: Optional[asyncio.Task], added: List[str], removed: List[str],
+                         changed: List[str]):
+        """按新配置对齐服务器：先停止删除的，再滚动重启修改过的，最后启动新增的"""
+        if previous:
+            await asyncio.gather(previous, return_exceptions=True)
+        
+        for gpu_id in removed:
+            if gpu_id in self.processes:
+                logger.info(f"GPU条目 {gpu_id} 已从配置中删除，排空后停止")
+                await self.drain_server(gpu_id)
+                await self._terminate_server_async(gpu_id)
+        
+        changed = [gpu_id for gpu_id in changed if gpu_id in self.desired]
+        if changed:
+            logger.info(f"GPU条目 {', '.join(changed)} 的配置已修改，滚动重启")
+            await self.rolling_restart(changed)
+        
+        if added and self.start_new_servers:
+            logger.info(f"配置新增GPU条目 {', '.join(added)}，启动")
+            try:
+                await self.start_all_servers(added)
+            except PlacementError as e:
+                logger.error(f"无法启动新增的服务器: {e}")
     
     def cleanup(self):
         """清理资源"""
@@ -208,20 +740,31 @@ def signal_handler(signum, frame, manager: ServerManager):
 async def main():
     parser = argparse.ArgumentParser(description='vLLM服务器管理器')
     parser.add_argument('--action', 
-                       choices=['start', 'stop', 'restart', 'status', 'monitor'],
+                       choices=['start', 'stop', 'restart', 'status', 'monitor', 'supervise'],
                        default='start',
-                       help='执行的操作')
+                       help='执行的操作（monitor与supervise相同，保留旧名称）')
     parser.add_argument('--gpu', 
-                       help='指定GPU ID（如果不指定则操作所有GPU）')
+                       help='指定GPU ID，多个用逗号分隔，如 0,1,2（如果不指定则操作所有GPU）')
     parser.add_argument('--config', 
                        default="vllm/config/config.json", 
                        help='配置文件路径')
     parser.add_argument('--monitor-interval',
-                       type=int,
+                       type=float,
                        default=30,
                        help='监控间隔（秒）')
+    parser.add_argument('--ready-timeout',
+                       type=float,
+                       help='每个服务器等待就绪的超时（秒），默认取配置中的manager.ready_timeout')
+    parser.add_argument('--drain-timeout',
+                       type=float,
+                       help='滚动重启时等待进行中请求完成的超时（秒），默认取配置中的manager.drain_timeout')
+    parser.add_argument('--tail',
+                       type=int,
+                       default=0,
+                       help='status时显示每个服务器日志的最后N行')
     
     args = parser.parse_args()
+    gpu_list = [gpu_id.strip() for gpu_id in args.gpu.split(",") if gpu_id.strip()] if args.gpu else None
     
     manager = ServerManager(args.config)
     
@@ -231,26 +774,24 @@ async def main():
     
     try:
         if args.action == 'start':
-            if args.gpu:
-                manager.start_server(args.gpu)
-            else:
-                manager.start_all_servers()
+            requested = gpu_list or manager.config.get_available_gpus()
+            ready_count = await manager.start_all_servers(requested, args.ready_timeout)
+            if ready_count < len(requested):
+                sys.exit(1)
                 
         elif args.action == 'stop':
-            if args.gpu:
-                manager.stop_server(args.gpu)
+            if gpu_list:
+                for gpu_id in gpu_list:
+                    manager.stop_server(gpu_id)
             else:
                 manager.stop_all_servers()
                 
         elif args.action == 'restart':
-            if args.gpu:
-                manager.stop_server(args.gpu)
-                time.sleep(2)
-                manager.start_server(args.gpu)
-            else:
-                manager.stop_all_servers()
-                time.sleep(2)
-                manager.start_all_servers()
+            # 逐个排空并重启，其余服务器继续提供服务
+            requested = gpu_list or manager.config.get_available_gpus()
+            restarted = await manager.rolling_restart(requested, args.drain_timeout, args.ready_timeout)
+            if restarted < len(requested):
+                sys.exit(1)
                 
         elif args.action == 'status':
             status = manager.get_server_status()
@@ -262,12 +803,30 @@ async def main():
                 print(f"  描述: {info['description']}")
                 if info["status"] == "running":
                     print(f"  PID: {info['pid']}")
+                    if info["devices"]:
+                        print(f"  设备: {','.join(info['devices'])}")
+                    if info["ready"]:
+                        print(f"  加载耗时: {info['load_time']:.1f}秒")
                 elif info["status"] == "stopped":
                     print(f"  退出代码: {info['exit_code']}")
+                if info.get("restarts"):
+                    print(f"  重启次数: {info['restarts']}")
+                if info.get("crash_loop"):
+                    print("  崩溃循环: 已停止自动重启")
+                print(f"  日志: {info['log_file']}")
+                if args.tail:
+                    for line in manager.tail_log(gpu_id, args.tail):
+                        print(f"    {line}")
                 print()
                 
-        elif args.action == 'monitor':
-            manager.monitor_servers(args.monitor_interval)
+        elif args.action in ('supervise', 'monitor'):
+            # 启动服务器后留在前台监督，异常退出的服务器自动重启；
+            # 新进程里没有它启动的服务器可监督，所以monitor也先启动服务器
+            await manager.start_all_servers(gpu_list, args.ready_timeout)
+            manager.start_new_servers = gpu_list is None
+            # kill -HUP <pid> 对监督中的服务器做一次滚动重启
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, manager.request_rolling_restart)
+            await manager.monitor_servers(args.monitor_interval)
             
     except Exception as e:
         logger.error(f"操作失败: {e}")
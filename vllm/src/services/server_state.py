@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Server State - 客户端侧缓存的单个vLLM服务器状态
+
+由后台健康探测（主动）和请求结果（被动）共同更新，路由时只读取这里的状态，
+不在请求路径上做探测。
+"""
+
+import time
+from typing import Dict, Any, Optional
+
+class CircuitBreaker:
+    """按请求结果判断的熔断器
+
+    连续failure_threshold次失败后打开，reset_timeout秒内不再接收请求；
+    之后进入半开状态，只放行一个试探请求，成功则关闭，失败则重新打开。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self._state = self.CLOSED
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def allows_request(self) -> bool:
+        state = self.state
+        return state == self.CLOSED or (state == self.HALF_OPEN and not self.trial_in_flight)
+
+    def on_request_start(self):
+        if self.state == self.HALF_OPEN:
+            self._state = self.HALF_OPEN
+            self.trial_in_flight = True
+
+    def on_request_end(self):
+        # 试探请求没有明确结果（例如被取消或返回429）时，允许下一个请求继续试探
+        self.trial_in_flight = False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self._state = self.CLOSED
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._state = self.OPEN
+            self.opened_at = time.monotonic()
+
+class ServerState:
+    """单个服务器的健康和负载状态"""
+
+    def __init__(
+        self,
+        gpu_id: str,
+        url: str,
+        unhealthy_threshold: int = 2,
+        healthy_threshold: int = 1,
+        ewma_alpha: float = 0.3,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self.gpu_id = gpu_id
+        self.url = url
+        self.unhealthy_threshold = unhealthy_threshold
+        self.healthy_threshold = healthy_threshold
+
+        # None表示尚未探测过
+        self.healthy: Optional[bool] = None
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        self.last_checked: Optional[float] = None
+        self.last_error: Optional[str] = None
+        # 最近一次/health返回的内容
+        self.health_info: Dict[str, Any] = {}
+
+        # 负载统计，供路由策略使用
+        self.ewma_alpha = ewma_alpha
+        self.outstanding = 0
+        # 在客户端侧（例如网关的每服务器队列）排队、尚未发出的请求数
+        self.queued = 0
+        self.completed = 0
+        self.ewma_latency: Optional[float] = None
+        self.ewma_time_per_token: Optional[float] = None
+
+        self.breaker = breaker or CircuitBreaker()
+
+    @property
+    def draining(self) -> bool:
+        """服务器在最近一次/health中报告正在排空"""
+        return self.health_info.get("status") == "draining"
+    
+    @property
+    def available(self) -> bool:
+        """是否可以接收新请求：健康、未在排空且熔断器放行"""
+        return bool(self.healthy) and not self.draining and self.breaker.allows_request()
+
+    @property
+    def load(self) -> int:
+        """估计的负载：本客户端未完成的请求数与服务器上报的执行数取大，再加上两侧的排队数"""
+        in_flight = self.health_info.get("in_flight", 0)
+        waiting = self.health_info.get("waiting", 0)
+        return max(self.outstanding, in_flight) + waiting + self.queued
+
+    def _ewma(self, current: Optional[float], sample: float) -> float:
+        if current is None:
+            return sample
+        return current + self.ewma_alpha * (sample - current)
+
+    def on_request_start(self):
+        self.outstanding += 1
+        self.breaker.on_request_start()
+
+    def on_request_end(self, elapsed: Optional[float] = None, completion_tokens: Optional[int] = None):
+        """请求结束；elapsed为None表示请求失败，不计入延迟统计"""
+        self.outstanding -= 1
+        self.breaker.on_request_end()
+        if elapsed is None:
+            return
+        self.completed += 1
+        self.ewma_latency = self._ewma(self.ewma_latency, elapsed)
+        if completion_tokens:
+            self.ewma_time_per_token = self._ewma(self.ewma_time_per_token, elapsed / completion_tokens)
+
+    def record_success(self, health_info: Optional[Dict[str, Any]] = None):
+        """记录一次成功的探测或请求"""
+        self.last_checked = time.monotonic()
+        self.consecutive_failures = 0
+        self.consecutive_successes += 1
+        if health_info is not None:
+            self.health_info = health_info
+        if self.healthy is None or self.consecutive_successes >= self.healthy_threshold:
+            self.healthy = True
+
+    def record_failure(self, error: str):
+        """记录一次失败的探测或请求"""
+        self.last_checked = time.monotonic()
+        self.last_error = error
+        self.consecutive_successes = 0
+        self.consecutive_failures += 1
+        if self.healthy is None or self.consecutive_failures >= self.unhealthy_threshold:
+            self.healthy = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        """以check_server_health相同的格式导出"""
+        result = {
+            "gpu_id": self.gpu_id,
+            "status": "healthy" if self.available else ("draining" if self.draining else "unhealthy"),
+            "url": self.url,
+            "circuit": self.breaker.state,
+        }
+        if self.available or self.draining:
+            result["response"] = self.health_info
+        else:
+            result["error"] = self.last_error or "尚未探测"
+        return result
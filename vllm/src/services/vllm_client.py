@@ -5,36 +5,272 @@ vLLM Client - 用于连接和管理多个vLLM服务器的客户端
 
 import asyncio
 import aiohttp
+import collections
+import json
 import logging
-from typing import Dict, List, Optional, Any
-from ..utils.config import Config
+import random
+import time
+from typing import Dict, List, Optional, Any, AsyncIterable, AsyncIterator, Iterable, Tuple, Union
+from ..utils.config import Config, diff_gpus, get_config_store
+from ..utils.metrics import LatencyWindow
+from .server_state import CircuitBreaker, ServerState
+from .routing import RoutingPolicy, create_policy
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 换一个副本重试有意义的HTTP状态码：过载和暂时不可用
+RETRYABLE_STATUSES = (429, 503)
+# 计入熔断器的HTTP状态码：服务器出错或不可用。504是调用方给的截止时间已过，
+# 与服务器是否健康无关，截止时间短的调用方不应因此熔断健康的服务器
+FAILURE_STATUSES = (500, 502, 503)
+# 服务器暂时无法完成请求的HTTP状态码，稍后重新提交可能成功（504为截止时间已过）
+TRANSIENT_STATUSES = RETRYABLE_STATUSES + (504,)
+
+class NoServerAvailable(Exception):
+    """没有健康的服务器可以接收请求"""
+
+# generate_many的输入：prompt字符串，或包含"prompt"和采样参数的字典
+PromptItem = Union[str, Dict[str, Any]]
+GENERATION_PARAMS = ("max_tokens", "temperature", "top_p", "top_k", "stop", "cache")
+
+class UpstreamError(Exception):
+    """服务器返回了非200响应"""
+
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+
 class VLLMClient:
     """vLLM客户端类"""
     
     def __init__(self, config_path: str = "vllm/config/config.json"):
-        self.config = Config(config_path)
+        # 进程内共用的配置快照；GPU条目的增删改在运行中生效，其余客户端配置只在创建时读取
+        self.config_store = get_config_store(config_path)
+        self.config: Config = self.config_store.snapshot
         self.client_config = self.config.config.get("client", {})
         self.timeout = self.client_config.get("default_timeout", 300)
         self.retry_attempts = self.client_config.get("retry_attempts", 3)
         self.retry_delay = self.client_config.get("retry_delay", 1)
         self.session = None
         
-    async def __aenter__(self):
-        """异步上下文管理器入口"""
+        # 后台健康探测，路由时读取缓存的状态而不在请求路径上探测
+        routing_config = self.client_config.get("routing", {})
+        self.routing_policy: RoutingPolicy = create_policy(
+            routing_config.get("policy", "least_outstanding"), routing_config)
+        
+        # 失败重试、对冲请求和熔断
+        failover_config = self.client_config.get("failover", {})
+        self.max_attempts = failover_config.get("max_attempts", 3)
+        self.backoff = failover_config.get("backoff", 0.05)
+        self.max_backoff = failover_config.get("max_backoff", 2.0)
+        
+        hedging_config = self.client_config.get("hedging", {})
+        self.hedging_enabled = hedging_config.get("enabled", False)
+        self.hedge_percentile = hedging_config.get("percentile", 95)
+        self.hedge_min_delay = hedging_config.get("min_delay", 0.05)
+        self.hedge_min_samples = hedging_config.get("min_samples", 20)
+        self.hedge_window = hedging_config.get("window", 500)
+        # 模型名称 -> 最近的成功请求延迟
+        self.latencies: Dict[str, LatencyWindow] = {}
+        
+        health_config = self.client_config.get("health_check", {})
+        self.health_check_enabled = health_config.get("enabled", True)
+        self.health_check_interval = health_config.get("interval", 5)
+        self.health_check_timeout = health_config.get("timeout", 2)
+        self.server_states: Dict[str, ServerState] = {
+            gpu_id: self._new_state(gpu_id) for gpu_id in self.config.get_available_gpus()
+        }
+        # 已从配置中删除的GPU -> 模型名称，进行中的请求完成时仍要记录延迟
+        self._retired_models: Dict[str, str] = {}
+        self._health_task: Optional[asyncio.Task] = None
+        self._health_ready: Optional[asyncio.Event] = None
+        
+    def _new_state(self, gpu_id: str) -> ServerState:
+        """按当前配置创建一个服务器的状态"""
+        health_config = self.client_config.get("health_check", {})
+        breaker_config = self.client_config.get("circuit_breaker", {})
+        return ServerState(
+            gpu_id,
+            self.get_server_url(gpu_id),
+            unhealthy_threshold=health_config.get("unhealthy_threshold", 2),
+            healthy_threshold=health_config.get("healthy_threshold", 1),
+            ewma_alpha=self.client_config.get("routing", {}).get("ewma_alpha", 0.3),
+            breaker=CircuitBreaker(
+                failure_threshold=breaker_config.get("failure_threshold", 5),
+                reset_timeout=breaker_config.get("reset_timeout", 10)
+            )
+        )
+    
+    def _apply_config(self, old: Config, new: Config):
+        """换用新的配置快照并增删服务器状态
+        
+        删除的服务器立即不再参与路由，进行中的请求继续使用原来的连接完成；
+        新增或端口变化的服务器从未探测的状态开始，下一轮健康探测后接收流量。
+        """
+        added, removed, changed = diff_gpus(self.config, new)
+        for gpu_id in removed:
+            self._retired_models[gpu_id] = self.config.get_model_name(gpu_id)
+            self.server_states.pop(gpu_id, None)
+        self.config = new
+        for gpu_id in added + changed:
+            self._retired_models.pop(gpu_id, None)
+            state = self.server_states.get(gpu_id)
+            if state is None or state.url != self.get_server_url(gpu_id):
+                self.server_states[gpu_id] = self._new_state(gpu_id)
+        if added or removed or changed:
+            logger.info(f"客户端已更新服务器列表: {sorted(self.server_states)}")
+    
+    async def start(self):
+        """创建带keep-alive连接池的会话，并启动后台健康探测"""
+        if self.session:
+            return
+        
+        # 跟随配置文件的修改；创建之后已经重新加载过的先补上
+        self.config_store.subscribe(self._apply_config)
+        if self.config is not self.config_store.snapshot:
+            self._apply_config(self.config, self.config_store.snapshot)
+        
+        pool_config = self.client_config.get("pool", {})
+        connector = aiohttp.TCPConnector(
+            limit=pool_config.get("limit", 256),
+            limit_per_host=pool_config.get("limit_per_host", 64),
+            keepalive_timeout=pool_config.get("keepalive_timeout", 60),
+            ttl_dns_cache=pool_config.get("dns_cache_ttl", 300),
+            use_dns_cache=True
+        )
         self.session = aiohttp.ClientSession(
+            connector=connector,
             timeout=aiohttp.ClientTimeout(total=self.timeout)
         )
+        
+        if self.health_check_enabled:
+            self._health_ready = asyncio.Event()
+            self._health_task = asyncio.ensure_future(self._health_loop())
+    
+    async def close(self):
+        """停止健康探测，关闭会话和连接池"""
+        self.config_store.unsubscribe(self._apply_config)
+        if self._health_task:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        
+        if self.session:
+            await self.session.close()
+            self.session = None
+    
+    async def _health_loop(self):
+        """按固定间隔检查配置文件是否修改，并探测所有服务器"""
+        while True:
+            try:
+                self.config_store.check()
+                await self.refresh_health()
+            except Exception as e:
+                logger.error(f"后台健康探测出错: {e}")
+            self._health_ready.set()
+            await asyncio.sleep(self.health_check_interval)
+    
+    async def _probe(self, gpu_id: str):
+        """单次探测服务器的/health，不重试，结果写入缓存状态"""
+        state = self.server_states[gpu_id]
+        try:
+            async with self.session.get(
+                f"{state.url}/health",
+                timeout=aiohttp.ClientTimeout(total=self.health_check_timeout)
+            ) as response:
+                if response.status == 200:
+                    state.record_success(await response.json())
+                else:
+                    state.record_failure(f"HTTP {response.status}")
+        except Exception as e:
+            state.record_failure(str(e) or type(e).__name__)
+    
+    async def refresh_health(self):
+        """并发探测所有服务器一次"""
+        await asyncio.gather(*[self._probe(gpu_id) for gpu_id in self.server_states])
+    
+    async def _ensure_health(self):
+        """保证缓存状态可用：后台探测运行时等待首轮完成，否则立即探测一次"""
+        if self._health_task and not self._health_task.done():
+            await self._health_ready.wait()
+        else:
+            await self.refresh_health()
+    
+    def _record_failure(self, gpu_id: str, error: Exception):
+        """请求失败时被动更新服务器状态和熔断器
+
+        只统计连接错误（包括连接和读取超时）；整个请求超过调用方的截止时间不计。
+        """
+        if isinstance(error, aiohttp.ClientConnectionError) and gpu_id in self.server_states:
+            state = self.server_states[gpu_id]
+            state.record_failure(str(error) or type(error).__name__)
+            state.breaker.record_failure()
+    
+    def _record_response(self, gpu_id: str, status: int):
+        """根据HTTP状态码被动更新服务器状态和熔断器，500、502和503视为失败，其余错误状态不计"""
+        state = self.server_states.get(gpu_id)
+        if state is None:
+            return
+        if status in FAILURE_STATUSES:
+            state.record_failure(f"HTTP {status}")
+            state.breaker.record_failure()
+        elif status < 400:
+            state.record_success()
+            state.breaker.record_success()
+    
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """连接错误和429/503可以换一个副本重试；超时说明期限已用完，不再重试"""
+        if isinstance(error, UpstreamError):
+            return error.status in RETRYABLE_STATUSES
+        return isinstance(error, aiohttp.ClientConnectionError) and not isinstance(error, asyncio.TimeoutError)
+    
+    @staticmethod
+    def _is_transient(error: Exception) -> bool:
+        """没有健康的服务器、过载、暂时不可用、连接错误和超时：稍后重新提交可能成功"""
+        if isinstance(error, UpstreamError):
+            return error.status in TRANSIENT_STATUSES
+        return isinstance(error, (NoServerAvailable, aiohttp.ClientConnectionError, asyncio.TimeoutError))
+    
+    def _backoff_delay(self, attempt: int, error: Exception, same_server: bool) -> float:
+        """带抖动的指数退避；在同一服务器上重试时不早于它给出的Retry-After"""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+        if same_server and isinstance(error, UpstreamError) and error.retry_after:
+            delay = max(delay, min(error.retry_after, self.max_backoff))
+        return delay
+    
+    def _alternate_server(self, gpu_id: str, exclude: List[str], prompt: Optional[str] = None) -> Optional[str]:
+        """在gpu_id所属模型的副本组中选择一个未尝试过的可用副本"""
+        replicas = self.config.get_replicas(self._model_name(gpu_id))
+        candidates = [
+            self.server_states[replica] for replica in replicas
+            if replica not in exclude and self.server_states[replica].available
+        ]
+        if not candidates:
+            return None
+        return self.routing_policy.select(candidates, prompt).gpu_id
+    
+    def _failover_target(self, gpu_id: str, tried: List[str], prompt: Optional[str] = None) -> Optional[str]:
+        """重试目标：优先换一个副本，没有其他副本时仍可用的原服务器"""
+        target = self._alternate_server(gpu_id, tried, prompt)
+        if target is None and gpu_id in self.server_states and self.server_states[gpu_id].available:
+            target = gpu_id
+        return target
+    
+    async def __aenter__(self):
+        """异步上下文管理器入口"""
+        await self.start()
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """异步上下文管理器出口"""
-        if self.session:
-            await self.session.close()
+        await self.close()
     
     def get_server_url(self, gpu_id: str) -> str:
         """获取指定GPU服务器的URL"""
@@ -54,6 +290,7 @@ class VLLMClient:
             servers[gpu_id] = {
                 "gpu_id": gpu_id,
                 "model": gpu_config["model"],
+                "name": self.config.get_model_name(gpu_id),
                 "description": gpu_config["description"],
                 "port": gpu_config["port"],
                 "url": self.get_server_url(gpu_id)
@@ -72,6 +309,7 @@ class VLLMClient:
                 async with self.session.get(url) as response:
                     if response.status == 200:
                         data = await response.json()
+                        self.server_states[gpu_id].record_success(data)
                         return {
                             "gpu_id": gpu_id,
                             "status": "healthy",
@@ -86,6 +324,7 @@ class VLLMClient:
                 if attempt < self.retry_attempts - 1:
                     await asyncio.sleep(self.retry_delay)
         
+        self.server_states[gpu_id].record_failure("健康检查失败")
         return {
             "gpu_id": gpu_id,
             "status": "unhealthy",
@@ -111,6 +350,10 @@ class VLLMClient:
             logger.error(f"获取服务器信息失败 GPU {gpu_id}: {e}")
             raise e
     
+    def _deadline_headers(self) -> Dict[str, str]:
+        """把客户端超时告知服务器，超时后服务器会中止生成"""
+        return {"X-Request-Timeout": str(self.timeout)}
+    
     async def generate_text(
         self,
         gpu_id: str,
@@ -119,35 +362,256 @@ class VLLMClient:
         temperature: float = 0.7,
         top_p: float = 0.95,
         top_k: int = -1,
-        stop: Optional[List[str]] = None
+        stop: Optional[List[str]] = None,
+        cache: bool = True
     ) -> Dict[str, Any]:
-        """在指定GPU上生成文本"""
+        """在指定GPU上生成文本
+
+        连接错误、429和503会在同一模型的其他副本上退避重试（共max_attempts次）；
+        开启对冲时，超过该模型延迟分位数仍未返回的请求会在另一个副本上再发一份，
+        先返回的结果生效，另一份被取消。
+        """
         if not self.session:
             raise RuntimeError("客户端会话未初始化，请使用async with语句")
         
-        url = f"{self.get_server_url(gpu_id)}/generate"
         data = {
             "prompt": prompt,
             "max_tokens": max_tokens,
             "temperature": temperature,
             "top_p": top_p,
             "top_k": top_k,
-            "stop": stop
+            "stop": stop,
+            "cache": cache
         }
         
+        tried: List[str] = []
+        target = gpu_id
+        for attempt in range(1, self.max_attempts + 1):
+            tried.append(target)
+            try:
+                if self.hedging_enabled:
+                    result = await self._hedged_generate(target, data, tried)
+                else:
+                    result = await self._post_generate(target, data)
+                logger.info(f"文本生成成功 GPU {result.get('gpu_id', target)}: {len(result.get('text', ''))} 字符")
+                return result
+            except Exception as e:
+                next_target = None
+                if attempt < self.max_attempts and self._is_retryable(e):
+                    next_target = self._failover_target(target, tried, prompt)
+                if next_target is None:
+                    logger.error(f"文本生成失败 GPU {target}: {e}")
+                    raise e
+                
+                delay = self._backoff_delay(attempt, e, next_target == target)
+                logger.warning(f"文本生成失败 GPU {target}: {e}，{delay:.2f}秒后在GPU {next_target}上重试")
+                await asyncio.sleep(delay)
+                target = next_target
+    
+    async def _post_generate(self, gpu_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """向一个服务器发送一次/generate请求，不重试"""
+        url = f"{self.get_server_url(gpu_id)}/generate"
+        state = self.server_states[gpu_id]
+        state.on_request_start()
+        start = time.monotonic()
+        elapsed = None
+        completion_tokens = None
         try:
-            async with self.session.post(url, json=data) as response:
+            async with self.session.post(url, json=data, headers=self._deadline_headers()) as response:
+                self._record_response(gpu_id, response.status)
                 if response.status == 200:
                     result = await response.json()
-                    logger.info(f"文本生成成功 GPU {gpu_id}: {len(result.get('text', ''))} 字符")
+                    elapsed = time.monotonic() - start
+                    completion_tokens = result.get("completion_tokens")
+                    self._latency_window(gpu_id).observe(elapsed)
                     return result
                 else:
-                    error_text = await response.text()
-                    raise Exception(f"HTTP {response.status}: {error_text}")
+                    raise await self._upstream_error(response)
                     
         except Exception as e:
-            logger.error(f"文本生成失败 GPU {gpu_id}: {e}")
+            self._record_failure(gpu_id, e)
             raise e
+        finally:
+            state.on_request_end(elapsed, completion_tokens)
+    
+    @staticmethod
+    async def _upstream_error(response: aiohttp.ClientResponse) -> UpstreamError:
+        retry_after = response.headers.get("Retry-After")
+        try:
+            retry_after = float(retry_after) if retry_after is not None else None
+        except ValueError:
+            retry_after = None
+        return UpstreamError(response.status, await response.text(), retry_after)
+    
+    def _model_name(self, gpu_id: str) -> str:
+        """GPU的模型名称，已从配置中删除的GPU取删除前的名称"""
+        if gpu_id in self._retired_models:
+            return self._retired_models[gpu_id]
+        return self.config.get_model_name(gpu_id)
+    
+    def _latency_window(self, gpu_id: str) -> LatencyWindow:
+        model = self._model_name(gpu_id)
+        window = self.latencies.get(model)
+        if window is None:
+            window = self.latencies[model] = LatencyWindow(self.hedge_window)
+        return window
+    
+    def _hedge_delay(self, gpu_id: str) -> Optional[float]:
+        """对冲等待时间：该模型最近延迟的分位数，样本不足时不对冲"""
+        window = self._latency_window(gpu_id)
+        if len(window) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, window.percentile(self.hedge_percentile))
+    
+    async def _hedged_generate(self, gpu_id: str, data: Dict[str, Any], tried: List[str]) -> Dict[str, Any]:
+        """主请求超过对冲等待时间仍未返回时，在另一个副本上发送备份请求"""
+        primary = asyncio.ensure_future(self._post_generate(gpu_id, data))
+        pending = {primary}
+        try:
+            delay = self._hedge_delay(gpu_id)
+            if delay is not None:
+                done, pending = await asyncio.wait(pending, timeout=delay)
+                if done:
+                    return primary.result()
+                
+                backup_target = self._alternate_server(gpu_id, tried, data["prompt"])
+                if backup_target is not None:
+                    logger.info(f"GPU {gpu_id} 超过{delay:.2f}秒未返回，在GPU {backup_target}上发送对冲请求")
+                    tried.append(backup_target)
+                    pending.add(asyncio.ensure_future(self._post_generate(backup_target, data)))
+            
+            # 第一个成功的结果生效；都失败时抛出最后一个错误
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # 取消仍在进行的请求，关闭连接后服务器会中止生成
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+    
+    async def _stream_events(
+        self,
+        gpu_id: str,
+        prompt: str,
+        max_tokens: int = 2048,
+        temperature: float = 0.7,
+        top_p: float = 0.95,
+        top_k: int = -1,
+        stop: Optional[List[str]] = None,
+        cache: bool = True
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """逐条解析服务器/generate_stream返回的事件"""
+        if not self.session:
+            raise RuntimeError("客户端会话未初始化，请使用async with语句")
+        
+        url = f"{self.get_server_url(gpu_id)}/generate_stream"
+        data = {
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "stop": stop,
+            "cache": cache
+        }
+        
+        state = self.server_states[gpu_id]
+        state.on_request_start()
+        start = time.monotonic()
+        elapsed = None
+        completion_tokens = None
+        try:
+            async with self.session.post(url, json=data, headers=self._deadline_headers()) as response:
+                self._record_response(gpu_id, response.status)
+                if response.status != 200:
+                    raise await self._upstream_error(response)
+                
+                async for event in self._read_events(response):
+                    if event.get("finished"):
+                        elapsed = time.monotonic() - start
+                        completion_tokens = event.get("completion_tokens")
+                    yield event
+        finally:
+            state.on_request_end(elapsed, completion_tokens)
+    
+    @staticmethod
+    async def _read_events(response: aiohttp.ClientResponse) -> AsyncIterator[Dict[str, Any]]:
+        """按行解析SSE事件直到结束事件；未读到结束事件就退出时关闭连接"""
+        finished = False
+        try:
+            # 按行读取，不缓冲整个响应体
+            async for raw_line in response.content:
+                line = raw_line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                
+                event = json.loads(line[len("data:"):])
+                if "error" in event:
+                    finished = True
+                    raise Exception(event["error"])
+                
+                if event.get("finished"):
+                    finished = True
+                yield event
+                if finished:
+                    break
+        finally:
+            if not finished:
+                # 调用方提前退出，直接关闭连接以便服务器停止生成
+                response.close()
+    
+    async def generate_stream(
+        self,
+        gpu_id: str,
+        prompt: str,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """在指定GPU上流式生成文本，逐个产出增量文本"""
+        async for event in self.stream_events(gpu_id, prompt, **kwargs):
+            if event.get("delta"):
+                yield event["delta"]
+    
+    async def stream_events(
+        self,
+        gpu_id: str,
+        prompt: str,
+        **kwargs
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """在指定GPU上流式生成文本，逐个产出服务器事件（包括带token计数的结束事件）
+
+        收到第一个事件之前的可重试失败会像generate_text一样换副本重试；
+        之后的失败直接抛出，避免重复输出。
+        """
+        tried: List[str] = []
+        target = gpu_id
+        for attempt in range(1, self.max_attempts + 1):
+            tried.append(target)
+            started = False
+            try:
+                async for event in self._stream_events(target, prompt, **kwargs):
+                    started = True
+                    yield event
+                return
+            except Exception as e:
+                self._record_failure(target, e)
+                next_target = None
+                if not started and attempt < self.max_attempts and self._is_retryable(e):
+                    next_target = self._failover_target(target, tried, prompt)
+                if next_target is None:
+                    logger.error(f"流式生成失败 GPU {target}: {e}")
+                    raise e
+                
+                delay = self._backoff_delay(attempt, e, next_target == target)
+                logger.warning(f"流式生成失败 GPU {target}: {e}，{delay:.2f}秒后在GPU {next_target}上重试")
+                await asyncio.sleep(delay)
+                target = next_target
     
     async def check_all_servers(self) -> Dict[str, Dict]:
         """检查所有服务器的健康状态"""
@@ -166,74 +630,291 @@ class VLLMClient:
         
         return health_status
     
+    def _preferred_replicas(self, preferred_model: str, candidates: List[ServerState]) -> List[ServerState]:
+        """模型名称或别名精确匹配副本组，否则按模型路径子串匹配"""
+        replicas = self.config.get_replicas(preferred_model)
+        if replicas:
+            return [state for state in candidates if state.gpu_id in replicas]
+        return [
+            state for state in candidates
+            if preferred_model.lower() in self.config.get_gpu_config(state.gpu_id)["model"].lower()
+        ]
+    
+    async def candidate_servers(
+        self,
+        model_preference: Optional[List[str]] = None,
+        model: Optional[str] = None
+    ) -> List[ServerState]:
+        """可以接收请求的候选服务器
+
+        指定model（模型名称或别名）时只在该模型的副本组中选择；
+        model_preference按顺序取第一个有健康副本的模型，都没有时使用所有健康的服务器。
+        """
+        if model is not None:
+            replicas = self.config.get_replicas(model)
+            if not replicas:
+                raise ValueError(f"未配置的模型: {model}")
+        
+        # 读取缓存的健康状态
+        await self._ensure_health()
+        if model is not None:
+            candidates = [self.server_states[gpu_id] for gpu_id in replicas]
+            candidates = [state for state in candidates if state.available]
+            if not candidates:
+                raise NoServerAvailable(f"模型 {model} 没有健康的副本可用")
+        else:
+            candidates = [state for state in self.server_states.values() if state.available]
+            if not candidates:
+                raise NoServerAvailable("没有健康的服务器可用")
+        
+        # 根据模型偏好缩小候选范围
+        if model_preference:
+            for preferred_model in model_preference:
+                matching = self._preferred_replicas(preferred_model, candidates)
+                if matching:
+                    candidates = matching
+                    break
+        return candidates
+    
+    async def select_best_server(
+        self,
+        model_preference: Optional[List[str]] = None,
+        prompt: Optional[str] = None,
+        model: Optional[str] = None
+    ) -> str:
+        """用路由策略从候选服务器中选择最佳可用服务器"""
+        candidates = await self.candidate_servers(model_preference, model)
+        target_server = self.routing_policy.select(candidates, prompt).gpu_id
+        logger.info(f"选择服务器 GPU {target_server} 进行文本生成")
+        return target_server
+    
     async def generate_on_best_server(
         self,
         prompt: str,
         model_preference: Optional[List[str]] = None,
+        model: Optional[str] = None,
         **kwargs
     ) -> Dict[str, Any]:
         """在最佳可用服务器上生成文本"""
-        # 检查所有服务器健康状态
-        health_status = await self.check_all_servers()
-        healthy_servers = [
-            gpu_id for gpu_id, status in health_status.items()
-            if status.get("status") == "healthy"
-        ]
+        target_server = await self.select_best_server(model_preference, prompt, model)
+        return await self.generate_text(target_server, prompt, **kwargs)
+    
+    async def generate_many(
+        self,
+        prompts: Union[Iterable[PromptItem], AsyncIterable[PromptItem]],
+        concurrency: Optional[int] = None,
+        model_preference: Optional[List[str]] = None,
+        model: Optional[str] = None,
+        per_server_concurrency: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """并发生成大量prompt，按完成顺序产出结果
+
+        prompts可以是字符串或包含"prompt"及采样参数的字典，按需从（异步）迭代器中读取：
+        最多concurrency个请求同时进行，调用方消费结果变慢时不再读取新的输入，
+        因此内存占用与输入总量无关。每个服务器同时最多per_server_concurrency个请求。
+        没有健康的服务器、429、503和连接错误时按failover的退避（不早于Retry-After）重试，
+        直到default_timeout秒后仍失败或遇到不可重试的错误才作为失败返回。
+        每个结果为{"index", "input", "result", "error", "transient"}，单条失败只记录在error中，
+        transient表示失败是暂时的（没有健康的服务器、429、503、超时等），稍后重新提交可能成功。
+        """
+        if not self.session:
+            raise RuntimeError("客户端会话未初始化，请使用async with语句")
         
-        if not healthy_servers:
-            raise Exception("没有健康的服务器可用")
+        bulk_config = self.client_config.get("bulk", {})
+        concurrency = concurrency or bulk_config.get("concurrency", 64)
+        server_limit = per_server_concurrency or bulk_config.get("per_server_concurrency", 32)
         
-        # 根据模型偏好选择服务器
-        target_server = None
-        if model_preference:
-            for preferred_model in model_preference:
-                for gpu_id in healthy_servers:
-                    gpu_config = self.config.get_gpu_config(gpu_id)
-                    if preferred_model.lower() in gpu_config["model"].lower():
-                        target_server = gpu_id
-                        break
-                if target_server:
-                    break
+        items = self._enumerate_prompts(prompts)
+        input_lock = asyncio.Lock()
+        capacity = asyncio.Condition()
+        # 热加载可能在批处理过程中增加服务器，计数按需创建
+        active: Dict[str, int] = collections.defaultdict(int)
+        results: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
         
-        # 如果没有找到偏好模型，选择第一个健康的服务器
-        if not target_server:
-            target_server = healthy_servers[0]
+        async def acquire_server(prompt: str) -> str:
+            while True:
+                # 获取候选服务器可能要做健康检查，不能持有条件锁，否则所有worker和notify都要等它
+                servers = await self.candidate_servers(model_preference, model)
+                async with capacity:
+                    candidates = [state for state in servers if active[state.gpu_id] < server_limit]
+                    if candidates:
+                        gpu_id = self.routing_policy.select(candidates, prompt).gpu_id
+                        active[gpu_id] += 1
+                        return gpu_id
+                    await capacity.wait()
         
-        logger.info(f"选择服务器 GPU {target_server} 进行文本生成")
-        return await self.generate_text(target_server, prompt, **kwargs)
+        async def release_server(gpu_id: str):
+            async with capacity:
+                active[gpu_id] -= 1
+                capacity.notify()
+        
+        async def generate_item(index: int, item: PromptItem) -> Dict[str, Any]:
+            # 没有健康的服务器或服务器过载时退避等待，而不是让整批请求全速失败
+            deadline = time.monotonic() + self.timeout
+            attempt = 0
+            while True:
+                try:
+                    if isinstance(item, str):
+                        prompt, params = item, kwargs
+                    else:
+                        prompt = item["prompt"]
+                        params = dict(kwargs, **{key: item[key] for key in GENERATION_PARAMS if key in item})
+                    
+                    gpu_id = await acquire_server(prompt)
+                    try:
+                        result = await self.generate_text(gpu_id, prompt, **params)
+                    finally:
+                        await release_server(gpu_id)
+                    return {"index": index, "input": item, "result": result, "error": None, "transient": False}
+                except Exception as e:
+                    attempt += 1
+                    delay = self._backoff_delay(attempt, e, same_server=True)
+                    waitable = isinstance(e, NoServerAvailable) or self._is_retryable(e)
+                    if not waitable or time.monotonic() + delay > deadline:
+                        return {
+                            "index": index, "input": item, "result": None,
+                            "error": str(e) or type(e).__name__, "transient": self._is_transient(e)
+                        }
+                    logger.info(f"第{index}条请求暂时失败: {e}，{delay:.2f}秒后重试")
+                    await asyncio.sleep(delay)
+        
+        async def worker():
+            try:
+                while True:
+                    async with input_lock:
+                        try:
+                            index, item = await items.__anext__()
+                        except StopAsyncIteration:
+                            break
+                    await results.put(await generate_item(index, item))
+            except Exception as e:
+                # 读取输入出错，交给调用方
+                await results.put(e)
+            else:
+                await results.put(None)
+        
+        workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+        try:
+            remaining = len(workers)
+            while remaining:
+                result = await results.get()
+                if result is None:
+                    remaining -= 1
+                elif isinstance(result, Exception):
+                    raise result
+                else:
+                    yield result
+        finally:
+            # 调用方提前退出或出错时取消所有进行中的请求
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+    
+    @staticmethod
+    async def _enumerate_prompts(
+        prompts: Union[Iterable[PromptItem], AsyncIterable[PromptItem]]
+    ) -> AsyncIterator[Tuple[int, PromptItem]]:
+        """把同步或异步可迭代对象统一为按需读取的(index, item)异步迭代器"""
+        index = 0
+        if hasattr(prompts, "__aiter__"):
+            async for item in prompts:
+                yield index, item
+                index += 1
+        else:
+            for item in prompts:
+                yield index, item
+                index += 1
 
 class VLLMClientManager:
-    """vLLM客户端管理器 - 简化常用操作"""
+    """vLLM客户端管理器 - 简化常用操作
+
+    管理器持有一个长期存在的VLLMClient，所有调用共享同一个连接池；
+    使用完毕后调用close()，或使用async with语句。
+    """
     
     def __init__(self, config_path: str = "vllm/config/config.json"):
         self.config_path = config_path
+        self._client: Optional[VLLMClient] = None
+    
+    async def get_client(self) -> VLLMClient:
+        """返回共享的客户端，首次调用时创建"""
+        if self._client is None:
+            client = VLLMClient(self.config_path)
+            await client.start()
+            self._client = client
+        return self._client
+    
+    async def close(self):
+        """关闭共享的客户端"""
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.close()
+    
+    async def __aenter__(self):
+        await self.get_client()
+        return self
+    
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
     
     async def list_servers(self) -> Dict[str, Dict]:
         """列出所有服务器"""
-        async with VLLMClient(self.config_path) as client:
-            return client.list_available_servers()
+        client = await self.get_client()
+        return client.list_available_servers()
     
     async def check_health(self, gpu_id: Optional[str] = None) -> Dict[str, Dict]:
         """检查服务器健康状态"""
-        async with VLLMClient(self.config_path) as client:
-            if gpu_id:
-                result = await client.check_server_health(gpu_id)
-                return {gpu_id: result}
-            else:
-                return await client.check_all_servers()
+        client = await self.get_client()
+        if gpu_id:
+            result = await client.check_server_health(gpu_id)
+            return {gpu_id: result}
+        else:
+            return await client.check_all_servers()
     
     async def generate(
         self,
         prompt: str,
         gpu_id: Optional[str] = None,
         model_preference: Optional[List[str]] = None,
+        model: Optional[str] = None,
         **kwargs
     ) -> Dict[str, Any]:
         """生成文本"""
-        async with VLLMClient(self.config_path) as client:
-            if gpu_id:
-                return await client.generate_text(gpu_id, prompt, **kwargs)
-            else:
-                return await client.generate_on_best_server(
-                    prompt, model_preference, **kwargs
-                ) 
\ No newline at end of file
+        client = await self.get_client()
+        if gpu_id:
+            return await client.generate_text(gpu_id, prompt, **kwargs)
+        else:
+            return await client.generate_on_best_server(
+                prompt, model_preference, model, **kwargs
+            )
+    
+    async def generate_stream(
+        self,
+        prompt: str,
+        gpu_id: Optional[str] = None,
+        model_preference: Optional[List[str]] = None,
+        model: Optional[str] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """流式生成文本，逐个产出增量文本"""
+        client = await self.get_client()
+        if not gpu_id:
+            gpu_id = await client.select_best_server(model_preference, prompt, model)
+        async for delta in client.generate_stream(gpu_id, prompt, **kwargs):
+            yield delta
+    
+    async def generate_many(
+        self,
+        prompts: Union[Iterable[PromptItem], AsyncIterable[PromptItem]],
+        concurrency: Optional[int] = None,
+        model_preference: Optional[List[str]] = None,
+        model: Optional[str] = None,
+        **kwargs
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """并发生成大量prompt，按完成顺序产出结果"""
+        client = await self.get_client()
+        async for result in client.generate_many(
+            prompts, concurrency, model_preference, model, **kwargs
+        ):
+            yield result
@@ -5,16 +5,24 @@ vLLM Server - 在指定GPU上部署单个模型的服务器
 
 import argparse
 import asyncio
+import hmac
+import ipaddress
 import json
 import os
 import logging
-from typing import Dict, Any, Optional
-from fastapi import FastAPI, HTTPException
+import time
+import uuid
+from typing import Dict, Any, Optional, List, Tuple, Callable, AsyncIterator
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 import uvicorn
-from vllm import AsyncLLMEngine, AsyncEngineArgs, SamplingParams
-from ..utils.config import Config
+from .engines import BaseEngine, EngineOutput, create_engine, get_engine_class
+from ..utils.config import load_config
+from ..utils.metrics import MetricsRegistry
+from ..utils.admission import AdmissionController, AdmissionRejected
+from ..utils.cache import ResponseCache
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
@@ -28,6 +36,8 @@ class GenerateRequest(BaseModel):
     top_p: Optional[float] = 0.95
     top_k: Optional[int] = -1
     stop: Optional[list] = None
+    timeout: Optional[float] = None
+    cache: Optional[bool] = True
 
 class GenerateResponse(BaseModel):
     """生成响应模型"""
@@ -35,26 +45,208 @@ class GenerateResponse(BaseModel):
     prompt: str
     model: str
     gpu_id: str
+    finish_reason: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+class SamplingOverrides(BaseModel):
+    """批量请求中单条prompt的采样参数覆盖"""
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    top_k: Optional[int] = None
+    stop: Optional[list] = None
+
+class BatchGenerateRequest(BaseModel):
+    """批量生成请求模型，顶层采样参数为所有prompt共享"""
+    prompts: List[str]
+    params: Optional[List[Optional[SamplingOverrides]]] = None
+    max_tokens: Optional[int] = 2048
+    temperature: Optional[float] = 0.7
+    top_p: Optional[float] = 0.95
+    top_k: Optional[int] = -1
+    stop: Optional[list] = None
+    timeout: Optional[float] = None
+    cache: Optional[bool] = True
+    stream: Optional[bool] = False
+
+class BatchItemResult(BaseModel):
+    """批量生成中单条prompt的结果"""
+    index: int
+    text: Optional[str] = None
+    finish_reason: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchGenerateResponse(BaseModel):
+    """批量生成响应模型，results按输入顺序排列"""
+    results: List[BatchItemResult]
+    model: str
+    gpu_id: str
+
+class RequestAborted(Exception):
+    """请求因超过截止时间或客户端断开而被中止"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+class RequestControl:
+    """单个引擎请求的中止控制
+
+    超过截止时间或客户端断开时调用引擎的abort，立即释放KV cache和batch槽位。
+    """
+    
+    DEADLINE = "deadline"
+    DISCONNECTED = "disconnected"
+    CANCELLED = "cancelled"
+    
+    def __init__(self, engine: BaseEngine, timeout: Optional[float] = None):
+        self.request_id = uuid.uuid4().hex
+        self.abort_reason: Optional[str] = None
+        self._engine = engine
+        self._callbacks: List[Callable[[], None]] = []
+        self._timer = None
+        if timeout is not None:
+            self._timer = asyncio.get_running_loop().call_later(
+                max(timeout, 0), self.abort, self.DEADLINE)
+    
+    def abort(self, reason: str):
+        """中止请求，重复调用时只有第一次生效"""
+        if self.abort_reason is not None:
+            return
+        self.abort_reason = reason
+        asyncio.ensure_future(self._abort_engine())
+        for callback in self._callbacks:
+            callback()
+    
+    def add_abort_callback(self, callback: Callable[[], None]):
+        """注册中止时的回调"""
+        self._callbacks.append(callback)
+    
+    async def _abort_engine(self):
+        try:
+            await self._engine.abort(self.request_id)
+        except Exception as e:
+            logger.warning(f"中止请求{self.request_id}失败: {e}")
+    
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+class SharedGeneration:
+    """多个相同请求共享的一次引擎生成
+
+    后台任务消费引擎输出并只保留最新一条（text是累计文本），每个订阅者按自己的节奏读取。
+    单个订阅者中止不会影响其他订阅者；所有订阅者都离开后才取消生成。
+    """
+    
+    def __init__(self, outputs: AsyncIterator[EngineOutput], on_done: Callable[[], None]):
+        self.latest: Optional[EngineOutput] = None
+        self.version = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._on_done = on_done
+        self._updated = asyncio.Event()
+        self._task = asyncio.ensure_future(self._produce(outputs))
+    
+    async def _produce(self, outputs: AsyncIterator[EngineOutput]):
+        try:
+            async for output in outputs:
+                self.latest = output
+                self.version += 1
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = RequestAborted(RequestControl.CANCELLED)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            self._on_done()
+    
+    def _notify(self):
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+    
+    async def subscribe(self, control: RequestControl) -> AsyncIterator[EngineOutput]:
+        """订阅共享生成的输出，control的截止时间和断开只作用于本订阅者"""
+        self.subscribers += 1
+        control.add_abort_callback(self._notify)
+        seen = 0
+        try:
+            while True:
+                if self.version > seen:
+                    seen = self.version
+                    yield self.latest
+                elif self.done:
+                    break
+                elif control.abort_reason is not None:
+                    raise RequestAborted(control.abort_reason)
+                else:
+                    await self._updated.wait()
+            
+            if self.error is not None:
+                raise self.error
+        finally:
+            control.close()
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self._task.cancel()
 
 class VLLMServer:
     """vLLM服务器类"""
     
-    def __init__(self, gpu_id: str, config_path: str = "vllm/config/config.json"):
+    def __init__(self, gpu_id: str, config_path: str = "vllm/config/config.json",
+                 devices: Optional[List[str]] = None):
         self.gpu_id = gpu_id
-        self.config = Config(config_path)
+        self.config = load_config(config_path)
         self.gpu_config = self.config.get_gpu_config(gpu_id)
         
         if not self.gpu_config:
             raise ValueError(f"未找到GPU {gpu_id}的配置")
             
         self.model_path = self.gpu_config["model"]
+        self.model_name = self.config.get_model_name(gpu_id)
         self.port = self.gpu_config["port"]
         self.host = self.config.server_config.get("host", "0.0.0.0")
         
-        # 设置CUDA设备
-        os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_id)
+        # 设置CUDA设备，ServerManager按放置规划传入devices
+        self.devices = devices or self.config.get_devices(gpu_id)
+        os.environ["CUDA_VISIBLE_DEVICES"] = ",".join(self.devices)
+        
+        self.engine: Optional[BaseEngine] = None
+        
+        # 准入控制：限制进入引擎的并发请求数，过载时快速返回429
+        server_config = self.config.server_config
+        self.admission = AdmissionController(
+            max_in_flight=self.gpu_config.get(
+                "max_parallel_seqs", server_config.get("max_parallel_seqs", 256)),
+            max_waiting=server_config.get("max_waiting", 512),
+            max_queue_wait=server_config.get("max_queue_wait", 30)
+        )
+        
+        # 相同的确定性请求合并为一次生成
+        self.coalesce = server_config.get("coalesce_requests", True)
+        self.inflight: Dict[Tuple, SharedGeneration] = {}
+        # 正在排队等待槽位的确定性请求，相同的请求等它开始生成后订阅，而不是各自排队
+        self.pending: Dict[Tuple, asyncio.Future] = {}
+        
+        # 排空状态：不再接收新请求，已接收的请求照常完成，用于滚动重启
+        self.draining = False
+        # 管理接口的令牌，未配置时管理接口只接受本机请求
+        self.admin_token = server_config.get("admin_token")
         
-        self.engine = None
+        # 确定性请求的结果缓存，默认关闭
+        cache_config = server_config.get("cache", {})
+        self.cache: Optional[ResponseCache] = None
+        if cache_config.get("enabled", False):
+            self.cache = ResponseCache(
+                max_entries=cache_config.get("max_entries", 10000),
+                max_bytes=cache_config.get("max_bytes", 256 * 1024 * 1024),
+                ttl=cache_config.get("ttl", 3600)
+            )
         self.app = FastAPI(
             title=f"vLLM Server - GPU {gpu_id}",
             description=f"运行在GPU {gpu_id}上的{self.gpu_config['description']}",
@@ -70,8 +262,63 @@ class VLLMServer:
             allow_headers=["*"],
         )
         
+        self._setup_metrics()
         self._setup_routes()
     
+    def _setup_metrics(self):
+        """注册服务器指标"""
+        self.metrics = MetricsRegistry({"gpu_id": self.gpu_id, "model": self.model_path})
+        self.requests_total = self.metrics.counter(
+            "vllm_requests_total", "Number of generation requests received")
+        self.request_errors_total = self.metrics.counter(
+            "vllm_request_errors_total", "Number of generation requests that failed")
+        self.prompt_tokens_total = self.metrics.counter(
+            "vllm_prompt_tokens_total", "Number of prompt tokens processed")
+        self.generation_tokens_total = self.metrics.counter(
+            "vllm_generation_tokens_total", "Number of generated tokens")
+        self.requests_running = self.metrics.gauge(
+            "vllm_requests_running", "Number of requests currently inside the engine")
+        self.metrics.gauge(
+            "vllm_requests_waiting", "Number of requests waiting in the engine queue",
+            function=lambda: self.engine.get_stats().get("waiting", 0) if self.engine else 0)
+        # 只导出引擎能报告的前缀缓存计数，不报告的引擎不输出恒为0的序列
+        if "prefix_cache_hits" in get_engine_class(self.gpu_config).reported_stats:
+            self.metrics.counter(
+                "vllm_prefix_cache_queries_total", "Number of prompt tokens looked up in the prefix cache",
+                function=lambda: self.engine.get_stats().get("prefix_cache_queries", 0) if self.engine else 0)
+            self.metrics.counter(
+                "vllm_prefix_cache_hits_total", "Number of prompt tokens served from the prefix cache",
+                function=lambda: self.engine.get_stats().get("prefix_cache_hits", 0) if self.engine else 0)
+        self.requests_aborted_total = self.metrics.counter(
+            "vllm_requests_aborted_total", "Number of requests aborted on deadline expiry or client disconnect")
+        self.requests_rejected_total = self.metrics.counter(
+            "vllm_requests_rejected_total", "Number of requests rejected by admission control")
+        self.metrics.gauge(
+            "vllm_admission_in_flight", "Number of admitted requests being served",
+            function=lambda: self.admission.in_flight)
+        self.metrics.gauge(
+            "vllm_admission_waiting", "Number of requests waiting for admission",
+            function=lambda: self.admission.waiting)
+        self.requests_coalesced_total = self.metrics.counter(
+            "vllm_requests_coalesced_total", "Number of requests attached to an identical in-flight generation")
+        self.metrics.counter(
+            "vllm_cache_hits_total", "Number of requests served from the response cache",
+            function=lambda: self.cache.hits if self.cache else 0)
+        self.metrics.counter(
+            "vllm_cache_misses_total", "Number of cacheable requests not found in the response cache",
+            function=lambda: self.cache.misses if self.cache else 0)
+        self.metrics.gauge(
+            "vllm_cache_entries", "Number of entries in the response cache",
+            function=lambda: len(self.cache) if self.cache else 0)
+        self.time_to_first_token = self.metrics.histogram(
+            "vllm_time_to_first_token_seconds", "Time from submission to the first generated token")
+        self.time_per_output_token = self.metrics.histogram(
+            "vllm_time_per_output_token_seconds", "Average time between generated tokens",
+            buckets=(0.001, 0.0025, 0.005, 0.01, 0.015, 0.02, 0.03, 0.04, 0.05,
+                     0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0))
+        self.e2e_latency = self.metrics.histogram(
+            "vllm_e2e_request_latency_seconds", "End-to-end generation latency")
+    
     def _setup_routes(self):
         """设置路由"""
         
@@ -79,18 +326,52 @@ class VLLMServer:
         async def health_check():
             """健康检查"""
             return {
-                "status": "healthy",
+                "status": "draining" if self.draining else "healthy",
                 "gpu_id": self.gpu_id,
                 "model": self.model_path,
-                "port": self.port
+                "port": self.port,
+                "in_flight": self.admission.in_flight,
+                "waiting": self.admission.waiting
+            }
+        
+        @self.app.post("/admin/drain")
+        async def drain(http_request: Request):
+            """进入排空状态，新请求返回503，进行中的请求继续完成"""
+            self._authorize_admin(http_request)
+            if not self.draining:
+                logger.info(f"服务器进入排空状态 GPU {self.gpu_id}, 进行中: {self.admission.in_flight}")
+            self.draining = True
+            return {
+                "status": "draining",
+                "in_flight": self.admission.in_flight,
+                "waiting": self.admission.waiting,
+                "pid": os.getpid()
             }
         
+        @self.app.post("/admin/resume")
+        async def resume(http_request: Request):
+            """退出排空状态，重新接收请求"""
+            self._authorize_admin(http_request)
+            if self.draining:
+                logger.info(f"服务器恢复接收请求 GPU {self.gpu_id}")
+            self.draining = False
+            return {"status": "healthy"}
+        
+        @self.app.get("/metrics")
+        async def get_metrics():
+            """Prometheus文本格式的指标"""
+            return PlainTextResponse(
+                self.metrics.render(),
+                media_type="text/plain; version=0.0.4; charset=utf-8"
+            )
+        
         @self.app.get("/info")
         async def get_info():
             """获取模型信息"""
             return {
                 "gpu_id": self.gpu_id,
                 "model": self.model_path,
+                "name": self.model_name,
                 "description": self.gpu_config["description"],
                 "port": self.port,
                 "config": {
@@ -101,57 +382,483 @@ class VLLMServer:
             }
         
         @self.app.post("/generate", response_model=GenerateResponse)
-        async def generate(request: GenerateRequest):
+        async def generate(request: GenerateRequest, http_request: Request):
             """生成文本"""
             if not self.engine:
                 raise HTTPException(status_code=503, detail="模型尚未加载")
+            self._reject_if_draining()
             
+            cached = self._cache_lookup(request)
+            if cached is not None:
+                return self._build_response(request, cached)
+            
+            control = RequestControl(self.engine, self._resolve_timeout(request, http_request))
+            outputs = await self._start_or_reject(request, control)
+            watcher = self._watch_disconnect(http_request, [control])
             try:
-                sampling_params = SamplingParams(
-                    temperature=request.temperature,
-                    top_p=request.top_p,
-                    top_k=request.top_k,
-                    max_tokens=request.max_tokens,
-                    stop=request.stop
-                )
+                output = await self._drain(outputs)
+                return self._build_response(request, output)
                 
+            except RequestAborted as e:
+                raise HTTPException(status_code=504, detail=f"请求已中止: {e.reason}")
+            except Exception as e:
+                logger.error(f"生成文本时出错: {e}")
+                raise HTTPException(status_code=500, detail=f"生成失败: {str(e)}")
+            finally:
+                watcher.cancel()
+        
+        @self.app.post("/generate_stream")
+        async def generate_stream(request: GenerateRequest, http_request: Request):
+            """以SSE流式返回生成的增量文本"""
+            if not self.engine:
+                raise HTTPException(status_code=503, detail="模型尚未加载")
+            self._reject_if_draining()
+            
+            cached = self._cache_lookup(request)
+            if cached is not None:
+                return StreamingResponse(
+                    self._replay_events(cached),
+                    media_type="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+                )
+            
+            # 入口处检查一次队列，槽位在生成器内获取：响应没有开始发送时不会占用槽位
+            try:
+                self.admission.check()
+            except AdmissionRejected as e:
+                self._raise_rejected(e)
+            
+            # 客户端断开时StreamingResponse会取消生成器，由_run_engine负责中止引擎请求
+            control = RequestControl(self.engine, self._resolve_timeout(request, http_request))
+            return StreamingResponse(
+                self._stream_request(request, control),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        
+        @self.app.post("/generate_batch", response_model=BatchGenerateResponse)
+        async def generate_batch(request: BatchGenerateRequest, http_request: Request):
+            """批量生成文本，所有prompt同时提交给引擎"""
+            if not self.engine:
+                raise HTTPException(status_code=503, detail="模型尚未加载")
+            self._reject_if_draining()
+            
+            if request.params is not None and len(request.params) != len(request.prompts):
+                raise HTTPException(status_code=422, detail="params的长度必须与prompts一致")
+            
+            # 整个批次在入口处检查一次，子项随后排队等待槽位而不会被单独拒绝
+            try:
+                self.admission.check()
+            except AdmissionRejected as e:
+                self._raise_rejected(e)
+            
+            items = self._expand_batch(request)
+            timeout = self._resolve_timeout(request, http_request)
+            controls = [RequestControl(self.engine, timeout) for _ in items]
+            
+            if request.stream:
+                return StreamingResponse(
+                    self._stream_batch_events(items, controls),
+                    media_type="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+                )
+            
+            watcher = self._watch_disconnect(http_request, controls)
+            try:
+                results = await asyncio.gather(*[
+                    self._generate_batch_item(index, item, control)
+                    for index, (item, control) in enumerate(zip(items, controls))
+                ])
+            finally:
+                watcher.cancel()
+            
+            return BatchGenerateResponse(
+                results=results,
+                model=self.model_path,
+                gpu_id=self.gpu_id
+            )
+    
+    def _build_response(self, request: GenerateRequest, output: EngineOutput) -> GenerateResponse:
+        return GenerateResponse(
+            text=output.text,
+            prompt=request.prompt,
+            model=self.model_path,
+            gpu_id=self.gpu_id,
+            finish_reason=output.finish_reason,
+            prompt_tokens=output.prompt_tokens,
+            completion_tokens=output.completion_tokens
+        )
+    
+    def _authorize_admin(self, http_request: Request):
+        """配置了server.admin_token时要求Authorization: Bearer <token>，否则只接受本机请求，不满足时返回403"""
+        if self.admin_token:
+            authorization = http_request.headers.get("authorization", "")
+            if not hmac.compare_digest(authorization.encode(), f"Bearer {self.admin_token}".encode()):
+                raise HTTPException(status_code=403, detail="管理接口需要有效的令牌")
+            return
+        
+        try:
+            address = ipaddress.ip_address(http_request.client.host if http_request.client else "")
+        except ValueError:
+            address = None
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if address is None or not address.is_loopback:
+            raise HTTPException(status_code=403, detail="管理接口只接受本机请求，远程调用需配置server.admin_token")
+    
+    def _reject_if_draining(self):
+        """排空中的服务器对新请求返回503，客户端会换一个副本重试"""
+        if self.draining:
+            self.requests_rejected_total.inc()
+            raise HTTPException(
+                status_code=503,
+                detail="服务器正在排空，不再接收新请求",
+                headers={"Retry-After": "1"}
+            )
+    
+    def _raise_rejected(self, rejection: AdmissionRejected):
+        """将准入拒绝转换为带Retry-After的429响应"""
+        self.requests_rejected_total.inc()
+        logger.warning(f"拒绝请求: {rejection.reason}")
+        raise HTTPException(
+            status_code=429,
+            detail=rejection.reason,
+            headers={"Retry-After": str(rejection.retry_after)}
+        )
+    
+    async def _start(
+        self,
+        request: GenerateRequest,
+        control: RequestControl,
+        enforce_limits: bool = True
+    ) -> AsyncIterator[EngineOutput]:
+        """获取执行槽位并启动生成，返回输出迭代器
+
+        相同的确定性请求正在生成或正在排队时等待并订阅它，不占用新的槽位和batch位置。
+        """
+        key = self._coalesce_key(request)
+        if key is None:
+            await self.admission.acquire(enforce_limits)
+            return self._release_after(self._run_engine(request, control))
+        
+        while key not in self.inflight:
+            pending = self.pending.get(key)
+            if pending is None:
+                break
+            # 排在前面的相同请求被拒绝时一并拒绝；它被取消时重新检查，可能由本请求排队
+            outcome = await asyncio.shield(pending)
+            if isinstance(outcome, AdmissionRejected):
+                raise outcome
+        if key in self.inflight:
+            self.requests_coalesced_total.inc()
+            return self.inflight[key].subscribe(control)
+        
+        pending = self.pending[key] = asyncio.get_running_loop().create_future()
+        try:
+            await self.admission.acquire(enforce_limits)
+        except AdmissionRejected as e:
+            pending.set_result(e)
+            raise
+        finally:
+            if self.pending.get(key) is pending:
+                del self.pending[key]
+            if not pending.done():
+                pending.set_result(None)
+        
+        # 排队等待槽位期间，相同的请求可能已经开始生成
+        if key in self.inflight:
+            self.admission.release()
+            self.requests_coalesced_total.inc()
+            return self.inflight[key].subscribe(control)
+        
+        def on_done():
+            self.admission.release()
+            if self.inflight.get(key) is shared:
+                del self.inflight[key]
+        
+        # 共享生成没有自己的截止时间，由各订阅者分别控制
+        shared = SharedGeneration(self._run_engine(request, RequestControl(self.engine)), on_done)
+        self.inflight[key] = shared
+        return shared.subscribe(control)
+    
+    async def _start_or_reject(
+        self,
+        request: GenerateRequest,
+        control: RequestControl
+    ) -> AsyncIterator[EngineOutput]:
+        """启动生成，过载时抛出429"""
+        try:
+            return await self._start(request, control)
+        except AdmissionRejected as e:
+            control.close()
+            self._raise_rejected(e)
+    
+    async def _release_after(self, outputs: AsyncIterator[EngineOutput]) -> AsyncIterator[EngineOutput]:
+        """迭代结束后释放执行槽位"""
+        try:
+            async for output in outputs:
+                yield output
+        finally:
+            await outputs.aclose()
+            self.admission.release()
+    
+    @staticmethod
+    async def _drain(outputs: AsyncIterator[EngineOutput]) -> EngineOutput:
+        """消费输出直到结束，返回最终输出"""
+        output = None
+        async for output in outputs:
+            pass
+        return output
+    
+    def _request_key(self, request: GenerateRequest) -> Optional[Tuple]:
+        """确定性请求的键，用于缓存和合并；请求要求绕过或采样不确定时返回None"""
+        if not request.cache:
+            return None
+        sampling = self._build_sampling_params(request)
+        if not ResponseCache.is_cacheable(sampling):
+            return None
+        return ResponseCache.make_key(self.model_path, request.prompt, sampling)
+    
+    def _coalesce_key(self, request: GenerateRequest) -> Optional[Tuple]:
+        return self._request_key(request) if self.coalesce else None
+    
+    def _cache_key(self, request: GenerateRequest) -> Optional[Tuple]:
+        return self._request_key(request) if self.cache is not None else None
+    
+    def _cache_lookup(self, request: GenerateRequest) -> Optional[EngineOutput]:
+        key = self._cache_key(request)
+        if key is None:
+            return None
+        return self.cache.get(key)
+    
+    def _cache_store(self, request: GenerateRequest, output: EngineOutput):
+        key = self._cache_key(request)
+        if key is not None:
+            self.cache.put(key, output, len(request.prompt) + len(output.text))
+    
+    @staticmethod
+    def _resolve_timeout(request: BaseModel, http_request: Request) -> Optional[float]:
+        """取请求体timeout字段和X-Request-Timeout头中较小的一个作为剩余时间（秒）"""
+        timeouts = []
+        if request.timeout is not None:
+            timeouts.append(request.timeout)
+        header = http_request.headers.get("x-request-timeout")
+        if header:
+            try:
+                timeouts.append(float(header))
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"无效的X-Request-Timeout: {header}")
+        return min(timeouts) if timeouts else None
+    
+    @staticmethod
+    def _watch_disconnect(http_request: Request, controls: List[RequestControl]) -> asyncio.Task:
+        """后台等待客户端断开，断开时中止所有相关的引擎请求"""
+        async def wait_for_disconnect():
+            while True:
+                message = await http_request.receive()
+                if message["type"] == "http.disconnect":
+                    logger.info("客户端已断开，中止生成")
+                    for control in controls:
+                        control.abort(RequestControl.DISCONNECTED)
+                    return
+        
+        return asyncio.ensure_future(wait_for_disconnect())
+    
+    @staticmethod
+    def _expand_batch(request: BatchGenerateRequest) -> List[GenerateRequest]:
+        """将批量请求展开为单条请求，合并共享参数和单条覆盖参数"""
+        shared = request.model_dump(exclude={"prompts", "params", "stream"})
+        overrides = request.params or [None] * len(request.prompts)
+        
+        items = []
+        for prompt, override in zip(request.prompts, overrides):
+            fields = dict(shared)
+            if override is not None:
+                fields.update(override.model_dump(exclude_none=True))
+            items.append(GenerateRequest(prompt=prompt, **fields))
+        return items
+    
+    async def _run_engine(
+        self,
+        request: GenerateRequest,
+        control: RequestControl
+    ) -> AsyncIterator[EngineOutput]:
+        """提交请求到引擎并逐个产出输出，同时记录延迟和token指标
+
+        请求被中止时抛出RequestAborted；未完成就退出（包括被取消）时中止引擎请求。
+        """
+        self.requests_total.inc()
+        self.requests_running.inc()
+        start = time.monotonic()
+        first_token_at = None
+        output = None
+        
+        try:
+            if control.abort_reason is None:
                 results = self.engine.generate(
                     request.prompt,
-                    sampling_params=sampling_params
-                )
-                
-                # 等待生成完成
-                async for request_output in results:
-                    pass
-                
-                generated_text = request_output.outputs[0].text
-                
-                return GenerateResponse(
-                    text=generated_text,
-                    prompt=request.prompt,
-                    model=self.model_path,
-                    gpu_id=self.gpu_id
+                    self._build_sampling_params(request),
+                    control.request_id
                 )
                 
-            except Exception as e:
-                logger.error(f"生成文本时出错: {e}")
-                raise HTTPException(status_code=500, detail=f"生成失败: {str(e)}")
+                async for output in results:
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                        self.time_to_first_token.observe(first_token_at - start)
+                    yield output
+            
+            if output is None or not output.finished:
+                if control.abort_reason is not None:
+                    self.requests_aborted_total.inc()
+                    raise RequestAborted(control.abort_reason)
+            else:
+                self._cache_store(request, output)
+            
+        except RequestAborted:
+            raise
+        except Exception:
+            self.request_errors_total.inc()
+            raise
+        finally:
+            if output is None or not output.finished:
+                control.abort(RequestControl.CANCELLED)
+            control.close()
+            self.requests_running.dec()
+            if output is not None:
+                finished_at = time.monotonic()
+                self.e2e_latency.observe(finished_at - start)
+                self.admission.record_service_time(finished_at - start)
+                self.prompt_tokens_total.inc(output.prompt_tokens)
+                self.generation_tokens_total.inc(output.completion_tokens)
+                if output.completion_tokens > 1:
+                    self.time_per_output_token.observe(
+                        (finished_at - first_token_at) / (output.completion_tokens - 1)
+                    )
+    
+    async def _generate_batch_item(
+        self,
+        index: int,
+        request: GenerateRequest,
+        control: RequestControl
+    ) -> BatchItemResult:
+        """生成批量请求中的一条，错误记录在结果中而不影响其他条目"""
+        try:
+            output = self._cache_lookup(request)
+            if output is None:
+                outputs = await self._start(request, control, enforce_limits=False)
+                output = await self._drain(outputs)
+            control.close()
+            return BatchItemResult(
+                index=index,
+                text=output.text,
+                finish_reason=output.finish_reason
+            )
+        except RequestAborted as e:
+            return BatchItemResult(index=index, error=f"请求已中止: {e.reason}")
+        except Exception as e:
+            logger.error(f"批量生成第{index}条时出错: {e}")
+            return BatchItemResult(index=index, error=f"生成失败: {str(e)}")
+    
+    async def _stream_batch_events(
+        self,
+        items: List[GenerateRequest],
+        controls: List[RequestControl]
+    ) -> AsyncIterator[str]:
+        """每条prompt完成时立即产出带index的结果事件"""
+        tasks = [
+            asyncio.ensure_future(self._generate_batch_item(index, item, control))
+            for index, (item, control) in enumerate(zip(items, controls))
+        ]
+        
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                yield self._format_event(result.model_dump())
+            yield self._format_event({"finished": True, "count": len(items)})
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    @staticmethod
+    def _build_sampling_params(request: GenerateRequest) -> Dict[str, Any]:
+        """根据请求构建采样参数"""
+        return {
+            "temperature": request.temperature,
+            "top_p": request.top_p,
+            "top_k": request.top_k,
+            "max_tokens": request.max_tokens,
+            "stop": request.stop
+        }
+    
+    @staticmethod
+    def _format_event(payload: Dict[str, Any]) -> str:
+        """编码为一条server-sent event"""
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    
+    def _final_event(self, output: EngineOutput) -> str:
+        """带finish_reason和token计数的结束事件"""
+        return self._format_event({
+            "delta": "",
+            "finished": True,
+            "finish_reason": output.finish_reason,
+            "prompt_tokens": output.prompt_tokens,
+            "completion_tokens": output.completion_tokens,
+            "model": self.model_path,
+            "gpu_id": self.gpu_id
+        })
+    
+    async def _replay_events(self, output: EngineOutput) -> AsyncIterator[str]:
+        """把缓存命中的结果以一次性的增量事件返回"""
+        if output.text:
+            yield self._format_event({"delta": output.text})
+        yield self._final_event(output)
+    
+    async def _stream_request(self, request: GenerateRequest, control: RequestControl) -> AsyncIterator[str]:
+        """获取执行槽位并流式返回事件；排队超时等拒绝作为错误事件返回"""
+        try:
+            outputs = await self._start(request, control)
+        except AdmissionRejected as e:
+            control.close()
+            self.requests_rejected_total.inc()
+            logger.warning(f"拒绝请求: {e.reason}")
+            yield self._format_event({"error": e.reason, "finished": True})
+            return
+        except asyncio.CancelledError:
+            control.close()
+            raise
+        async for event in self._stream_events(outputs):
+            yield event
+    
+    async def _stream_events(self, outputs: AsyncIterator[EngineOutput]) -> AsyncIterator[str]:
+        """逐个引擎输出产出增量文本事件，最后产出带finish_reason和token计数的结束事件"""
+        sent_chars = 0
+        output = None
+        
+        try:
+            async for output in outputs:
+                delta = output.text[sent_chars:]
+                if delta:
+                    sent_chars = len(output.text)
+                    yield self._format_event({"delta": delta})
+            
+            yield self._final_event(output)
+            
+        except RequestAborted as e:
+            yield self._format_event({"error": f"请求已中止: {e.reason}", "finished": True})
+        except Exception as e:
+            logger.error(f"流式生成时出错: {e}")
+            yield self._format_event({"error": f"生成失败: {str(e)}", "finished": True})
+        finally:
+            await outputs.aclose()
     
     async def load_model(self):
         """异步加载模型"""
         try:
             logger.info(f"开始在GPU {self.gpu_id}上加载模型: {self.model_path}")
             
-            engine_args = AsyncEngineArgs(
-                model=self.model_path,
-                tensor_parallel_size=self.gpu_config["tensor_parallel_size"],
-                gpu_memory_utilization=self.gpu_config["gpu_memory_utilization"],
-                max_model_len=self.gpu_config["max_model_len"],
-                device="cuda",
-                worker_use_ray=False
-            )
-            
-            self.engine = AsyncLLMEngine.from_engine_args(engine_args)
+            engine = create_engine(self.gpu_config)
+            await engine.start()
+            self.engine = engine
             logger.info(f"模型加载完成: GPU {self.gpu_id}")
             
         except Exception as e:
@@ -177,10 +884,12 @@ async def main():
     parser = argparse.ArgumentParser(description='启动vLLM服务器')
     parser.add_argument('--gpu', required=True, help='GPU ID')
     parser.add_argument('--config', default="vllm/config/config.json", help='配置文件路径')
+    parser.add_argument('--devices', help='使用的物理GPU编号，多个用逗号分隔（默认取配置中的devices）')
     args = parser.parse_args()
+    devices = [device.strip() for device in args.devices.split(",") if device.strip()] if args.devices else None
     
     try:
-        server = VLLMServer(args.gpu, args.config)
+        server = VLLMServer(args.gpu, args.config, devices)
         await server.start_server()
     except KeyboardInterrupt:
         logger.info("服务器已停止")
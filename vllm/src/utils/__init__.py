@@ -3,6 +3,11 @@ vLLM工具模块
 包含配置管理和其他实用工具
 """
 
-from .config import Config
+from .config import Config, ConfigStore, get_config_store, load_config
+from .metrics import Counter, Gauge, Histogram, LatencyWindow, MetricsRegistry
+from .cache import ResponseCache
+from .log_capture import log_file_path, tail_lines
 
-__all__ = ['Config'] 
\ No newline at end of file
+__all__ = ['Config', 'ConfigStore', 'get_config_store', 'load_config',
+           'Counter', 'Gauge', 'Histogram', 'LatencyWindow', 'MetricsRegistry', 'ResponseCache',
+           'log_file_path', 'tail_lines'] 
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+准入控制 - 限制同时进入引擎的请求数，并用有界等待队列快速拒绝过载请求
+"""
+
+import asyncio
+import math
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+class AdmissionRejected(Exception):
+    """请求因过载被拒绝，retry_after为建议的重试等待秒数"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """有界准入队列
+
+    最多max_in_flight个请求同时执行，最多max_waiting个请求排队等待；
+    队列已满或排队超过max_queue_wait秒的请求会立即收到AdmissionRejected。
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 256,
+        max_waiting: int = 512,
+        max_queue_wait: float = 30.0
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.max_queue_wait = max_queue_wait
+        self.in_flight = 0
+        self.rejected = 0
+        # 请求平均执行时间的指数滑动平均，用于估算Retry-After
+        self.service_time = 1.0
+        self._waiters: deque = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """按当前队列长度估算客户端应等待的秒数"""
+        backlog = (self.waiting + 1) / max(self.max_in_flight, 1)
+        return max(1, math.ceil(self.service_time * backlog))
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        raise AdmissionRejected(reason, self.retry_after())
+
+    async def acquire(self, enforce_limits: bool = True):
+        """获取一个执行槽位
+
+        enforce_limits为False时不受等待队列长度和排队时间限制，用于已被接纳的批量请求的子项
+        """
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            return
+
+        if enforce_limits and self.waiting >= self.max_waiting:
+            self._reject("服务器繁忙，等待队列已满")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        timeout = self.max_queue_wait if enforce_limits else None
+        try:
+            # release()直接把槽位交给被唤醒的等待者，in_flight保持不变
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self._reject("服务器繁忙，排队等待超时")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 槽位已交给本请求但调用方已取消，转交给下一个等待者
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self):
+        """释放一个执行槽位，优先交给最早的等待者"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def would_reject(self) -> bool:
+        """新请求此刻是否会因队列已满被拒绝"""
+        return self.in_flight >= self.max_in_flight and self.waiting >= self.max_waiting
+
+    def check(self):
+        """队列已满时立即拒绝，不占用槽位"""
+        if self.would_reject():
+            self._reject("服务器繁忙，等待队列已满")
+
+    def record_service_time(self, seconds: float, alpha: float = 0.1):
+        """更新请求平均执行时间"""
+        self.service_time += alpha * (seconds - self.service_time)
+
+    @asynccontextmanager
+    async def admit(self, enforce_limits: bool = True) -> AsyncIterator[None]:
+        """在槽位内执行一段代码"""
+        await self.acquire(enforce_limits)
+        try:
+            yield
+        finally:
+            self.release()
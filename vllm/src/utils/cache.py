@@ -0,0 +1,80 @@
+"""
+生成结果缓存 - 有界内存的LRU + TTL缓存，只用于确定性采样（temperature=0）的请求
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+class ResponseCache:
+    """LRU + TTL结果缓存
+
+    max_entries限制条目数，max_bytes按键和值中字符串的长度近似限制内存，
+    超出任一限制时淘汰最久未使用的条目；超过ttl秒的条目在读取时失效。
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 256 * 1024 * 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_bytes = 0
+        # key -> (过期时间, 近似大小, 值)
+        self._entries: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(model: str, prompt: str, sampling: Dict[str, Any]) -> Tuple:
+        """由模型、prompt和全部采样参数组成缓存键"""
+        params = tuple(
+            (name, tuple(value) if isinstance(value, list) else value)
+            for name, value in sorted(sampling.items())
+        )
+        return (model, prompt, params)
+
+    @staticmethod
+    def is_cacheable(sampling: Dict[str, Any]) -> bool:
+        """只有贪心解码的结果是确定的，才可以缓存"""
+        return sampling.get("temperature") == 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, size, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any, size: int):
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self.size_bytes += size
+
+        while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self.size_bytes -= size
+
+    def clear(self):
+        self._entries.clear()
+        self.size_bytes = 0
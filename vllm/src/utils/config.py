@@ -1,11 +1,16 @@
 import json
+import logging
 import os
-from typing import Dict, Optional, List
+from typing import Callable, Dict, Optional, List, Tuple
+
+logger = logging.getLogger(__name__)
 
 class Config:
     def __init__(self, config_path: str = "vllm/config/config.json"):
         self.config_path = config_path
         self.config = self._load_config()
+        self._build_model_index()
+        self._build_port_index()
         
     def _load_config(self) -> Dict:
         """Load configuration from JSON file"""
@@ -15,6 +20,36 @@ class Config:
         with open(self.config_path, 'r', encoding='utf-8') as f:
             return json.load(f)
     
+    def _build_model_index(self):
+        """构建模型名称/别名 -> GPU ID列表的索引
+
+        每个GPU条目的模型名称取自"name"字段，缺省为模型路径的最后一段
+        （models/qwen-32b -> qwen-32b）。名称相同的GPU组成一个副本组；
+        顶层"model_aliases"把别名映射到模型名称。键一律小写。
+        """
+        self._replicas: Dict[str, List[str]] = {}
+        for gpu_id, gpu_config in self.get_all_gpu_configs().items():
+            name = self.get_model_name(gpu_id).lower()
+            self._replicas.setdefault(name, []).append(gpu_id)
+        
+        self._aliases: Dict[str, str] = {}
+        for alias, name in self.config.get('model_aliases', {}).items():
+            if name.lower() not in self._replicas:
+                raise ValueError(f"模型别名 {alias} 指向未配置的模型: {name}")
+            self._aliases[alias.lower()] = name.lower()
+    
+    def _build_port_index(self):
+        """构建端口 -> GPU ID的索引，同时检查每个GPU条目都有模型和端口且端口不重复"""
+        self._ports: Dict[int, str] = {}
+        for gpu_id, gpu_config in self.get_all_gpu_configs().items():
+            for key in ('model', 'port'):
+                if key not in gpu_config:
+                    raise ValueError(f"GPU条目 {gpu_id} 缺少{key}字段")
+            port = gpu_config['port']
+            if port in self._ports:
+                raise ValueError(f"GPU条目 {gpu_id} 和 {self._ports[port]} 使用了同一个端口 {port}")
+            self._ports[port] = gpu_id
+    
     @property
     def server_config(self) -> Dict:
         """Get server configuration"""
@@ -37,8 +72,42 @@ class Config:
         """Get list of available GPU IDs"""
         return list(self.config.get('gpus', {}).keys())
     
+    def get_devices(self, gpu_id: str) -> List[str]:
+        """GPU条目配置的物理GPU编号，取自"devices"字段，缺省为GPU ID本身
+        
+        devices相交的条目共用设备，能否同时运行由放置规划器按显存利用率判断。
+        配置了devices的条目固定在这些设备上；未配置的条目由ServerManager优先放在缺省设备上，
+        缺省设备数量与tensor_parallel_size不符或已被占满时才由规划器换到别的设备。
+        """
+        gpu_config = self.get_gpu_config(gpu_id)
+        return [str(device) for device in gpu_config.get('devices', [gpu_id])]
+    
+    def get_model_name(self, gpu_id: str) -> str:
+        """GPU对外提供的模型名称"""
+        gpu_config = self.get_gpu_config(gpu_id)
+        return gpu_config.get('name') or os.path.basename(gpu_config['model'].rstrip('/'))
+    
+    def get_model_names(self) -> List[str]:
+        """所有模型名称（不含别名）"""
+        return list(self._replicas)
+    
+    def resolve_model(self, model: str) -> Optional[str]:
+        """把模型名称或别名解析为模型名称，未配置时返回None"""
+        key = model.lower()
+        if key in self._replicas:
+            return key
+        return self._aliases.get(key)
+    
+    def get_replicas(self, model: str) -> List[str]:
+        """返回提供该模型（名称或别名）的所有GPU ID"""
+        name = self.resolve_model(model)
+        return list(self._replicas[name]) if name else []
+    
     def get_gpu_by_model(self, model_name: str) -> Optional[str]:
         """根据模型名称查找GPU ID"""
+        replicas = self.get_replicas(model_name)
+        if replicas:
+            return replicas[0]
         for gpu_id, gpu_config in self.get_all_gpu_configs().items():
             if model_name.lower() in gpu_config.get('model', '').lower():
                 return gpu_id
@@ -46,12 +115,92 @@ class Config:
     
     def get_gpu_by_port(self, port: int) -> Optional[str]:
         """根据端口号查找GPU ID"""
-        for gpu_id, gpu_config in self.get_all_gpu_configs().items():
-            if gpu_config.get('port') == port:
-                return gpu_id
-        return None
+        return self._ports.get(port)
     
     @property
     def model_config(self) -> Dict:
         """Get model configuration"""
-        return self.config.get('model', {}) 
\ No newline at end of file
+        return self.config.get('model', {})
+
+def diff_gpus(old: Config, new: Config) -> Tuple[List[str], List[str], List[str]]:
+    """比较两个配置的GPU条目，返回(新增, 删除, 修改)的GPU ID"""
+    old_gpus = old.get_all_gpu_configs()
+    new_gpus = new.get_all_gpu_configs()
+    added = [gpu_id for gpu_id in new_gpus if gpu_id not in old_gpus]
+    removed = [gpu_id for gpu_id in old_gpus if gpu_id not in new_gpus]
+    changed = [gpu_id for gpu_id in new_gpus if gpu_id in old_gpus and new_gpus[gpu_id] != old_gpus[gpu_id]]
+    return added, removed, changed
+
+class ConfigStore:
+    """一个配置文件的进程级快照缓存
+
+    snapshot是加载并校验过的Config，创建后不再修改，调用方不应修改它的内容；
+    check()发现文件的修改时间或大小变化时加载一个新快照并整体替换，
+    加载或校验失败时保留原快照。替换后按订阅顺序调用subscribe注册的回调(old, new)。
+    """
+
+    def __init__(self, config_path: str):
+        self.config_path = config_path
+        self._stamp = self._file_stamp()
+        self.snapshot = Config(config_path)
+        self.version = 1
+        self._subscribers: List[Callable[[Config, Config], None]] = []
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.config_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def subscribe(self, callback: Callable[[Config, Config], None]):
+        """注册快照替换后的回调"""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[Config, Config], None]):
+        """取消注册的回调"""
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def check(self) -> bool:
+        """文件变化时重新加载，返回是否换上了新快照"""
+        stamp = self._file_stamp()
+        if stamp is None or stamp == self._stamp:
+            return False
+        self._stamp = stamp
+
+        try:
+            snapshot = Config(self.config_path)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            # 文件可能正在写入；下次修改后会再次加载
+            logger.error(f"重新加载配置失败，继续使用版本 {self.version}: {e}")
+            return False
+
+        old, self.snapshot = self.snapshot, snapshot
+        self.version += 1
+        added, removed, changed = diff_gpus(old, snapshot)
+        logger.info(
+            f"配置已重新加载 {self.config_path} (版本 {self.version}): "
+            f"新增 {added}, 删除 {removed}, 修改 {changed}"
+        )
+        for callback in list(self._subscribers):
+            try:
+                callback(old, snapshot)
+            except Exception as e:
+                logger.error(f"配置重新加载回调出错: {e}")
+        return True
+
+# 配置文件绝对路径 -> 快照缓存，同一进程中的客户端、网关和管理器共用
+_stores: Dict[str, ConfigStore] = {}
+
+def get_config_store(config_path: str = "vllm/config/config.json") -> ConfigStore:
+    """返回配置文件的进程级快照缓存，首次调用时加载"""
+    key = os.path.abspath(config_path)
+    store = _stores.get(key)
+    if store is None:
+        store = _stores[key] = ConfigStore(config_path)
+    return store
+
+def load_config(config_path: str = "vllm/config/config.json") -> Config:
+    """返回配置文件当前的快照，不会重复读取和解析文件"""
+    return get_config_store(config_path).snapshot
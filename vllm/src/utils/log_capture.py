@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Log Capture - 把服务器子进程的stdout/stderr写入按大小轮转的日志文件
+
+ServerManager为每个服务器启动一个独立的转储进程，服务器的输出通过管道接到它的stdin。
+转储进程只做读取和写文件，持续清空管道，服务器不会因为管道写满而阻塞；
+它独立于管理器进程，管理器退出后日志照常写入，服务器关闭输出后它自行退出。
+"""
+
+import argparse
+import logging
+import logging.handlers
+import os
+import signal
+import sys
+from collections import deque
+from typing import BinaryIO, List
+
+def log_file_path(log_dir: str, gpu_id: str) -> str:
+    """GPU服务器日志文件的路径"""
+    return os.path.join(log_dir, f"gpu_{gpu_id}.log")
+
+def pump(stream: BinaryIO, path: str, max_bytes: int, backup_count: int):
+    """逐行把stream写入path，超过max_bytes时轮转，保留backup_count个旧文件"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    try:
+        for line in stream:
+            record = logging.makeLogRecord({
+                "msg": line.decode("utf-8", errors="replace").rstrip("\n"),
+                "levelno": logging.INFO,
+            })
+            handler.emit(record)
+    finally:
+        handler.close()
+
+def tail_lines(path: str, lines: int = 20, block_size: int = 8192) -> List[str]:
+    """从文件末尾向前读取最后lines行，文件不存在时返回空列表"""
+    if lines <= 0 or not os.path.exists(path):
+        return []
+
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        # 多读一行，保证第一行是完整的
+        while position > 0 and data.count(b"\n") <= lines:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+
+    tail = deque(data.decode("utf-8", errors="replace").splitlines(), maxlen=lines)
+    return list(tail)
+
+def main():
+    parser = argparse.ArgumentParser(description='把stdin写入轮转日志文件')
+    parser.add_argument('--path', required=True, help='日志文件路径')
+    parser.add_argument('--max-bytes', type=int, default=100 * 1024 * 1024, help='单个日志文件的最大字节数')
+    parser.add_argument('--backup-count', type=int, default=5, help='保留的轮转文件数')
+    args = parser.parse_args()
+
+    # Ctrl+C会发给整个进程组；继续读取直到服务器退出，保留它最后的日志
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    pump(sys.stdin.buffer, args.path, args.max_bytes, args.backup_count)
+
+if __name__ == "__main__":
+    main()
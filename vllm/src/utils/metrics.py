@@ -0,0 +1,203 @@
+"""
+轻量级Prometheus指标 - Counter、Gauge、Histogram以及文本格式导出
+
+所有指标只在事件循环线程中更新，不需要加锁；记录一次观测值只是几次整数/浮点运算。
+"""
+
+import bisect
+import math
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Dict, List, Optional, Sequence
+
+# 延迟类直方图的默认分桶（秒）
+DEFAULT_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+    1.0, 2.5, 5.0, 7.5, 10.0, 30.0, 60.0
+)
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    """将标签编码为{key="value",...}"""
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{key}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Metric(ABC):
+    """指标基类"""
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels or {}
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Prometheus文本格式的样本行"""
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """单调递增计数器，也可以绑定一个在导出时才求值的函数"""
+    metric_type = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Optional[Dict[str, str]] = None,
+        function: Optional[Callable[[], float]] = None
+    ):
+        super().__init__(name, documentation, labels)
+        self.value = 0.0
+        self.function = function
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def get(self) -> float:
+        return self.function() if self.function else self.value
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels)} {_format_value(self.get())}"]
+
+class Gauge(Metric):
+    """可增可减的瞬时值，也可以绑定一个在导出时才求值的函数"""
+    metric_type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Optional[Dict[str, str]] = None,
+        function: Optional[Callable[[], float]] = None
+    ):
+        super().__init__(name, documentation, labels)
+        self.value = 0.0
+        self.function = function
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def get(self) -> float:
+        return self.function() if self.function else self.value
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels)} {_format_value(self.get())}"]
+
+class Histogram(Metric):
+    """固定分桶的直方图"""
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Optional[Dict[str, str]] = None,
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            labels = dict(self.labels, le=_format_value(bound))
+            lines.append(f"{self.name}_bucket{_format_labels(labels)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels)} {_format_value(self.sum)}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels)} {self.count}")
+        return lines
+
+class LatencyWindow:
+    """最近size个观测值的滑动窗口，用于在客户端估计延迟分位数"""
+
+    def __init__(self, size: int = 500):
+        self.values = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def observe(self, value: float):
+        self.values.append(value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """返回第q百分位数（最近秩法），窗口为空时返回None"""
+        if not self.values:
+            return None
+        ordered = sorted(self.values)
+        rank = max(1, math.ceil(q / 100 * len(ordered)))
+        return ordered[min(rank, len(ordered)) - 1]
+
+class MetricsRegistry:
+    """指标注册表，所有指标共享一组常量标签"""
+
+    def __init__(self, labels: Optional[Dict[str, str]] = None):
+        self.labels = labels or {}
+        self.metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"指标已注册: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self,
+        name: str,
+        documentation: str,
+        function: Optional[Callable[[], float]] = None
+    ) -> Counter:
+        return self._register(Counter(name, documentation, self.labels, function))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        function: Optional[Callable[[], float]] = None
+    ) -> Gauge:
+        return self._register(Gauge(name, documentation, self.labels, function))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, self.labels, buckets))
+
+    def render(self) -> str:
+        """导出为Prometheus文本格式"""
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+自动扩缩容测试：用构造的负载、设备清单和放置需求驱动Autoscaler.plan()，以及配置重新加载后的apply()
+"""
+
+import asyncio
+import json
+import os
+import threading
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import pytest
+
+from vllm.src.services import placement
+from vllm.src.services.autoscaler import Autoscaler, ScalingAction, ServerLoad
+from vllm.src.services.placement import PlacementPlanner, ServerSpec
+from vllm.src.services.server_manager import ServerManager
+from vllm.src.utils.config import Config
+
+NOW = 10000.0
+
+class StubManager:
+    """只提供plan()用到的部分：配置、设备清单和每个GPU条目的放置需求"""
+
+    def __init__(self, config: Config, inventory: Dict[str, Optional[float]], specs: Dict[str, ServerSpec]):
+        self.config = config
+        self.config_store = SimpleNamespace(subscribe=lambda callback: None)
+        self.planner = PlacementPlanner(inventory)
+        self.specs = specs
+
+    def placement_spec(self, gpu_id: str) -> ServerSpec:
+        return self.specs[gpu_id]
+
+def make_autoscaler(tmp_path, gpus: Dict[str, Dict], models: Dict[str, Dict],
+                    devices: int = 4) -> Autoscaler:
+    """gpus为gpu_id -> {"name", "utilization", "tp", "devices"}，每张卡80GB，模型14GB"""
+    config_gpus = {
+        gpu_id: {"model": f"models/{options['name']}", "name": options["name"], "port": 8000 + index}
+        for index, (gpu_id, options) in enumerate(gpus.items())
+    }
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({
+        "gpus": config_gpus,
+        "autoscaler": {"scale_up_cooldown": 60, "scale_down_cooldown": 300, "models": models}
+    }))
+    specs = {
+        gpu_id: ServerSpec(
+            gpu_id, 14,
+            tensor_parallel_size=options.get("tp", 1),
+            gpu_memory_utilization=options.get("utilization", 0.9),
+            devices=options.get("devices")
+        )
+        for gpu_id, options in gpus.items()
+    }
+    inventory = {str(index): 80.0 for index in range(devices)}
+    return Autoscaler(StubManager(Config(str(path)), inventory, specs))
+
+def summary(actions) -> List[tuple]:
+    return [(action.action, action.gpu_id) for action in actions]
+
+@pytest.fixture
+def single_model(tmp_path) -> Autoscaler:
+    """模型a有3个副本，各占一张卡，1-3个副本，每个副本目标负载8"""
+    gpus = {gpu_id: {"name": "a", "devices": [gpu_id]} for gpu_id in ("0", "1", "2")}
+    return make_autoscaler(tmp_path, gpus, {"a": {"min_replicas": 1, "max_replicas": 3, "target_load": 8}})
+
+def test_scale_up_to_load(single_model):
+    """负载20需要ceil(20/8)=3个副本，启动两个停止的副本"""
+    actions = single_model.plan({"0"}, {"0": ServerLoad(in_flight=12, waiting=8)}, {}, NOW)
+    assert summary(actions) == [("start", "1"), ("start", "2")]
+
+def test_scale_up_respects_cooldown(single_model):
+    """冷却期内不再扩容"""
+    single_model.last_scaled["a"] = NOW - 10
+    assert single_model.plan({"0"}, {"0": ServerLoad(in_flight=20)}, {}, NOW) == []
+
+    single_model.last_scaled["a"] = NOW - 61
+    assert summary(single_model.plan({"0"}, {"0": ServerLoad(in_flight=20)}, {}, NOW))[0] == ("start", "1")
+
+def test_below_min_replicas_ignores_cooldown(single_model):
+    """低于最小副本数时不受冷却限制"""
+    single_model.last_scaled["a"] = NOW
+    assert summary(single_model.plan(set(), {}, {}, NOW)) == [("start", "0")]
+
+def test_scale_down_one_replica_per_cycle(single_model):
+    """负载低于目标时每个周期只停一个负载最低的副本，冷却期内不缩容"""
+    loads = {"0": ServerLoad(in_flight=3), "1": ServerLoad(in_flight=1), "2": ServerLoad(in_flight=2)}
+    assert summary(single_model.plan({"0", "1", "2"}, loads, {}, NOW)) == [("stop", "1")]
+
+    single_model.last_scaled["a"] = NOW - 100
+    assert single_model.plan({"0", "1", "2"}, loads, {}, NOW) == []
+
+def test_scale_to_zero_waits_for_idle_timeout(tmp_path):
+    """min_replicas为0的模型空闲超过idle_timeout才缩容到0"""
+    autoscaler = make_autoscaler(
+        tmp_path, {"0": {"name": "a", "devices": ["0"]}},
+        {"a": {"min_replicas": 0, "max_replicas": 1, "idle_timeout": 600}}
+    )
+    autoscaler.last_active["a"] = NOW - 300
+    assert autoscaler.plan({"0"}, {"0": ServerLoad()}, {}, NOW) == []
+
+    autoscaler.last_active["a"] = NOW - 600
+    assert summary(autoscaler.plan({"0"}, {"0": ServerLoad()}, {}, NOW)) == [("stop", "0")]
+
+def test_demand_starts_model_at_zero(tmp_path):
+    """缩容到0的模型在网关有无法服务的请求时启动一个副本"""
+    autoscaler = make_autoscaler(
+        tmp_path, {"0": {"name": "a", "devices": ["0"]}, "1": {"name": "a", "devices": ["1"]}},
+        {"a": {"min_replicas": 0, "max_replicas": 2}}
+    )
+    assert summary(autoscaler.plan(set(), {}, {"a": 3}, NOW)) == [("start", "0")]
+
+def make_eviction(tmp_path, busy_tp: int = 1, idle_min: int = 1) -> Autoscaler:
+    """三张卡各跑一个空闲模型idle的副本，繁忙模型busy的副本未固定设备、暂时放不下"""
+    gpus = {f"i{index}": {"name": "idle", "devices": [str(index)]} for index in range(3)}
+    gpus["b0"] = {"name": "busy", "tp": busy_tp}
+    autoscaler = make_autoscaler(tmp_path, gpus, {
+        "idle": {"min_replicas": idle_min, "max_replicas": 3, "idle_timeout": 600},
+        "busy": {"min_replicas": 0, "max_replicas": 1}
+    }, devices=3)
+    # idle刚缩容过，本周期不会自己缩容；它已空闲超过idle_timeout，可以被驱逐
+    autoscaler.last_scaled["idle"] = NOW
+    autoscaler.last_active["idle"] = NOW - 1000
+    return autoscaler
+
+def test_idle_eviction_stops_only_what_is_needed(tmp_path):
+    """一张卡就够时只驱逐一个空闲副本"""
+    autoscaler = make_eviction(tmp_path)
+    actions = autoscaler.plan({"i0", "i1", "i2"}, {}, {"busy": 5}, NOW)
+    assert summary(actions) == [("stop", "i0"), ("start", "b0")]
+
+def test_idle_eviction_for_tensor_parallel(tmp_path):
+    """TP=2的副本需要两张卡，驱逐两个空闲副本"""
+    autoscaler = make_eviction(tmp_path, busy_tp=2)
+    actions = autoscaler.plan({"i0", "i1", "i2"}, {}, {"busy": 5}, NOW)
+    assert summary(actions) == [("stop", "i0"), ("stop", "i1"), ("start", "b0")]
+
+def test_eviction_keeps_min_replicas(tmp_path):
+    """驱逐不能让空闲模型低于最小副本数，腾不出足够的卡时什么都不做"""
+    autoscaler = make_eviction(tmp_path, busy_tp=2, idle_min=2)
+    assert autoscaler.plan({"i0", "i1", "i2"}, {}, {"busy": 5}, NOW) == []
+
+def test_active_model_is_not_evicted(tmp_path):
+    """最近有请求的模型不会被驱逐"""
+    autoscaler = make_eviction(tmp_path)
+    autoscaler.last_active["idle"] = NOW - 10
+    assert autoscaler.plan({"i0", "i1", "i2"}, {}, {"busy": 5}, NOW) == []
+
+class RecordingManager(ServerManager):
+    """真实的配置重新加载和设备分配，只记录启动和停止而不启动进程"""
+
+    def __init__(self, config_path: str):
+        super().__init__(config_path)
+        self.started: Dict[str, List[str]] = {}
+        self.stopped: List[str] = []
+
+    def start_server(self, gpu_id: str, devices: Optional[List[str]] = None) -> bool:
+        self.started[gpu_id] = devices or self.assign_devices([gpu_id])[gpu_id]
+        self.desired.add(gpu_id)
+        return True
+
+    async def wait_until_ready(self, gpu_id: str, timeout: Optional[float] = None) -> bool:
+        return True
+
+    async def drain_server(self, gpu_id: str, timeout: Optional[float] = None) -> Optional[int]:
+        return None
+
+    async def stop_server_async(self, gpu_id: str) -> bool:
+        self.stopped.append(gpu_id)
+        self.desired.discard(gpu_id)
+        return True
+
+def write_config(path, gpus: Dict[str, str]):
+    """gpus为gpu_id -> 模型名，模型目录不存在，大小由放置需求按目录估计"""
+    path.write_text(json.dumps({
+        "gpus": {
+            gpu_id: {"model": str(path.parent / name), "name": name, "port": 8000 + int(gpu_id)}
+            for gpu_id, name in gpus.items()
+        },
+        "placement": {"devices": {"0": 80, "1": 80}},
+        "autoscaler": {"models": {name: {"min_replicas": 1, "max_replicas": 1} for name in gpus.values()}}
+    }))
+
+def test_apply_after_reload_loads_placement_off_loop(tmp_path, monkeypatch):
+    """配置重新加载清空放置缓存后，apply()在线程中重新读取设备清单和模型大小，再按新配置启动和停止"""
+    threads = []
+
+    def recording(function):
+        def wrapper(*args):
+            threads.append(threading.get_ident())
+            return function(*args)
+        return wrapper
+
+    monkeypatch.setattr(placement, "load_inventory", recording(placement.load_inventory))
+    monkeypatch.setattr(placement, "estimate_model_size", recording(placement.estimate_model_size))
+    path = tmp_path / "config.json"
+    write_config(path, {"0": "a"})
+    manager = RecordingManager(str(path))
+    manager.desired.add("0")
+    autoscaler = Autoscaler(manager)
+
+    async def collect(now: float):
+        return {gpu_id: ServerLoad() for gpu_id in manager.desired}, {}
+
+    autoscaler.collect = collect
+
+    async def run():
+        assert await autoscaler.step() == []
+
+        # 换成模型b：订阅者换上新快照、清空放置缓存并重建扩缩容策略
+        write_config(path, {"0": "a", "1": "b"})
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        assert manager.config_store.check()
+        assert "b" in autoscaler.policies
+        assert manager._planner is None and not manager._specs
+
+        await autoscaler.apply([
+            ScalingAction("stop", "0", "a", "test"),
+            ScalingAction("start", "1", "b", "test")
+        ], NOW)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert manager.stopped == ["0"]
+    assert manager.started == {"1": ["1"]}
+    assert autoscaler.last_scaled == {"a": NOW, "b": NOW}
+    # 重新加载前后各读取一次设备清单，都不在事件循环线程上
+    assert len(threads) >= 4
+    assert loop_thread not in threads
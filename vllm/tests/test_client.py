@@ -82,6 +82,33 @@ async def test_generate_text(
     except Exception as e:
         logger.error(f"文本生成失败: {e}")
 
+async def test_generate_stream(
+    manager: VLLMClientManager,
+    prompt: str,
+    gpu_id: Optional[str] = None,
+    model_preference: Optional[List[str]] = None,
+    max_tokens: int = 2048,
+    temperature: float = 0.7
+):
+    """测试流式文本生成，边生成边打印"""
+    print("-" * 50)
+    
+    try:
+        async for delta in manager.generate_stream(
+            prompt=prompt,
+            gpu_id=gpu_id,
+            model_preference=model_preference,
+            max_tokens=max_tokens,
+            temperature=temperature
+        ):
+            print(delta, end="", flush=True)
+        print()
+        print("-" * 50)
+        
+    except Exception as e:
+        print()
+        logger.error(f"流式生成失败: {e}")
+
 async def interactive_mode(manager: VLLMClientManager):
     """交互模式"""
     print("\n=== 交互模式 ===")
@@ -125,7 +152,7 @@ async def interactive_mode(manager: VLLMClientManager):
                 print("已切换到自动选择模式")
                 
             elif user_input:
-                await test_generate_text(manager, user_input, current_gpu)
+                await test_generate_stream(manager, user_input, current_gpu)
                 
         except KeyboardInterrupt:
             print("\n退出交互模式")
@@ -185,6 +212,8 @@ async def main():
             
     except Exception as e:
         logger.error(f"操作失败: {e}")
+    finally:
+        await manager.close()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+引擎中止测试：FakeEngine的abort_raises像vLLM一样以CancelledError结束被中止的结果流
+"""
+
+import asyncio
+import json
+
+import httpx
+
+from vllm.src.services.engines import FakeEngine
+from vllm.src.services.vllm_server import VLLMServer
+
+FAKE_OPTIONS = {"prefill_delay": 0.01, "decode_rate": 50, "abort_raises": True}
+
+async def collect_until_abort(engine: FakeEngine, request_id: str, abort_after: int):
+    outputs = []
+    async for output in engine.generate("a b c", {"max_tokens": 100}, request_id):
+        outputs.append(output)
+        if len(outputs) == abort_after:
+            await engine.abort(request_id)
+    return outputs
+
+def test_abort_ends_stream_without_error():
+    """被中止的请求像流正常结束一样返回，最后一个输出未完成"""
+    async def run():
+        engine = FakeEngine({"fake_engine": FAKE_OPTIONS})
+        await engine.start()
+        outputs = await collect_until_abort(engine, "r1", abort_after=3)
+        return engine, outputs
+
+    engine, outputs = asyncio.run(run())
+    assert len(outputs) == 3
+    assert not outputs[-1].finished
+    assert engine.get_stats()["running"] == 0
+    assert not engine._active and not engine._aborted
+
+def test_task_cancellation_still_propagates():
+    """消费结果流的任务本身被取消时仍然抛出CancelledError，不被当成中止"""
+    async def run():
+        engine = FakeEngine({"fake_engine": FAKE_OPTIONS})
+        await engine.start()
+        task = asyncio.ensure_future(collect_until_abort(engine, "r1", abort_after=1000))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return engine, True
+        return engine, False
+
+    engine, cancelled = asyncio.run(run())
+    assert cancelled
+    assert engine.get_stats()["running"] == 0
+
+def test_deadline_abort_returns_504(tmp_path, monkeypatch):
+    """请求超过截止时间被中止时服务器返回504并计入vllm_requests_aborted_total，而不是500"""
+    # VLLMServer会设置CUDA_VISIBLE_DEVICES，测试结束后恢复
+    monkeypatch.setenv("CUDA_VISIBLE_DEVICES", "")
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"gpus": {"0": {
+        "model": "models/fake-7b", "port": 18000, "description": "Fake 7B", "engine": "fake",
+        "fake_engine": FAKE_OPTIONS
+    }}}))
+
+    async def run():
+        server = VLLMServer("0", str(path))
+        await server.load_model()
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/generate", json={"prompt": "a b c", "max_tokens": 100, "timeout": 0.2})
+        return server, response
+
+    server, response = asyncio.run(run())
+    assert response.status_code == 504
+    assert server.requests_aborted_total.get() == 1
+    assert server.request_errors_total.get() == 0
+    assert server.admission.in_flight == 0
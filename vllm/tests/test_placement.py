@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+放置规划器测试：用构造的设备清单验证张量并行打包、超额分配和固定设备
+"""
+
+import json
+
+import pytest
+
+from vllm.src.services.placement import PlacementError, PlacementPlanner, ServerSpec, server_spec
+from vllm.src.utils.config import Config
+
+def make_planner(count: int = 8, memory: float = 80.0) -> PlacementPlanner:
+    return PlacementPlanner({str(index): memory for index in range(count)})
+
+def test_tensor_parallel_gets_whole_devices():
+    """TP=4的大模型拿到四张整卡，小模型密集地挤在剩下的卡上"""
+    specs = [ServerSpec("70b", 140, tensor_parallel_size=4, gpu_memory_utilization=0.9)]
+    specs += [ServerSpec(f"7b-{index}", 14, gpu_memory_utilization=0.3) for index in range(6)]
+    placements = make_planner().plan(specs)
+
+    assert placements["70b"].devices == ["0", "1", "2", "3"]
+    small_devices = [placements[f"7b-{index}"].devices[0] for index in range(6)]
+    assert set(small_devices).isdisjoint(placements["70b"].devices)
+    # 每张卡最多放3个利用率0.3的服务器，6个只占两张卡
+    assert len(set(small_devices)) == 2
+
+def test_ports_follow_entry_order():
+    """未固定的端口按条目顺序从base_port起分配，跳过已固定的端口"""
+    specs = [
+        ServerSpec("a", 14, gpu_memory_utilization=0.3),
+        ServerSpec("b", 14, gpu_memory_utilization=0.3, port=8001),
+        ServerSpec("c", 14, gpu_memory_utilization=0.3)
+    ]
+    placements = make_planner().plan(specs)
+    assert [placements[gpu_id].port for gpu_id in "abc"] == [8000, 8001, 8002]
+
+def test_oversubscribed_device_raises():
+    """固定在同一张卡上、利用率之和超过max_utilization的条目无法同时运行"""
+    specs = [
+        ServerSpec("a", 14, gpu_memory_utilization=0.6, devices=["0"]),
+        ServerSpec("b", 14, gpu_memory_utilization=0.6, devices=["0"])
+    ]
+    with pytest.raises(PlacementError, match="超额分配"):
+        make_planner().check(specs)
+
+def test_not_enough_devices_raises():
+    """剩余容量足够的卡少于tensor_parallel_size时无法放置"""
+    specs = [
+        ServerSpec("a", 140, tensor_parallel_size=4, gpu_memory_utilization=0.9),
+        ServerSpec("b", 140, tensor_parallel_size=2, gpu_memory_utilization=0.9)
+    ]
+    with pytest.raises(PlacementError, match="需要2张卡"):
+        make_planner(count=5).plan(specs)
+
+def test_shard_larger_than_device_raises():
+    """分片加KV缓存余量放不进卡的预留显存时无法放置"""
+    with pytest.raises(PlacementError, match="只有0张卡"):
+        make_planner(count=1, memory=24.0).plan([ServerSpec("big", 140, gpu_memory_utilization=0.9)])
+
+def test_devices_must_match_tensor_parallel_size():
+    """固定的devices数量必须与tensor_parallel_size一致"""
+    spec = ServerSpec("a", 14, tensor_parallel_size=2, devices=["0"])
+    with pytest.raises(PlacementError, match="不一致"):
+        make_planner().plan([spec])
+
+def test_pinned_devices_are_kept():
+    """固定了devices的条目留在原处，未固定的条目避开已用满的卡"""
+    specs = [
+        ServerSpec("pinned", 14, gpu_memory_utilization=0.9, devices=["1"]),
+        ServerSpec("free", 14, gpu_memory_utilization=0.9)
+    ]
+    placements = make_planner(count=2).plan(specs)
+    assert placements["pinned"].devices == ["1"]
+    assert placements["free"].devices == ["0"]
+
+def test_unpinned_tensor_parallel_fills_around_pinned():
+    """未固定的TP=2条目与固定的条目共用部分占用的卡，设备按清单顺序返回"""
+    specs = [
+        ServerSpec("pinned", 5, gpu_memory_utilization=0.4, devices=["1"]),
+        ServerSpec("tp2", 20, tensor_parallel_size=2, gpu_memory_utilization=0.5)
+    ]
+    placements = make_planner(count=4, memory=40.0).plan(specs)
+    assert placements["tp2"].devices == ["0", "1"]
+
+def test_unknown_device_raises():
+    """固定到清单之外的设备时报错"""
+    with pytest.raises(PlacementError, match="不在设备清单中"):
+        make_planner(count=2).check([ServerSpec("a", 14, devices=["7"])])
+
+def test_server_spec_pins_only_configured_devices(tmp_path):
+    """配置了devices的条目固定在这些设备上，其余条目的devices留给规划器"""
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"gpus": {
+        "0": {"model": "models/a", "port": 8000, "model_size_gb": 14, "tensor_parallel_size": 2},
+        "1": {"model": "models/b", "port": 8001, "model_size_gb": 14, "devices": [3]}
+    }}))
+    config = Config(str(path))
+
+    unpinned = server_spec(config, "0")
+    assert unpinned.devices is None
+    assert unpinned.preferred == ["0"]
+    assert (unpinned.tensor_parallel_size, unpinned.port, unpinned.size_gb) == (2, 8000, 14)
+    assert server_spec(config, "1").devices == ["3"]
+
+    placements = make_planner(count=4).plan([unpinned, server_spec(config, "1")])
+    assert len(placements["0"].devices) == 2
+    assert placements["1"].devices == ["3"]
+
+def test_preferred_devices_are_kept_without_conflict():
+    """未固定设备的条目留在首选设备上，不会被密集打包挪到别的卡"""
+    specs = [
+        ServerSpec(gpu_id, 14, gpu_memory_utilization=0.3, preferred=[gpu_id])
+        for gpu_id in ("3", "5", "6")
+    ]
+    placements = make_planner().plan(specs)
+    assert {gpu_id: placements[gpu_id].devices for gpu_id in ("3", "5", "6")} == {
+        "3": ["3"], "5": ["5"], "6": ["6"]
+    }
+
+def test_preferred_devices_move_on_conflict():
+    """首选设备已被占满或数量与tensor_parallel_size不符时由规划器另选"""
+    specs = [
+        ServerSpec("pinned", 14, gpu_memory_utilization=0.9, devices=["0"]),
+        ServerSpec("0", 14, gpu_memory_utilization=0.9, preferred=["0"]),
+        ServerSpec("1", 14, tensor_parallel_size=2, gpu_memory_utilization=0.9, preferred=["1"])
+    ]
+    placements = make_planner(count=4).plan(specs)
+    assert placements["0"].devices != ["0"]
+    assert len(placements["1"].devices) == 2
+    assert "0" not in placements["1"].devices